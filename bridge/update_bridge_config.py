@@ -1,11 +1,19 @@
 #!/usr/bin/python3
 
+import json
 import os
-import re
 import sys
 import uuid
 import subprocess
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from compose import PROFILES as COMPOSE_PROFILES, render_compose
+from render import RenderError, dumps, render_text
+from dns_tuning import apply_dns, resolve_hosts
+from transport import DEFAULT_PATHS, TRANSPORTS, set_transport
+from tuning import PROFILES, apply_mux, apply_profile
+from upstream_probe import apply_balancer, print_results, probe
+
 def print_banner():
     banner = """
 -----------------------------------------------------------
@@ -54,15 +62,14 @@ def save_file(content, file_path):
         sys.exit(1)
 
 def update_config(content, upstream_uuid, bridge_uuid, outbound_domain, deployment_mode):
-    # Replace placeholders with user-supplied values
-    content = re.sub(r'<UPSTREAM-UUID>', upstream_uuid, content)
-    content = re.sub(r'<BRIDGE-UUID>', bridge_uuid, content)
-    content = re.sub(r'<DEPLOYMENT-MODE>', deployment_mode, content)
-    if deployment_mode == "direct":
-        content = re.sub(r'<OUTBOUND-DOMAIN>', "", content)
-    else:
-        content = re.sub(r'<OUTBOUND-DOMAIN>', outbound_domain, content)
-    return content
+    # Fill all placeholders in one pass over the cached template slots
+    values = {
+        'UPSTREAM-UUID': upstream_uuid,
+        'BRIDGE-UUID': bridge_uuid,
+        'DEPLOYMENT-MODE': deployment_mode,
+        'OUTBOUND-DOMAIN': "" if deployment_mode == "direct" else outbound_domain,
+    }
+    return render_text(content, values)
 
 def prompt_uuid(label):
     while True:
@@ -80,7 +87,18 @@ def prompt_uuid(label):
             print("Invalid UUID format. Please try again.")
 
 def prompt_outbound_domain():
-    return get_input("Enter the outbound domain (e.g., usnode1.example.com)")
+    response = get_input("Enter the outbound domain, or several separated by commas "
+                         "(e.g., usnode1.example.com,usnode2.example.com)")
+    return [domain.strip() for domain in (response or "").split(",") if domain.strip()]
+
+def rank_upstreams(domains):
+    print(f">> Probing {len(domains)} upstreams (TCP connect + TLS handshake)...")
+    results = probe(domains)
+    print_results(results)
+    if not any(result['samples'] for result in results):
+        print(">> Warning: no upstream answered; keeping the given order.")
+        return domains
+    return [result['target'] for result in results]
 
 def prompt_deployment_mode():
     print("\nDeployment Mode Options:")
@@ -98,6 +116,52 @@ def prompt_deployment_mode():
         else:
             print("Invalid selection. Please enter 1, 2, or 3.")
 
+def prompt_tuning_profile():
+    names = sorted(PROFILES)
+    print("\nTuning Profile Options:")
+    print("  0. None (Xray defaults)")
+    for number, name in enumerate(names, 1):
+        print(f"  {number}. {name}")
+    while True:
+        choice = get_input("Select tuning profile", "0")
+        if choice == "0":
+            return None
+        if choice.isdigit() and 1 <= int(choice) <= len(names):
+            return names[int(choice) - 1]
+        print(f"Invalid selection. Please enter a number from 0 to {len(names)}.")
+
+def prompt_transport():
+    # Must match the upstream's inbound (update_upstream_config.py asks the same).
+    while True:
+        transport = get_input(f"Transport to the upstream ({'/'.join(TRANSPORTS)})", "ws").lower()
+        if transport in TRANSPORTS:
+            break
+        print(f"Invalid transport. Please enter one of: {', '.join(TRANSPORTS)}.")
+    label = "gRPC service name" if transport == "grpc" else "Path"
+    return transport, get_input(label, DEFAULT_PATHS[transport])
+
+def prompt_mux():
+    # Returns (concurrency, xudpConcurrency) or None when mux stays off.
+    if not yes_no_input("Multiplex client connections over the upstream link (mux/XUDP)?", "n"):
+        return None
+    while True:
+        concurrency = get_input("Max TCP streams per upstream connection (-1 keeps TCP off mux)", "8")
+        xudp_concurrency = get_input("Max UDP (XUDP) streams per upstream connection (-1 keeps UDP off mux)", "16")
+        try:
+            return int(concurrency), int(xudp_concurrency)
+        except ValueError:
+            print("Please enter whole numbers.")
+
+def prompt_pinned_hosts(domains):
+    # Pinned upstreams skip DNS on connect; they must be re-pinned if the IPs change.
+    if not domains or not yes_no_input("Pin the upstream domain(s) to their current IPs in dns.hosts?", "n"):
+        return None
+    hosts = resolve_hosts(domains)
+    for domain in domains:
+        if domain not in hosts:
+            print(f">> Warning: Could not resolve {domain}; not pinned.")
+    return hosts
+
 def update_config_file(config_path):
     print("\n[Step 1] Updating Xray configuration file...")
     content = load_file(config_path)
@@ -108,7 +172,10 @@ def update_config_file(config_path):
         common_uuid = prompt_uuid("common")
         upstream_uuid = common_uuid
         bridge_uuid = common_uuid
-        outbound_domain = ""
+        outbound_domains = []
+        transport = None
+        mux = None
+        hosts = None
     else:
         if yes_no_input("Use the same UUID for both upstream and bridge?"):
             common_uuid = prompt_uuid("common")
@@ -117,24 +184,74 @@ def update_config_file(config_path):
         else:
             upstream_uuid = prompt_uuid("upstream")
             bridge_uuid = prompt_uuid("bridge")
-        outbound_domain = prompt_outbound_domain()
+        outbound_domains = prompt_outbound_domain()
+        if len(outbound_domains) > 1:
+            outbound_domains = rank_upstreams(outbound_domains)
+        transport = prompt_transport()
+        mux = prompt_mux()
+        hosts = prompt_pinned_hosts(outbound_domains)
+    outbound_domain = outbound_domains[0] if outbound_domains else ""
+    profile = prompt_tuning_profile()
     
-    updated_content = update_config(content, upstream_uuid, bridge_uuid, outbound_domain, deployment_mode)
+    try:
+        updated_content = update_config(content, upstream_uuid, bridge_uuid, outbound_domain, deployment_mode)
+    except RenderError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    if transport == ("ws", DEFAULT_PATHS["ws"]):
+        transport = None
+    config = json.loads(updated_content)
+    if transport:
+        set_transport(config, *transport)
+        print(f">> Upstream transport set to {transport[0]} ({transport[1]}).")
+    if len(outbound_domains) > 1:
+        # One outbound per upstream, fastest first, behind a leastPing balancer
+        apply_balancer(config, outbound_domains)
+        print(f">> Balancer configured with upstreams: {', '.join(outbound_domains)}")
+    if mux:
+        apply_mux(config, *mux)
+        print(f">> Mux enabled (concurrency {mux[0]}, xudpConcurrency {mux[1]}).")
+    if profile:
+        apply_profile(config, profile)
+        print(f">> Applied the {profile} tuning profile.")
+    apply_dns(config, hosts)
+    print(f">> DNS section written{' with pinned upstream hosts' if hosts else ''}.")
+    updated_content = dumps(config)
     save_file(updated_content, config_path)
     print(">> Xray configuration updated successfully.\n")
 
-def update_docker_compose_file():
+def prompt_compose_profile():
+    names = list(COMPOSE_PROFILES)
+    print("\nDocker Compose Profile Options:")
+    print("  0. None (published ports through docker-proxy, Docker defaults)")
+    print("  1. performance (network_mode host, raised nofile limit, non-blocking logs)")
+    print("  2. published (ports via iptables only, nofile limit, sysctls, non-blocking logs)")
+    while True:
+        choice = get_input("Select Docker Compose profile", "0")
+        if choice == "0":
+            return None
+        if choice.isdigit() and 1 <= int(choice) <= len(names):
+            return names[int(choice) - 1]
+        print("Invalid selection. Please try again.")
+
+def update_docker_compose_file(config_path):
     print("[Step 2] Updating Docker Compose configuration (removing Caddy)...")
     dc_file = './docker-compose.yml'
-    content = load_file(dc_file)
-    # Remove any Caddy service configuration block.
-    content = re.sub(
-        r'caddy:.*depends_on:.*- xray.*ports:.*- "80:80".*- "443:443".*volumes:.*',
-        '',
-        content,
-        flags=re.DOTALL
-    )
+    profile = prompt_compose_profile()
+    config = json.loads(load_file(config_path))
+    try:
+        content, moved = render_compose(load_file(dc_file), profile, config, drop=['caddy'])
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
     save_file(content, dc_file)
+    if moved:
+        # Host networking: the API inbound must not listen on every interface.
+        save_file(dumps(config), config_path)
+        print(f">> Inbounds now listening on 127.0.0.1 only: {', '.join(map(str, moved))}")
+    if profile == 'published':
+        print('>> Set "userland-proxy": false in /etc/docker/daemon.json and restart Docker '
+              'so published ports skip docker-proxy.')
     print(">> Docker Compose file updated successfully.\n")
 
 def install_certbot():
@@ -149,7 +266,7 @@ def install_certbot():
 
 def obtain_certificate_certbot(domain):
     print(f"[SSL] Issuing certificate for '{domain}' using Certbot...")
-    run_command(f"sudo certbot --nginx -d {domain}")
+    run_command(f"sudo certbot --nginx --key-type ecdsa --elliptic-curve secp256r1 -d {domain}")
 
 def install_certificate_certbot(domain, install_folder):
     fullchain_src = f"/etc/letsencrypt/live/{domain}/fullchain.pem"
@@ -193,7 +310,7 @@ def obtain_certificate_acme_sh(domain):
 def install_certificate_acme_sh(domain, install_folder):
     fullchain_path = os.path.join(install_folder, "xray.crt")
     key_path = os.path.join(install_folder, "xray.key")
-    cmd = f"sudo ~/.acme.sh/acme.sh --installcert -d {domain} --fullchainpath {fullchain_path} --keypath {key_path}"
+    cmd = f"sudo ~/.acme.sh/acme.sh --installcert -d {domain} --ecc --fullchainpath {fullchain_path} --keypath {key_path}"
     run_command(cmd)
 
 def run_command(command):
@@ -211,7 +328,7 @@ def main():
     update_config_file(config_path)
     
     # Step 2: Update docker-compose file (remove Caddy service)
-    update_docker_compose_file()
+    update_docker_compose_file(config_path)
     
     # Step 3: SSL certificate issuance (optional)
     if yes_no_input("Do you want to install SSL certificates?", "y"):
@@ -39,8 +39,13 @@ def update_vless_subscription(vless_url):
         f.write(vless_url)
 
 
-bridge_config = load_config('bridge/xray/config.json')
-upstream_config = load_config('upstream/xray/config.json')
+def main():
+    bridge_config = load_config('bridge/xray/config.json')
+    upstream_config = load_config('upstream/xray/config.json')
 
-vless_url = generate_vless_url(bridge_config, upstream_config)
-update_vless_subscription(vless_url)
+    vless_url = generate_vless_url(bridge_config, upstream_config)
+    update_vless_subscription(vless_url)
+
+
+if __name__ == "__main__":
+    main()
@@ -74,8 +74,7 @@ cat << EOF > $xray_config_path/config.json
                             ]
                         }
                     ],
-                    "sessionTicket": true,
-                    "sessionTicketKeyFile": "/etc/xray/session_ticket.key",
+                    "enableSessionResumption": true,
                     "fallbacks": [
                         {
                             "dest": 80
@@ -128,10 +127,7 @@ EOF
 
 
 # Create self-signed Xray TLS certificate
-openssl req -newkey rsa:2048 -nodes -keyout $xray_config_path/xray.key -x509 -days 365 -out $xray_config_path/xray.crt -subj "/C=US/ST=California/L=San Francisco/O=Example Corp/OU=IT Department/CN=$domain"
-
-# Create session ticket encryption key
-openssl rand -hex 48 > $xray_config_path/session_ticket.key
+openssl req -newkey ec -pkeyopt ec_paramgen_curve:prime256v1 -nodes -keyout $xray_config_path/xray.key -x509 -days 365 -out $xray_config_path/xray.crt -subj "/C=US/ST=California/L=San Francisco/O=Example Corp/OU=IT Department/CN=$domain"
 
 # Create docker-compose.yaml file
 # Create docker-compose.yaml file
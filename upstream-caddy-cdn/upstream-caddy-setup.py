@@ -1,10 +1,16 @@
 #!/usr/bin/python3
 
 import json
+import os
+import sys
 import uuid
 import base64
 from pathlib import Path
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from caddyfile import site
+from transport import TRANSPORTS, apply_transport, caddy_transport_block, caddy_tunnel_paths, set_transport
+
 # Function to set up the server
 
 
@@ -49,6 +55,14 @@ def setup_server():
     config['inbounds'][0]['settings']['fallbacks'][1]['path'] = websocket_path
     config['inbounds'][1]['streamSettings']['wsSettings']['path'] = websocket_path
 
+    # INPUT: TRANSPORT BETWEEN CADDY AND XRAY (grpc/h2/xhttp go over h2c)
+    transport = input(f"Transport ({'/'.join(TRANSPORTS)}): (Leave empty to use `ws`)\n").strip().lower() or 'ws'
+    if transport not in TRANSPORTS:
+        print(f"Unknown transport `{transport}`, using `ws`.")
+        transport = 'ws'
+    if transport != 'ws':
+        set_transport(config, transport, websocket_path, side='inbound')
+
     # SET CERTIFICATE AND KEY PATHS
     cert_path = f"/data/caddy/certificates/acme-v02.api.letsencrypt.org-directory/{domain}"
     config['inbounds'][0]['streamSettings']['tlsSettings'][
@@ -60,25 +74,12 @@ def setup_server():
     content = json.dumps(config, indent=2)
     open(str(path), 'w', encoding='utf-8').write(content)
 
-    # Update Caddyfile with domain
+    # Update Caddyfile with domain; the tunnel path streams to Xray
+    # uncompressed (grpc/h2/xhttp over h2c on 1311, ws on 1310).
     caddyfile_path = Path(__file__).parent.joinpath('caddy/Caddyfile')
-    caddyfile_content = f"{domain} {{\n"
-    caddyfile_content += "  root * /usr/share/caddy\n\n"
-    caddyfile_content += "  @websockets {\n"
-    caddyfile_content += "    header Connection *Upgrade*\n"
-    caddyfile_content += "    header Upgrade    websocket\n"
-    caddyfile_content += "  }\n\n"
-    caddyfile_content += f"  reverse_proxy @websockets xray:1310{websocket_path}\n\n"
-    caddyfile_content += "  route {\n"
-    caddyfile_content += f"    reverse_proxy {websocket_path} xray:1310\n"
-    caddyfile_content += "    file_server\n"
-    caddyfile_content += "  }\n\n"
-    caddyfile_content += "  log {\n"
-    caddyfile_content += "output stdout\n"
-    caddyfile_content += "  }\n"
-    caddyfile_content += "}"
-    # Create the directory if it doesn't exist
-#    caddyfile_path.parent.mkdir(parents=True, exist_ok=True)
+    upstream = 'xray:1310' if transport == 'ws' else 'xray:1311'
+    caddyfile_content = site(domain, [caddy_transport_block(transport, websocket_path, upstream)],
+                             caddy_tunnel_paths(transport, websocket_path))
     with open(str(caddyfile_path), 'w', encoding='utf-8') as caddyfile:
         caddyfile.write(caddyfile_content)
 
@@ -120,7 +121,8 @@ def setup_server():
                     "network": "ws",
                     "security": "tls",
                     "tlsSettings": {
-                        "serverName": domain
+                        "serverName": domain,
+                        "enableSessionResumption": True
                     },
                     "wsSettings": {
                         "path": websocket_path
@@ -130,6 +132,9 @@ def setup_server():
         ]
     }
 
+    if transport != 'ws':
+        apply_transport(client_config['outbounds'][0], transport, websocket_path)
+
     # Save client configuration to a file
     client_config_path = Path(__file__).parent.joinpath(
         f'./xray/client_configs/{domain}_client_config.json')
@@ -6,6 +6,10 @@ import subprocess
 import os
 import shutil
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from render import RenderError, dumps, render_text
+from transport import DEFAULT_PATHS, TRANSPORTS, set_transport
+
 
 def load_file(file_path):
     with open(file_path, 'r') as f:
@@ -18,7 +22,7 @@ def save_file(content, file_path):
 
 
 def update_upstream_config(config_str, new_uuid):
-    return re.sub(r'<UPSTREAM-UUID>', new_uuid, config_str)
+    return render_text(config_str, {'UPSTREAM-UUID': new_uuid})
 
 
 def prompt_uuid():
@@ -53,11 +57,37 @@ def update_upstream_config_file(config_path):
             print("Using the current UUID.")
             return
     new_uuid = prompt_uuid()
-    updated_config_str = update_upstream_config(config_str, new_uuid)
+    try:
+        updated_config_str = update_upstream_config(config_str, new_uuid)
+    except RenderError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
     save_file(updated_config_str, config_path)
     print("Upstream configuration updated successfully.")
 
 
+def prompt_transport():
+    # Must match the bridge's outbound (update_bridge_config.py asks the same).
+    while True:
+        transport = input(f"Transport from the bridge ({'/'.join(TRANSPORTS)}) [ws]: ").strip().lower() or 'ws'
+        if transport in TRANSPORTS:
+            break
+        print(f"Invalid transport. Please enter one of: {', '.join(TRANSPORTS)}.")
+    label = "gRPC service name" if transport == 'grpc' else "Path"
+    path = input(f"{label} [{DEFAULT_PATHS[transport]}]: ").strip() or DEFAULT_PATHS[transport]
+    return transport, path
+
+
+def update_transport(config_path):
+    transport, path = prompt_transport()
+    if (transport, path) == ('ws', DEFAULT_PATHS['ws']):
+        return
+    config = json.loads(load_file(config_path))
+    set_transport(config, transport, path, side='inbound')
+    save_file(dumps(config), config_path)
+    print(f"Inbound transport set to {transport} ({path}).")
+
+
 def run_command(command):
     process = subprocess.Popen(
         command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -89,7 +119,7 @@ def install_certbot():
 
 def obtain_certificate_certbot(domain):
     print(f"Obtaining SSL certificate for domain {domain}...")
-    run_command(f"sudo certbot --nginx -d {domain}")
+    run_command(f"sudo certbot --nginx --key-type ecdsa --elliptic-curve secp256r1 -d {domain}")
 
 
 def install_acme_sh():
@@ -114,7 +144,7 @@ def install_certificate_acme_sh(domain, config_path):
     fullchain_path = os.path.join(config_path, "xray.cer")
     key_path = os.path.join(config_path, "xray.key")
     run_command(
-        f"sudo ~/.acme.sh/acme.sh --installcert -d {domain} --fullchainpath {fullchain_path} --keypath {key_path}")
+        f"sudo ~/.acme.sh/acme.sh --installcert -d {domain} --ecc --fullchainpath {fullchain_path} --keypath {key_path}")
 
 
 def setup_auto_renewal_certbot():
@@ -144,6 +174,7 @@ def main():
     if not config_path:
         config_path = "./xray/config/config.json"
     update_upstream_config_file(config_path)
+    update_transport(config_path)
 
     install_certs = input(
         "Do you want to install SSL certificates? (yes/no): ").strip().lower()
@@ -0,0 +1,307 @@
+#!/usr/bin/python3
+
+import argparse
+import base64
+import gzip
+import json
+import os
+import re
+import sys
+import time
+import zlib
+from array import array
+from collections import Counter
+from pathlib import Path
+
+DEFAULT_LOG = './xray/logs/access.log'
+FINGERPRINT_BYTES = 4096
+
+# 2024/01/15 10:20:30 from 1.2.3.4:5678 accepted tcp:example.com:443 [vless-in >> direct] email: a@b
+LINE_RE = re.compile(
+    r'^\S+ \S+ (?:from )?(?:(?:tcp|udp):)?(?P<source>\S+) (?P<status>accepted|rejected) '
+    r'(?:(?P<network>tcp|udp):)?(?P<dest>\S+)'
+    r'(?: \[(?P<route>[^\]]*)\])?(?: email: (?P<email>\S+))?')
+
+
+class CountMinSketch:
+    # Fixed-size frequency estimates; memory does not grow with the key count.
+
+    def __init__(self, width=16384, depth=4, table=None):
+        self.width = width
+        self.depth = depth
+        self.table = table if table is not None else array('Q', bytes(8 * width * depth))
+        self.seeds = [(row * 0x9E3779B1) & 0xFFFFFFFF for row in range(depth)]
+
+    def _slots(self, key):
+        data = key.encode()
+        width = self.width
+        return [row * width + zlib.crc32(data, seed) % width for row, seed in enumerate(self.seeds)]
+
+    def add(self, key, count=1):
+        table = self.table
+        estimate = None
+        for slot in self._slots(key):
+            table[slot] += count
+            if estimate is None or table[slot] < estimate:
+                estimate = table[slot]
+        return estimate
+
+    def estimate(self, key):
+        return min(self.table[slot] for slot in self._slots(key))
+
+    def to_dict(self):
+        return {'width': self.width, 'depth': self.depth,
+                'table': base64.b64encode(zlib.compress(self.table.tobytes())).decode()}
+
+    @classmethod
+    def from_dict(cls, data):
+        table = array('Q')
+        table.frombytes(zlib.decompress(base64.b64decode(data['table'])))
+        return cls(data['width'], data['depth'], table)
+
+
+class TopK:
+    # Heavy hitters tracked on top of a count-min sketch. Candidates are pruned
+    # back to k whenever they reach 2k, so updates stay amortized O(1).
+
+    def __init__(self, k=100, sketch=None, candidates=None, floor=0):
+        self.k = k
+        self.sketch = sketch or CountMinSketch()
+        self.candidates = candidates or {}
+        self.floor = floor
+        self.total = 0
+
+    def add(self, key, count=1):
+        self.total += count
+        estimate = self.sketch.add(key, count)
+        candidates = self.candidates
+        if key in candidates:
+            candidates[key] = estimate
+        elif estimate > self.floor or len(candidates) < self.k:
+            candidates[key] = estimate
+            if len(candidates) >= 2 * self.k:
+                ranked = sorted(candidates.items(), key=lambda item: item[1], reverse=True)
+                self.candidates = dict(ranked[:self.k])
+                self.floor = ranked[self.k - 1][1]
+
+    def top(self, n=None):
+        ranked = sorted(((key, self.sketch.estimate(key)) for key in self.candidates),
+                        key=lambda item: item[1], reverse=True)
+        return ranked[:n or self.k]
+
+    def to_dict(self):
+        return {'k': self.k, 'total': self.total, 'floor': self.floor,
+                'sketch': self.sketch.to_dict(), 'candidates': self.candidates}
+
+    @classmethod
+    def from_dict(cls, data):
+        topk = cls(data['k'], CountMinSketch.from_dict(data['sketch']),
+                   data['candidates'], data['floor'])
+        topk.total = data['total']
+        return topk
+
+
+class Aggregator:
+
+    def __init__(self, k=100):
+        self.lines = 0
+        self.unparsed = 0
+        self.status = Counter()
+        self.outbounds = Counter()
+        self.users = TopK(k)
+        self.destinations = TopK(k)
+
+    def add(self, record):
+        self.lines += 1
+        if record is None:
+            self.unparsed += 1
+            return
+        self.status[record['status']] += 1
+        self.outbounds[record['outbound']] += 1
+        self.users.add(record['email'] or '-')
+        self.destinations.add(record['host'])
+
+    def to_dict(self):
+        return {
+            'lines': self.lines,
+            'unparsed': self.unparsed,
+            'status': self.status,
+            'outbounds': self.outbounds,
+            'users': self.users.to_dict(),
+            'destinations': self.destinations.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        aggregator = cls()
+        aggregator.lines = data['lines']
+        aggregator.unparsed = data['unparsed']
+        aggregator.status = Counter(data['status'])
+        aggregator.outbounds = Counter(data['outbounds'])
+        aggregator.users = TopK.from_dict(data['users'])
+        aggregator.destinations = TopK.from_dict(data['destinations'])
+        return aggregator
+
+
+def parse_line(line):
+    match = LINE_RE.match(line)
+    if not match:
+        return None
+    route = match.group('route') or ''
+    for separator in ('>>', '->'):
+        if separator in route:
+            route = route.split(separator, 1)[1]
+            break
+    dest = match.group('dest')
+    host = dest.rsplit(':', 1)[0] if dest.count(':') == 1 or dest.startswith('[') else dest
+    return {
+        'status': match.group('status'),
+        'network': match.group('network') or 'tcp',
+        'host': host.strip('[]'),
+        'outbound': route.strip() or '-',
+        'email': match.group('email'),
+    }
+
+
+def rotated_files(log_path):
+    # access.log.1, access.log.2.gz, ... oldest first, like logrotate leaves them.
+    log_path = Path(log_path)
+    pattern = re.compile(re.escape(log_path.name) + r'\.(\d+)(\.gz)?$')
+    found = []
+    if log_path.parent.is_dir():
+        for entry in log_path.parent.iterdir():
+            match = pattern.match(entry.name)
+            if match:
+                found.append((int(match.group(1)), entry))
+    return [entry for _, entry in sorted(found, reverse=True)]
+
+
+def open_log(path):
+    return gzip.open(path, 'rb') if str(path).endswith('.gz') else open(path, 'rb')
+
+
+def fingerprint(path):
+    # Files are identified by their first line (at most FINGERPRINT_BYTES of
+    # it), which survives logrotate's rename, copytruncate and compression
+    # alike. Only a first line still being written gives no fingerprint yet.
+    with open_log(path) as f:
+        first = f.readline(FINGERPRINT_BYTES)
+    if not first.endswith(b'\n') and len(first) < FINGERPRINT_BYTES:
+        return None
+    return f"{zlib.crc32(first):08x}:{len(first)}"
+
+
+def read_lines(path, offset=0):
+    # Yields (line, offset after the line); a trailing partial line is left
+    # for the next run.
+    with open_log(path) as f:
+        if offset:
+            f.seek(offset)
+        for raw in f:
+            if not raw.endswith(b'\n'):
+                break
+            offset += len(raw)
+            yield raw.decode('utf-8', 'replace'), offset
+
+
+class LogTailer:
+
+    def __init__(self, log_path, state_path, k=100):
+        self.log_path = Path(log_path)
+        self.state_path = Path(state_path)
+        self.files = {}
+        self.aggregator = Aggregator(k)
+        if self.state_path.exists():
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            self.files = state['files']
+            self.aggregator = Aggregator.from_dict(state['stats'])
+
+    def save(self):
+        state = {'files': self.files, 'stats': self.aggregator.to_dict()}
+        tmp_path = self.state_path.with_name(self.state_path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def pending(self):
+        paths = rotated_files(self.log_path)
+        if self.log_path.exists():
+            paths.append(self.log_path)
+        for path in paths:
+            key = fingerprint(path)
+            if key is not None:
+                yield path, key, self.files.get(key, 0)
+
+    def records(self, checkpoint_every=100000):
+        seen = {}
+        for path, key, offset in list(self.pending()):
+            count = 0
+            for line, offset in read_lines(path, offset):
+                yield parse_line(line)
+                count += 1
+                if count % checkpoint_every == 0:
+                    self.files[key] = offset
+                    self.save()
+            self.files[key] = seen[key] = offset
+        # Forget files that have been rotated away, keeping the state bounded.
+        self.files = seen
+
+    def run(self):
+        for record in self.records():
+            self.aggregator.add(record)
+        self.save()
+
+    def follow(self, interval=2.0):
+        while True:
+            self.run()
+            time.sleep(interval)
+
+
+def print_report(aggregator, top):
+    print(f"Lines: {aggregator.lines} (unparsed: {aggregator.unparsed})")
+    for status, count in aggregator.status.most_common():
+        print(f"  {status:40}{count:>12}")
+    print("Outbounds:")
+    for outbound, count in aggregator.outbounds.most_common(top):
+        print(f"  {outbound:40}{count:>12}")
+    print(f"Users (top {top}, estimated):")
+    for email, count in aggregator.users.top(top):
+        print(f"  {email:40}{count:>12}")
+    print(f"Destinations (top {top}, estimated):")
+    for host, count in aggregator.destinations.top(top):
+        print(f"  {host:40}{count:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Incrementally aggregate Xray access logs with a byte-offset checkpoint.")
+    parser.add_argument('log', nargs='?', default=DEFAULT_LOG,
+                        help=f"access log to tail; rotated .N and .N.gz files are read too (default: {DEFAULT_LOG})")
+    parser.add_argument('--state', default=None,
+                        help="checkpoint file (default: access_log_state.json next to the log)")
+    parser.add_argument('--top', type=int, default=20, help="rows to print per table")
+    parser.add_argument('--follow', action='store_true', help="keep tailing the log")
+    parser.add_argument('--reset', action='store_true', help="discard the checkpoint and start over")
+    args = parser.parse_args()
+
+    state_path = args.state or Path(args.log).with_name('access_log_state.json')
+    if args.reset and Path(state_path).exists():
+        os.remove(state_path)
+    if not Path(args.log).exists() and not rotated_files(args.log):
+        print(f"Error: File '{args.log}' not found.")
+        sys.exit(1)
+
+    tailer = LogTailer(args.log, state_path, max(args.top, 100))
+    try:
+        if args.follow:
+            tailer.follow()
+        else:
+            tailer.run()
+    except KeyboardInterrupt:
+        tailer.save()
+    print_report(tailer.aggregator, args.top)
+
+
+if __name__ == "__main__":
+    main()
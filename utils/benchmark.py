@@ -0,0 +1,234 @@
+#!/usr/bin/python3
+
+import argparse
+import builtins
+import contextlib
+import importlib.util
+import io
+import ipaddress
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+from cidr_compiler import REPO_ROOT, aggregate
+from domain_matcher import CompiledMatcher
+from render import dumps
+from route_check import Router
+from subscriptions import MANIFEST, generate
+from user_registry import client_inbounds, render_clients
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent.joinpath('benchmark_baseline.json')
+USER_SIZES = [1000, 10000, 100000]
+CIDR_SIZES = [2000, 20000, 200000]
+REGRESSION_THRESHOLD = 1.25
+
+
+def load_script(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@contextlib.contextmanager
+def scripted_input(answers):
+    # Feeds the interactive prompts of the setup scripts and hides their output.
+    answers = iter(answers)
+    original = builtins.input
+    builtins.input = lambda prompt='': next(answers)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+    finally:
+        builtins.input = original
+
+
+def synthetic_users(count, seed=1):
+    rng = random.Random(seed)
+    return [{'id': str(uuid.UUID(int=rng.getrandbits(128), version=4)), 'email': f'user{i}@example.com',
+             'level': 0, 'flow': ''} for i in range(count)]
+
+
+def synthetic_cidrs(count, seed=1):
+    rng = random.Random(seed)
+    entries = []
+    for _ in range(count):
+        prefix = rng.randint(16, 28)
+        address = rng.getrandbits(32) & ~((1 << (32 - prefix)) - 1) & 0xFFFFFFFF
+        entries.append(f'{ipaddress.IPv4Address(address)}/{prefix}')
+    return entries
+
+
+def timed(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_update_config(results, repeat):
+    bridge = load_script('update_bridge_config', REPO_ROOT.joinpath('bridge/update_bridge_config.py'))
+    template = json.loads(REPO_ROOT.joinpath('bridge/xray/config/config.json').read_text())
+    values = (str(uuid.uuid4()), str(uuid.uuid4()), 'upstream.example.com', 'bridge')
+    ip_rule = next(rule for rule in template['routing']['settings']['rules'] if 'ip' in rule)
+    for size in CIDR_SIZES:
+        ip_rule['ip'] = ['geoip:ir'] + synthetic_cidrs(size)
+        # A new text per size so the renderer's parse cache is measured too.
+        text = json.dumps(template, indent=2)
+        results[f'update_config/cidrs={size}'] = timed(
+            lambda: bridge.update_config(text, *values), 1)
+
+
+def bench_generate_vless_url(results, repeat):
+    keymaker = load_script('keymaker', REPO_ROOT.joinpath('keymaker.py'))
+    bridge = {'inbounds': [{'port': 443, 'settings': {'clients': [{'id': str(uuid.uuid4())}]}}]}
+    for size in USER_SIZES:
+        upstreams = [{'inbounds': [{'settings': {'clients': [{'id': user['id'], 'level': 0}]},
+                                    'streamSettings': {'network': 'ws', 'security': 'tls',
+                                                       'wsSettings': {'path': '/'}}}]}
+                     for user in synthetic_users(size)]
+
+        def run():
+            for upstream in upstreams:
+                keymaker.generate_vless_url(bridge, upstream)
+        results[f'generate_vless_url/users={size}'] = timed(run, repeat)
+
+
+def bench_caddy_cdn(results, repeat):
+    # setup_server() and create_key() work next to their own file, so they run
+    # from a copy of upstream-caddy-cdn in a temporary directory.
+    for size in USER_SIZES:
+        with tempfile.TemporaryDirectory() as tmp:
+            workdir = Path(tmp).joinpath('upstream-caddy-cdn')
+            shutil.copytree(REPO_ROOT.joinpath('upstream-caddy-cdn'), workdir)
+            config_path = workdir.joinpath('xray/config/config.json')
+            config = json.loads(config_path.read_text())
+            clients = synthetic_users(size)
+            for inbound in client_inbounds(config):
+                inbound['settings']['clients'] = [
+                    {'id': c['id'], 'level': 0, 'email': c['email']} for c in clients]
+            config_path.write_text(json.dumps(config, indent=2))
+            module = load_script('upstream_caddy_setup', workdir.joinpath('upstream-caddy-setup.py'))
+
+            def setup():
+                with scripted_input(['cdn.example.com', '', '']):
+                    module.setup_server()
+            results[f'setup_server/users={size}'] = timed(setup, repeat)
+
+            def keys():
+                for _ in range(size):
+                    with scripted_input(['cdn.example.com']):
+                        module.create_key()
+            results[f'create_key/calls={size}'] = timed(keys, 1)
+
+
+def bench_rules(results, repeat):
+    domains = [f'host{i}.example{i % 50}.com' for i in range(100000)]
+    for size in CIDR_SIZES:
+        entries = ['geoip:ir', 'geoip:private'] + synthetic_cidrs(size)
+        results[f'aggregate/cidrs={size}'] = timed(lambda: aggregate(entries), repeat)
+
+        config = {'outbounds': [{'protocol': 'vless'}, {'protocol': 'freedom', 'tag': 'direct'}],
+                  'routing': {'rules': [
+                      {'type': 'field', 'outboundTag': 'direct', 'domain': ['regexp:.*\\.ir$']},
+                      {'type': 'field', 'outboundTag': 'direct', 'ip': entries}]}}
+        results[f'router_build/cidrs={size}'] = timed(lambda: Router(config), repeat)
+        router = Router(config)
+        rng = random.Random(2)
+        addresses = [str(ipaddress.IPv4Address(rng.getrandbits(32))) for _ in range(100000)]
+        results[f'route_100k_ips/cidrs={size}'] = timed(lambda: router.route_many(addresses), repeat)
+
+    domain_entries = [f'domain:site{i}.ir' for i in range(20000)] + ['regexp:.*\\.ir$', 'keyword:ads']
+    matcher = CompiledMatcher(domain_entries)
+    results['domain_compile/entries=20000'] = timed(lambda: CompiledMatcher(domain_entries), repeat)
+    results['domain_match/domains=100000'] = timed(lambda: [matcher.match(d) for d in domains], repeat)
+
+
+def bench_users(results, repeat):
+    template = json.loads(REPO_ROOT.joinpath('xtl-reality/xray/config/config.json').read_text())
+    node = {'domain': 'bridge.example.com'}
+    for size in USER_SIZES:
+        clients = synthetic_users(size)
+        results[f'render_clients/users={size}'] = timed(
+            lambda: dumps(render_clients(json.loads(json.dumps(template)), clients)), repeat)
+        users = [{'uuid': c['id'], 'email': c['email']} for c in clients]
+        with tempfile.TemporaryDirectory() as tmp:
+            output, manifest = os.path.join(tmp, 'sub'), os.path.join(tmp, MANIFEST)
+            results[f'subscriptions_cold/users={size}'] = timed(lambda: generate(users, [node], output,
+                                                                                 manifest_path=manifest), 1)
+            results[f'subscriptions_warm/users={size}'] = timed(lambda: generate(users, [node], output,
+                                                                                 manifest_path=manifest), 1)
+
+
+SUITES = {
+    'update_config': bench_update_config,
+    'generate_vless_url': bench_generate_vless_url,
+    'caddy_cdn': bench_caddy_cdn,
+    'rules': bench_rules,
+    'users': bench_users,
+}
+
+
+def compare(results, baseline):
+    regressions = []
+    print(f"{'benchmark':44}{'baseline':>12}{'current':>12}{'ratio':>8}")
+    for name, seconds in results.items():
+        old = baseline.get(name)
+        if old is None:
+            print(f"{name:44}{'-':>12}{seconds * 1e3:>10.1f}ms{'new':>8}")
+            continue
+        ratio = seconds / old if old else float('inf')
+        flag = '  <-- slower' if ratio > REGRESSION_THRESHOLD else ''
+        print(f"{name:44}{old * 1e3:>10.1f}ms{seconds * 1e3:>10.1f}ms{ratio:>8.2f}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark config generation and rule evaluation at scale.")
+    parser.add_argument('suites', nargs='*', help=f"suites to run: {', '.join(SUITES)} (default: all)")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="baseline JSON file")
+    parser.add_argument('--save', action='store_true', help="write the results as the new baseline")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per benchmark; the best is kept")
+    parser.add_argument('--fail-on-regression', action='store_true',
+                        help=f"exit non-zero when a benchmark is {REGRESSION_THRESHOLD}x slower than the baseline")
+    args = parser.parse_args()
+
+    unknown = set(args.suites) - set(SUITES)
+    if unknown:
+        print(f"Error: Unknown suites: {', '.join(sorted(unknown))}")
+        sys.exit(1)
+
+    results = {}
+    for name in args.suites or SUITES:
+        print(f">> Running {name}...", file=sys.stderr)
+        SUITES[name](results, args.repeat)
+
+    baseline_path = Path(args.baseline)
+    baseline = {}
+    if baseline_path.exists():
+        baseline = json.loads(baseline_path.read_text()).get('results', {})
+    regressions = compare(results, baseline)
+
+    if args.save:
+        saved = dict(baseline, **results)
+        data = {'python': platform.python_version(), 'machine': platform.machine(),
+                'results': {name: round(saved[name], 6) for name in sorted(saved)}}
+        baseline_path.write_text(json.dumps(data, indent=2) + '\n')
+        print(f">> Baseline saved: {baseline_path}")
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
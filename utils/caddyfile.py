@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+
+import argparse
+import sys
+
+from subscriptions import set_caddy_block
+
+# `transport http` options for tunnel upstreams: a warm pool of keepalive
+# connections to Xray and socket buffers large enough that a streaming
+# response is copied in few, big reads (Caddy's default is 4KiB).
+PROXY_TUNING = {
+    'keepalive': '5m',
+    'keepalive_idle_conns': 512,
+    'keepalive_idle_conns_per_host': 256,
+    'read_buffer': '64KiB',
+    'write_buffer': '64KiB',
+}
+ENCODINGS = ('zstd', 'gzip')
+CADDY_BEGIN = '# BEGIN websocket (generated by utils/caddyfile.py)'
+CADDY_END = '# END websocket'
+
+
+def reverse_proxy(upstream, matcher=None, h2c=False, tuning=PROXY_TUNING):
+    # Tunnel bytes are flushed as they arrive (flush_interval -1), and the
+    # transport neither asks Xray for compressed responses nor compresses
+    # them itself (compression off). h2c speaks cleartext HTTP/2 to Xray,
+    # for gRPC, h2 and XHTTP.
+    lines = [f"reverse_proxy {matcher + ' ' if matcher else ''}{upstream} {{",
+             "  flush_interval -1",
+             "  transport http {"]
+    if h2c:
+        lines.append("    versions h2c 2")
+    lines += [f"    {key} {value}" for key, value in tuning.items()]
+    lines += ["    compression off", "  }", "}"]
+    return lines
+
+
+def compression(excluded_paths, encodings=ENCODINGS):
+    # Compresses the site's own responses but never the tunnel paths, whose
+    # bytes are already encrypted.
+    if not excluded_paths:
+        return [f"encode {' '.join(encodings)}"]
+    return ["@compressible {",
+            f"  not path {' '.join(excluded_paths)}",
+            "}",
+            f"encode @compressible {' '.join(encodings)}"]
+
+
+def websocket_block(path, upstream):
+    # Upgrade requests on any path and plain requests to `path` both go to
+    # Xray over the same tuned transport; anything else is the site's.
+    lines = ["@websockets {",
+             "  header Connection *Upgrade*",
+             "  header Upgrade websocket",
+             "}"] + reverse_proxy(upstream, '@websockets')
+    lines += ["route {"] + indent(reverse_proxy(upstream, path)) + ["  file_server", "}"]
+    return '\n'.join(indent([CADDY_BEGIN] + lines + [CADDY_END])) + '\n'
+
+
+def set_websocket_block(content, path, upstream):
+    return set_caddy_block(content, websocket_block(path, upstream), CADDY_BEGIN, CADDY_END)
+
+
+def indent(lines, prefix='  '):
+    return [f"{prefix}{line}" if line else '' for line in lines]
+
+
+def site(domain, blocks, tunnel_paths=(), root='/usr/share/caddy', file_server=True, encodings=ENCODINGS):
+    # A site block serving `root`, with the given blocks (lists of lines, or
+    # preformatted text such as a transport.py block) in between.
+    lines = [f"{domain} {{"]
+    if root:
+        lines += [f"  root * {root}", ""]
+    if encodings:
+        lines += indent(compression(tunnel_paths, encodings)) + [""]
+    for block in blocks:
+        lines += block.rstrip('\n').split('\n') if isinstance(block, str) else indent(block)
+        lines.append("")
+    if file_server:
+        lines += ["  file_server", ""]
+    lines += ["  log {", "    output stdout", "  }", "}"]
+    return '\n'.join(lines) + '\n'
+
+
+def parse_proxy(value):
+    path, sep, upstream = value.partition('=')
+    if not sep or not path.startswith('/') or not upstream:
+        raise argparse.ArgumentTypeError(f"expected PATH=UPSTREAM, got '{value}'")
+    return path, upstream
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write a Caddyfile that serves a site and streams tunnel paths to Xray uncompressed.")
+    parser.add_argument('domain')
+    parser.add_argument('--proxy', type=parse_proxy, action='append', default=[], metavar='PATH=UPSTREAM',
+                        help="proxy PATH (e.g. /tunnel/*) to UPSTREAM (e.g. xray:1311); repeatable")
+    parser.add_argument('--h2c', action='store_true', help="speak cleartext HTTP/2 to the upstreams")
+    parser.add_argument('--no-encode', action='store_true', help="do not compress the site's own responses")
+    parser.add_argument('--websocket', type=parse_proxy, metavar='PATH=UPSTREAM',
+                        help="only refresh the generated WebSocket block of the -o Caddyfile, e.g. /ws=xray:1310")
+    parser.add_argument('-o', '--output', help="Caddyfile to write (default: stdout)")
+    args = parser.parse_args()
+
+    if args.websocket:
+        if not args.output:
+            parser.error("--websocket needs -o CADDYFILE")
+        with open(args.output, 'r', encoding='utf-8') as f:
+            content = set_websocket_block(f.read(), *args.websocket)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(content)
+        print(f">> Updated file saved: {args.output}")
+        return
+
+    blocks = [[f"handle {path} {{"] + indent(reverse_proxy(upstream, h2c=args.h2c)) + ["}"]
+              for path, upstream in args.proxy]
+    content = site(args.domain, blocks, [path for path, _ in args.proxy],
+                   encodings=() if args.no_encode else ENCODINGS)
+    if not args.output:
+        sys.stdout.write(content)
+        return
+    with open(args.output, 'w', encoding='utf-8') as f:
+        f.write(content)
+    print(f">> Updated file saved: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+#!/usr/bin/python3
+
+import argparse
+import bisect
+import ipaddress
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_CONFIGS = [
+    REPO_ROOT.joinpath('bridge/xray/config/config.json'),
+    REPO_ROOT.joinpath('xtl-reality/xray/config/config.json'),
+]
+# The templates only reference the lists compiled from these (see ruleset.py),
+# so the list tools check the rule sets by default.
+DEFAULT_RULESETS = sorted(REPO_ROOT.joinpath('rulesets').glob('*.json'))
+GEO_PREFIXES = ('geoip:', 'ext:', 'ext-ip:')
+
+
+def load_config(file_path):
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_config(config, file_path):
+    with open(file_path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2)
+        f.write('\n')
+
+
+def routing_rules(config):
+    # The bridge template still uses the legacy `routing.settings.rules` layout.
+    routing = config.get('routing', {})
+    if 'rules' in routing:
+        return routing['rules']
+    return routing.get('settings', {}).get('rules', [])
+
+
+def external_lists(config, key):
+    return [entry for rule in routing_rules(config) for entry in rule.get(key, []) if entry.startswith('ext:')]
+
+
+def parse_ip_entry(entry):
+    try:
+        return ipaddress.ip_network(entry.strip(), strict=False)
+    except ValueError:
+        return None
+
+
+def load_cidr_list(file_path):
+    networks = []
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                network = parse_ip_entry(line)
+                if network is None:
+                    raise ValueError(f"Invalid CIDR '{line}' in {file_path}")
+                networks.append(network)
+    return list(ipaddress.collapse_addresses(
+        n for n in networks if n.version == 4)) + list(ipaddress.collapse_addresses(
+            n for n in networks if n.version == 6))
+
+
+def find_covered(networks):
+    # Sweep networks in address order; anything ending inside an earlier,
+    # wider network is fully covered by it.
+    covered = {}
+    for version in (4, 6):
+        ordered = sorted(
+            (n for n in networks if n.version == version),
+            key=lambda n: (int(n.network_address), n.prefixlen))
+        parent = None
+        for network in ordered:
+            if parent is not None and int(network.broadcast_address) <= int(parent.broadcast_address):
+                if network != parent:
+                    covered[network] = parent
+            else:
+                parent = network
+    return covered
+
+
+def aggregate(entries, geoip=None):
+    # Returns the compacted entry list plus a report of what was removed.
+    report = {
+        'invalid': [],
+        'duplicate': [],
+        'normalized': [],
+        'covered': [],
+        'geoip_covered': [],
+        'merged': [],
+    }
+    passthrough = []
+    networks = []
+    seen = set()
+    for entry in entries:
+        if entry.startswith(GEO_PREFIXES):
+            if entry not in passthrough:
+                passthrough.append(entry)
+            continue
+        network = parse_ip_entry(entry)
+        if network is None:
+            report['invalid'].append(entry)
+            passthrough.append(entry)
+            continue
+        if str(network) != entry and f"{network.network_address}" != entry:
+            report['normalized'].append((entry, str(network)))
+        if network in seen:
+            report['duplicate'].append(entry)
+            continue
+        seen.add(network)
+        networks.append(network)
+
+    for network, parent in find_covered(networks).items():
+        report['covered'].append((str(network), str(parent)))
+
+    remaining = networks
+    if geoip:
+        # Entries already inside a referenced geoip list are dropped.
+        referenced = [n for code, nets in geoip.items()
+                      if f'geoip:{code}' in passthrough for n in nets]
+        index = IntervalIndex(referenced)
+        remaining = []
+        for network in networks:
+            if index.covers(network):
+                report['geoip_covered'].append(str(network))
+            else:
+                remaining.append(network)
+
+    v4 = list(ipaddress.collapse_addresses(n for n in remaining if n.version == 4))
+    v6 = list(ipaddress.collapse_addresses(n for n in remaining if n.version == 6))
+    compacted = v4 + v6
+
+    uncovered = set(remaining) - set(find_covered(remaining))
+    merged_into = set(compacted)
+    for network in sorted(uncovered - merged_into, key=lambda n: (n.version, int(n.network_address))):
+        report['merged'].append(str(network))
+
+    return passthrough + [str(n) for n in compacted], report
+
+
+class IntervalIndex:
+    # Sorted, non-overlapping [start, end] integer ranges searched with bisect.
+
+    def __init__(self, networks):
+        ranges = sorted((int(n.network_address), int(n.broadcast_address), n.version)
+                        for n in networks)
+        self.starts = {4: [], 6: []}
+        self.ends = {4: [], 6: []}
+        for start, end, version in ranges:
+            starts, ends = self.starts[version], self.ends[version]
+            if ends and start <= ends[-1] + 1:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+
+    def __len__(self):
+        return len(self.starts[4]) + len(self.starts[6])
+
+    def contains(self, address, version=4):
+        pos = bisect.bisect_right(self.starts[version], address) - 1
+        return pos >= 0 and address <= self.ends[version][pos]
+
+    def covers(self, network):
+        start = int(network.network_address)
+        pos = bisect.bisect_right(self.starts[network.version], start) - 1
+        return pos >= 0 and int(network.broadcast_address) <= self.ends[network.version][pos]
+
+
+def cidr_entries(entries):
+    return [n for n in (parse_ip_entry(e) for e in entries
+                        if not e.startswith(GEO_PREFIXES)) if n is not None]
+
+
+def benchmark_match(entries, samples, repeat=3):
+    networks = cidr_entries(entries)
+    build = lookup = linear = float('inf')
+    v4 = [(int(n.network_address), int(n.broadcast_address)) for n in networks if n.version == 4]
+    linear_samples = samples[:2000]
+    for _ in range(repeat):
+        start = time.perf_counter()
+        # Xray compiles CIDR rules into sorted ranges; mirror that here.
+        index = IntervalIndex(networks)
+        build = min(build, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for address in samples:
+            index.contains(address)
+        lookup = min(lookup, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for address in linear_samples:
+            for low, high in v4:
+                if low <= address <= high:
+                    break
+        linear = min(linear, time.perf_counter() - start)
+
+    return {
+        'prefixes': len(networks),
+        'json_bytes': len(json.dumps(entries)),
+        'build_ms': build * 1e3,
+        'bisect_ns_per_lookup': lookup / len(samples) * 1e9,
+        'linear_us_per_lookup': linear / len(linear_samples) * 1e6,
+    }
+
+
+def print_benchmark(before, after, count=100000):
+    rng = random.Random(1)
+    samples = [rng.getrandbits(32) for _ in range(count)]
+    old = benchmark_match(before, samples)
+    new = benchmark_match(after, samples)
+    print(f"    {'':24}{'before':>12}{'after':>12}")
+    for key in old:
+        if isinstance(old[key], float):
+            print(f"    {key:24}{old[key]:>12.1f}{new[key]:>12.1f}")
+        else:
+            print(f"    {key:24}{old[key]:>12}{new[key]:>12}")
+
+
+def print_report(report, verbose):
+    labels = {
+        'invalid': 'invalid entries (kept as-is)',
+        'duplicate': 'exact duplicates',
+        'normalized': 'entries with host bits set',
+        'covered': 'nested inside a wider entry',
+        'geoip_covered': 'already covered by geoip',
+        'merged': 'merged with adjacent prefixes',
+    }
+    for key, label in labels.items():
+        items = report[key]
+        if not items:
+            continue
+        print(f"    {label}: {len(items)}")
+        if verbose:
+            for item in items:
+                if isinstance(item, tuple):
+                    print(f"      {item[0]} -> {item[1]}")
+                else:
+                    print(f"      {item}")
+
+
+def compile_config(config_path, write=False, benchmark=False, verbose=False, geoip=None):
+    config = load_config(config_path)
+    print(f">> {config_path}")
+    changed = False
+    for index, rule in enumerate(routing_rules(config)):
+        entries = rule.get('ip')
+        if not entries:
+            continue
+        compacted, report = aggregate(entries, geoip)
+        print(f"  rule #{index} (outboundTag: {rule.get('outboundTag')}): "
+              f"{len(entries)} -> {len(compacted)} entries")
+        print_report(report, verbose)
+        if benchmark and len(cidr_entries(entries)) > 0:
+            print_benchmark(entries, compacted)
+        if compacted != entries:
+            rule['ip'] = compacted
+            changed = True
+    if external_lists(config, 'ip'):
+        print("  ext: lists are compiled from a rule set in rulesets/ (see ruleset.py); check that instead.")
+    if write and changed:
+        save_config(config, config_path)
+        print(f">> Updated file saved: {config_path}")
+    return config
+
+
+def parse_list_args(values, loader, option):
+    lists = {}
+    for value in values or []:
+        code, _, file_path = value.partition('=')
+        if not file_path:
+            print(f"Error: {option} expects CODE=FILE, got '{value}'")
+            sys.exit(1)
+        lists[code.lower()] = loader(file_path)
+    return lists
+
+
+def parse_geoip_args(values):
+    return parse_list_args(values, load_cidr_list, '--geoip')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Merge the CIDR entries of Xray routing rules into the minimal covering prefix set.")
+    parser.add_argument('configs', nargs='*', default=DEFAULT_RULESETS,
+                        help="config.json or rule set files to compile (default: the rule sets in rulesets/)")
+    parser.add_argument('--write', action='store_true',
+                        help="write the compacted rules back into the config files")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="compare rule count and match cost before and after")
+    parser.add_argument('--geoip', action='append', metavar='CODE=FILE',
+                        help="plain CIDR list for geoip:CODE; entries it covers are dropped")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="list every removed entry")
+    args = parser.parse_args()
+
+    geoip = parse_geoip_args(args.geoip)
+    for config_path in args.configs:
+        compile_config(config_path, args.write, args.benchmark, args.verbose, geoip)
+
+
+if __name__ == "__main__":
+    main()
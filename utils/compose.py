@@ -0,0 +1,309 @@
+#!/usr/bin/python3
+
+import argparse
+import json
+import re
+import sys
+
+from cidr_compiler import load_config, save_config
+from render import copy_tree
+
+NETWORKS = ('host', 'published')
+# Raised per container; Docker's default soft limit of 1024 descriptors caps
+# an Xray container at a few hundred proxied connections.
+NOFILE = 1048576
+# Namespaced, so a bridge-networked container may set them; with
+# network_mode: host they belong to the host (see bbr.sh).
+SYSCTLS = {
+    'net.core.somaxconn': 65535,
+    'net.ipv4.tcp_fastopen': 3,
+    'net.ipv4.ip_local_port_range': '1024 65535',
+}
+# Logs go to a rotated local file through a ring buffer: a slow log consumer
+# drops lines instead of blocking Xray's writes to stdout.
+LOGGING = {
+    'driver': 'local',
+    'options': {'mode': 'non-blocking', 'max-buffer-size': '4m', 'max-size': '10m', 'max-file': '3'},
+}
+PROFILES = {
+    # No docker-proxy and no NAT: the container uses the host's stack directly.
+    'performance': {'network': 'host', 'nofile': NOFILE, 'sysctls': SYSCTLS, 'logging': LOGGING},
+    # Keeps the bridge network, so several services can share a compose file;
+    # ports are forwarded by iptables alone once the daemon's userland proxy
+    # is off (see DAEMON_CONFIG).
+    'published': {'network': 'published', 'nofile': NOFILE, 'sysctls': SYSCTLS, 'logging': LOGGING},
+}
+DAEMON_CONFIG = {'userland-proxy': False}
+# - "443:443", - "127.0.0.1:10085:10085/udp"
+PORT_RE = re.compile(r'^(?:(?P<ip>\d+\.\d+\.\d+\.\d+):)?(?:\d+:)?(?P<port>\d+)(?:/\w+)?$')
+PLAIN_RE = re.compile(r'^[A-Za-z0-9_./$@=+,-][^#]*$')
+# Plain scalars YAML would read as something other than a string (numbers,
+# booleans, sexagesimal port pairs).
+SPECIAL_RE = re.compile(r'^(?:[-+]?[\d.]+|true|false|yes|no|on|off|null|~|[\d.]+(?::[\d.]+)+(?:/\w+)?)$',
+                        re.IGNORECASE)
+
+
+def _scalar(text):
+    text = text.strip()
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in '"\'':
+        return text[1:-1]
+    if re.fullmatch(r'-?\d+', text):
+        return int(text)
+    if text in ('true', 'false'):
+        return text == 'true'
+    return text
+
+
+def _strip_comment(line):
+    # Drops a trailing " # comment" outside quotes.
+    quote = None
+    for pos, char in enumerate(line):
+        if char in '"\'' and quote in (None, char):
+            quote = None if quote else char
+        elif char == '#' and quote is None and (pos == 0 or line[pos - 1] == ' '):
+            return line[:pos].rstrip()
+    return line.rstrip()
+
+
+def load(text):
+    # The block-style YAML subset docker-compose files here are written in:
+    # nested mappings, lists of scalars or mappings, plain and quoted scalars.
+    lines = []
+    for number, raw in enumerate(text.splitlines(), 1):
+        line = _strip_comment(raw)
+        if line.strip():
+            lines.append((number, len(line) - len(line.lstrip(' ')), line.strip()))
+
+    def block(pos, indent):
+        if pos < len(lines) and lines[pos][2].startswith('- '):
+            return sequence(pos, indent)
+        return mapping(pos, indent)
+
+    def mapping(pos, indent):
+        data = {}
+        while pos < len(lines) and lines[pos][1] == indent:
+            number, _, content = lines[pos]
+            key, sep, value = content.partition(':')
+            if not sep or content.startswith('- '):
+                raise ValueError(f"line {number}: expected 'key: value'")
+            pos += 1
+            if value.strip():
+                data[_scalar(key)] = _scalar(value)
+            elif pos < len(lines) and (lines[pos][1] > indent or
+                                       (lines[pos][1] == indent and lines[pos][2].startswith('- '))):
+                data[_scalar(key)], pos = block(pos, lines[pos][1])
+            else:
+                data[_scalar(key)] = None
+        return data, pos
+
+    def sequence(pos, indent):
+        items = []
+        while pos < len(lines) and lines[pos][1] == indent and lines[pos][2].startswith('- '):
+            number, _, content = lines[pos]
+            item = content[2:].strip()
+            key, sep, value = item.partition(':')
+            if sep and not item[0] in '"\'' and (not value or value.startswith(' ')):
+                # "- key: value" starts a mapping indented past the dash.
+                lines[pos] = (number, indent + 2, item)
+                entry, pos = mapping(pos, indent + 2)
+                items.append(entry)
+            else:
+                items.append(_scalar(item))
+                pos += 1
+        return items, pos
+
+    if not lines:
+        return {}
+    data, pos = block(0, lines[0][1])
+    if pos != len(lines):
+        raise ValueError(f"line {lines[pos][0]}: unexpected indentation")
+    return data
+
+
+def _format(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        return str(value)
+    if value is None:
+        return ''
+    value = str(value)
+    if PLAIN_RE.match(value) and not SPECIAL_RE.match(value) and ': ' not in value and not value.endswith(':'):
+        return value
+    return json.dumps(value)
+
+
+def dump(data, indent=0):
+    # Two-space block style with a blank line between top-level keys and
+    # between services, like the templates.
+    lines = []
+    pad = ' ' * indent
+    if isinstance(data, list):
+        for item in data:
+            if isinstance(item, dict):
+                entry = dump(item, indent + 2).splitlines()
+                lines.append(f"{pad}- {entry[0].lstrip()}")
+                lines += entry[1:]
+            else:
+                lines.append(f"{pad}- {_format(item)}")
+        return '\n'.join(lines) + '\n'
+    for key, value in data.items():
+        if indent == 0 and lines:
+            lines.append('')
+        if isinstance(value, (dict, list)) and value:
+            lines.append(f"{pad}{_format(key)}:")
+            lines += dump(value, indent + 2).rstrip('\n').split('\n')
+        else:
+            lines.append(f"{pad}{_format(key)}: {_format(value)}".rstrip())
+        if indent == 2 and isinstance(value, dict) and key != list(data)[-1]:
+            lines.append('')
+    return '\n'.join(lines) + '\n'
+
+
+def drop_service(compose, name):
+    services = compose.get('services', {})
+    services.pop(name, None)
+    for service in services.values():
+        depends = service.get('depends_on')
+        if isinstance(depends, list) and name in depends:
+            depends.remove(name)
+            if not depends:
+                del service['depends_on']
+    return compose
+
+
+def port_entries(service):
+    for entry in service.get('ports', []):
+        match = PORT_RE.match(str(entry))
+        if match:
+            yield entry, int(match.group('port')), match.group('ip')
+
+
+def drop_ports(compose, ports, service='xray'):
+    # Removes the publications of the given container ports.
+    service = compose.get('services', {}).get(service, {})
+    removed = [entry for entry, port, _ in port_entries(service) if port in ports]
+    if removed:
+        service['ports'] = [entry for entry in service['ports'] if entry not in removed]
+        if not service['ports']:
+            del service['ports']
+    return removed
+
+
+def loopback_ports(compose, service='xray'):
+    # Container ports published on 127.0.0.1 only, e.g. the stats API.
+    service = compose.get('services', {}).get(service, {})
+    return {port for _, port, ip in port_entries(service) if ip == '127.0.0.1'}
+
+
+def host_listen(config, ports):
+    # On the host network nothing stands between an inbound and the world, so
+    # inbounds that were only published on loopback listen on it instead.
+    changed = []
+    for inbound in config.get('inbounds', []):
+        if inbound.get('port') in ports and inbound.get('listen', '0.0.0.0') in ('0.0.0.0', '::'):
+            inbound['listen'] = '127.0.0.1'
+            changed.append(inbound.get('tag', inbound['port']))
+    return changed
+
+
+def resolve_profile(options):
+    # "performance", or {"profile": "published", "cpuset": "0-1", ...}.
+    if isinstance(options, str):
+        options = {'profile': options}
+    profile = options.get('profile', 'performance')
+    if profile not in PROFILES:
+        raise ValueError(f"compose profile must be one of {', '.join(PROFILES)}")
+    settings = dict(copy_tree(PROFILES[profile]), **{k: v for k, v in options.items() if k != 'profile'})
+    if settings['network'] not in NETWORKS:
+        raise ValueError(f"compose network must be one of {', '.join(NETWORKS)}")
+    return settings
+
+
+def apply_performance(compose, network='host', nofile=NOFILE, sysctls=SYSCTLS, logging=LOGGING, cpuset=None,
+                      cpus=None):
+    services = compose.get('services', {})
+    if network == 'host' and len(services) > 1:
+        # The other services reach xray by its service name on the bridge network.
+        raise ValueError(f"network_mode host needs a single service, not {', '.join(services)}; "
+                         "drop caddy or use the 'published' profile")
+    for service in services.values():
+        if network == 'host':
+            service.pop('ports', None)
+            service.pop('networks', None)
+            service['network_mode'] = 'host'
+        elif sysctls:
+            service['sysctls'] = dict(sysctls)
+        service['ulimits'] = {'nofile': {'soft': nofile, 'hard': nofile}}
+        if cpuset:
+            service['cpuset'] = str(cpuset)
+        if cpus:
+            service['cpus'] = str(cpus)
+        if logging:
+            service['logging'] = copy_tree(logging)
+    return compose
+
+
+def render_compose(text, options=None, config=None, drop=(), listening=None):
+    # The node's compose file: the template without the dropped services and,
+    # given the ports inbounds listen on, without the publications of other
+    # ports; with the performance settings applied. Returns the text and the
+    # inbound tags moved to loopback for host networking.
+    compose = load(text)
+    for name in drop:
+        drop_service(compose, name)
+    if listening is not None:
+        service = compose.get('services', {}).get('xray', {})
+        drop_ports(compose, {port for _, port, _ in port_entries(service)} - set(listening))
+    moved = []
+    if options:
+        settings = resolve_profile(options)
+        if settings['network'] == 'host' and config is not None:
+            moved = host_listen(config, loopback_ports(compose))
+        apply_performance(compose, **settings)
+    return dump(compose), moved
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render a docker-compose.yml with a performance profile (host networking or iptables-only "
+                    "publishing, nofile limits, sysctls, CPU pinning, non-blocking logs).")
+    parser.add_argument('compose', help="docker-compose.yml template")
+    parser.add_argument('-o', '--output', help="file to write (default: overwrite the template)")
+    parser.add_argument('--profile', choices=list(PROFILES), default='performance')
+    parser.add_argument('--config', help="Xray config.json; with host networking its loopback-only inbounds "
+                                         "are made to listen on 127.0.0.1")
+    parser.add_argument('--drop', action='append', default=[], metavar='SERVICE', help="remove a service")
+    parser.add_argument('--nofile', type=int, default=NOFILE)
+    parser.add_argument('--cpuset', help="CPUs to pin the containers to, e.g. 0-1")
+    parser.add_argument('--cpus', help="CPU quota, e.g. 1.5")
+    parser.add_argument('--daemon-json', action='store_true',
+                        help="print the daemon.json setting that turns off docker-proxy")
+    args = parser.parse_args()
+
+    if args.daemon_json:
+        print(json.dumps(DAEMON_CONFIG, indent=2))
+        return
+    options = {'profile': args.profile, 'nofile': args.nofile, 'cpuset': args.cpuset, 'cpus': args.cpus}
+    try:
+        with open(args.compose, 'r', encoding='utf-8') as f:
+            text = f.read()
+        config = load_config(args.config) if args.config else None
+        content, moved = render_compose(text, options, config, args.drop)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    output = args.output or args.compose
+    with open(output, 'w', encoding='utf-8') as f:
+        f.write(content)
+    print(f">> Updated file saved: {output}")
+    if moved:
+        save_config(config, args.config)
+        print(f">> {args.config}: inbounds now listening on 127.0.0.1: {', '.join(map(str, moved))}")
+    if PROFILES[args.profile]['network'] == 'published':
+        print(">> Set \"userland-proxy\": false in /etc/docker/daemon.json (see --daemon-json) "
+              "so published ports skip docker-proxy.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+#!/usr/bin/python3
+
+import argparse
+import asyncio
+import random
+import socket
+import struct
+import sys
+import time
+
+from cidr_compiler import load_config, routing_rules, save_config
+from upstream_probe import percentile
+
+STRATEGIES = ('UseIP', 'UseIPv4', 'UseIPv6')
+DEFAULT_STRATEGY = 'UseIPv4'
+# Queried through the tunnel, so answers are not tampered with on the way.
+DOH_SERVERS = ['https://1.1.1.1/dns-query', 'https://8.8.8.8/dns-query']
+QTYPES = {'A': 1, 'AAAA': 28}
+HEADER = struct.Struct('!HHHHHH')
+
+
+def direct_domains(config):
+    # Domains the routing sends to `direct` are resolved by the local resolver.
+    domains = []
+    for rule in routing_rules(config):
+        if rule.get('outboundTag') == 'direct':
+            domains += [d for d in rule.get('domain', rule.get('domains', [])) if d not in domains]
+    return domains
+
+
+def resolve_hosts(domains, strategy=DEFAULT_STRATEGY):
+    # Current addresses of the upstream domains, for dns.hosts.
+    family = {'UseIPv4': socket.AF_INET, 'UseIPv6': socket.AF_INET6}.get(strategy, socket.AF_UNSPEC)
+    hosts = {}
+    for domain in domains:
+        try:
+            infos = socket.getaddrinfo(domain, 443, family, socket.SOCK_STREAM)
+        except socket.gaierror:
+            continue
+        hosts[domain] = sorted({info[4][0] for info in infos})
+    return hosts
+
+
+def dns_section(local_domains, hosts=None, strategy=DEFAULT_STRATEGY, doh_servers=DOH_SERVERS):
+    servers = []
+    if local_domains:
+        servers.append({'address': 'localhost', 'domains': local_domains, 'skipFallback': True})
+    servers += doh_servers
+    section = {
+        'servers': servers,
+        'queryStrategy': strategy,
+        'disableCache': False,
+        'serveStale': True,
+    }
+    if hosts:
+        section = {'hosts': hosts, **section}
+    return section
+
+
+def outbound_addresses(outbound):
+    settings = outbound.get('settings', {})
+    return [server.get('address') for server in settings.get('vnext', []) + settings.get('servers', [])]
+
+
+def pin_outbounds(config, domains, strategy=DEFAULT_STRATEGY):
+    # Outbounds dial their server's domain with the system resolver unless
+    # sockopt.domainStrategy hands it to the dns module, where dns.hosts
+    # answers it. Returns the number of outbounds changed.
+    changed = 0
+    for outbound in config.get('outbounds', []):
+        if any(address in domains for address in outbound_addresses(outbound)):
+            sockopt = outbound.setdefault('streamSettings', {}).setdefault('sockopt', {})
+            sockopt['domainStrategy'] = strategy
+            changed += 1
+    return changed
+
+
+def apply_dns(config, hosts=None, strategy=DEFAULT_STRATEGY):
+    config['dns'] = dns_section(direct_domains(config), hosts, strategy)
+    if hosts:
+        pin_outbounds(config, hosts, strategy)
+    return config
+
+
+def encode_name(name):
+    return b''.join(bytes([len(label)]) + label.encode() for label in name.rstrip('.').split('.')) + b'\0'
+
+
+def build_query(query_id, name, qtype):
+    return HEADER.pack(query_id, 0x0100, 1, 0, 0, 0) + encode_name(name) + struct.pack('!HH', qtype, 1)
+
+
+def build_answer(query, ttl=300):
+    # Answers A with 192.0.2.1 and AAAA with 2001:db8::1 (documentation ranges).
+    query_id, _, _, _, _, _ = HEADER.unpack_from(query)
+    end = query.index(b'\0', HEADER.size) + 5
+    qtype, = struct.unpack_from('!H', query, end - 4)
+    rdata = socket.inet_pton(socket.AF_INET, '192.0.2.1') if qtype == QTYPES['A'] else \
+        socket.inet_pton(socket.AF_INET6, '2001:db8::1')
+    answer = struct.pack('!HHHIH', 0xC00C, qtype, 1, ttl, len(rdata)) + rdata
+    return HEADER.pack(query_id, 0x8180, 1, 1, 0, 0) + query[HEADER.size:end] + answer
+
+
+class StubServer(asyncio.DatagramProtocol):
+    # Local DNS server answering every A/AAAA query after a fixed delay.
+
+    def __init__(self, delays):
+        self.delays = delays
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        end = data.index(b'\0', HEADER.size)
+        qtype, = struct.unpack_from('!H', data, end + 1)
+        delay = self.delays.get(qtype, 0)
+        asyncio.get_running_loop().call_later(delay, self.transport.sendto, build_answer(data), addr)
+
+
+class Resolver(asyncio.DatagramProtocol):
+    # Minimal stub resolver: one UDP socket, replies matched by query id,
+    # with an optional TTL cache like Xray's.
+
+    def __init__(self, cache=True):
+        self.pending = {}
+        self.cache = {} if cache else None
+        self.next_id = random.randrange(1 << 16)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        query_id = HEADER.unpack_from(data)[0]
+        future = self.pending.pop(query_id, None)
+        if future and not future.done():
+            future.set_result(data)
+
+    async def query(self, name, qtype, timeout=2.0):
+        now = time.monotonic()
+        if self.cache is not None:
+            cached = self.cache.get((name, qtype))
+            if cached and cached[0] > now:
+                return cached[1]
+        self.next_id = (self.next_id + 1) & 0xFFFF
+        future = self.pending[self.next_id] = asyncio.get_running_loop().create_future()
+        self.transport.sendto(build_query(self.next_id, name, qtype))
+        answer = await asyncio.wait_for(future, timeout)
+        if self.cache is not None:
+            self.cache[(name, qtype)] = (now + 300, answer)
+        return answer
+
+    async def resolve(self, name, strategy):
+        # UseIP asks for both families and waits for both answers.
+        qtypes = {'UseIPv4': ['A'], 'UseIPv6': ['AAAA']}.get(strategy, ['A', 'AAAA'])
+        await asyncio.gather(*(self.query(name, QTYPES[qtype]) for qtype in qtypes))
+
+
+def workload(names, queries, seed=1):
+    # Destinations follow a Zipf-like popularity, as in real browsing.
+    rng = random.Random(seed)
+    weights = [1 / rank for rank in range(1, names + 1)]
+    return rng.choices([f'host{i}.example.com' for i in range(names)], weights, k=queries)
+
+
+async def measure(server, strategies, names, queries, parallel):
+    loop = asyncio.get_running_loop()
+    results = {}
+    domains = workload(names, queries)
+    for strategy in strategies:
+        for cache in (False, True):
+            transport, resolver = await loop.create_datagram_endpoint(
+                lambda: Resolver(cache), remote_addr=server)
+            semaphore = asyncio.Semaphore(parallel)
+
+            async def one(name):
+                async with semaphore:
+                    start = time.perf_counter()
+                    await resolver.resolve(name, strategy)
+                    return time.perf_counter() - start
+
+            latencies = await asyncio.gather(*(one(name) for name in domains))
+            transport.close()
+            results[(strategy, cache)] = latencies
+    return results
+
+
+async def benchmark(server, strategies, names, queries, parallel, delay_a, delay_aaaa):
+    stub = None
+    if server is None:
+        loop = asyncio.get_running_loop()
+        stub, _ = await loop.create_datagram_endpoint(
+            lambda: StubServer({QTYPES['A']: delay_a, QTYPES['AAAA']: delay_aaaa}),
+            local_addr=('127.0.0.1', 0))
+        server = stub.get_extra_info('sockname')
+    try:
+        return await measure(server, strategies, names, queries, parallel)
+    finally:
+        if stub:
+            stub.close()
+
+
+def print_results(results):
+    print(f"  {'strategy':10}{'cache':>7}{'mean ms':>10}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}")
+    for (strategy, cache), latencies in results.items():
+        mean = sum(latencies) / len(latencies)
+        print(f"  {strategy:10}{'on' if cache else 'off':>7}{mean * 1e3:>10.2f}"
+              + ''.join(f"{percentile(latencies, q) * 1e3:>9.2f}" for q in (50, 90, 99)))
+
+
+def parse_server(value):
+    host, _, port = value.rpartition(':')
+    return (host or value, int(port) if host else 53)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the Xray dns section and measure resolution latency.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    apply = commands.add_parser('apply', help="write the dns section into config files")
+    apply.add_argument('configs', nargs='+')
+    apply.add_argument('--strategy', choices=STRATEGIES, default=DEFAULT_STRATEGY)
+    apply.add_argument('--pin', action='append', default=[], metavar='DOMAIN',
+                       help="resolve DOMAIN now and pin its addresses in dns.hosts (repeatable)")
+
+    bench = commands.add_parser('bench', help="measure resolution latency per query strategy")
+    bench.add_argument('--server', type=parse_server, help="resolver HOST[:PORT] (default: a local stub server)")
+    bench.add_argument('--delay', type=float, default=40, help="stub delay for A answers in ms")
+    bench.add_argument('--delay-aaaa', type=float, default=80, help="stub delay for AAAA answers in ms")
+    bench.add_argument('--names', type=int, default=200, help="distinct domains in the workload")
+    bench.add_argument('--queries', type=int, default=2000)
+    bench.add_argument('--parallel', type=int, default=16)
+    args = parser.parse_args()
+
+    if args.command == 'apply':
+        hosts = resolve_hosts(args.pin, args.strategy)
+        for domain in set(args.pin) - set(hosts):
+            print(f"Warning: Could not resolve {domain}; not pinned.")
+        for config_path in args.configs:
+            save_config(apply_dns(load_config(config_path), hosts, args.strategy), config_path)
+            print(f">> dns section written to {config_path}")
+        return
+
+    try:
+        results = asyncio.run(benchmark(args.server, STRATEGIES, args.names, args.queries, args.parallel,
+                                        args.delay / 1e3, args.delay_aaaa / 1e3))
+    except (OSError, asyncio.TimeoutError) as e:
+        print(f"Error: {e or 'resolver did not answer'}")
+        sys.exit(1)
+    print_results(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/python3
+
+import argparse
+import re
+import sys
+from functools import lru_cache
+
+from cidr_compiler import DEFAULT_RULESETS, external_lists, load_config, routing_rules, save_config
+
+# Labels used to check whether a regexp accepts every subdomain of an entry.
+PROBE_LABELS = ['www', 'a', 'x-1', 'cdn.static', '0']
+
+
+def parse_domain_entry(entry):
+    # Xray syntax: full:, domain:, keyword:, regexp:, geosite:/ext:; a bare
+    # string is a keyword match.
+    kind, sep, value = entry.partition(':')
+    if not sep or kind not in ('full', 'domain', 'keyword', 'regexp', 'geosite', 'ext'):
+        return 'keyword', entry.lower()
+    if kind == 'regexp':
+        return kind, value
+    return kind, value.lower()
+
+
+class DomainTrie:
+    # Reversed-label trie: `domain:` marks match the whole subtree, `full:`
+    # marks only the exact node.
+
+    DOMAIN = 1
+    FULL = 2
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, value, mark):
+        node = self.root
+        for label in reversed(value.split('.')):
+            node = node.setdefault(label, {})
+        node[None] = node.get(None, 0) | mark
+
+    def match(self, domain):
+        node = self.root
+        labels = domain.split('.')
+        for pos in range(len(labels) - 1, -1, -1):
+            node = node.get(labels[pos])
+            if node is None:
+                return False
+            if node.get(None, 0) & self.DOMAIN:
+                return True
+        return bool(node.get(None, 0) & self.FULL)
+
+    def covers_exact(self, value):
+        node = self.root
+        for label in reversed(value.split('.')):
+            node = node.get(label)
+            if node is None:
+                return False
+        return bool(node.get(None, 0) & self.DOMAIN)
+
+    def covering(self, value):
+        # The closest strict ancestor with a `domain:` mark, if any.
+        node = self.root
+        labels = list(reversed(value.split('.')))
+        for depth, label in enumerate(labels[:-1]):
+            node = node.get(label)
+            if node is None:
+                return None
+            if node.get(None, 0) & self.DOMAIN:
+                return '.'.join(reversed(labels[:depth + 1]))
+        return None
+
+
+class CompiledMatcher:
+    # One trie for full:/domain: entries plus a single alternation regex for
+    # keyword:/regexp: entries.
+
+    def __init__(self, entries):
+        self.trie = DomainTrie()
+        self.external = []
+        patterns = []
+        for entry in entries:
+            kind, value = parse_domain_entry(entry)
+            if kind == 'full':
+                self.trie.add(value, DomainTrie.FULL)
+            elif kind == 'domain':
+                self.trie.add(value, DomainTrie.DOMAIN)
+            elif kind == 'keyword':
+                patterns.append(re.escape(value))
+            elif kind == 'regexp':
+                patterns.append(f'(?:{value})')
+            else:
+                self.external.append(entry)
+        self.regex = re.compile('|'.join(patterns)) if patterns else None
+
+    def match(self, domain):
+        if self.trie.match(domain):
+            return True
+        return self.regex is not None and self.regex.search(domain) is not None
+
+    def covers(self, kind, value):
+        # True when every domain matched by `kind:value` is matched here too.
+        full = kind == 'full'
+        if self.trie.covering(value) or self.trie.covers_exact(value) or full and self.trie.match(value):
+            return True
+        return self.regex is not None and regexp_accepts_subtree(self.regex, value, full)
+
+    def match_many(self, domains):
+        match = lru_cache(maxsize=262144)(self.match)
+        return [match(domain.lower().rstrip('.')) for domain in domains]
+
+
+def regexp_accepts_subtree(regex, value, full=False):
+    if not regex.search(value):
+        return False
+    if full:
+        return True
+    return all(regex.search(f'{label}.{value}') for label in PROBE_LABELS)
+
+
+def load_domain_list(file_path):
+    # One rule entry per line; bare names are domain suffixes as in v2fly lists.
+    entries = []
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                entries.append(line if ':' in line else f'domain:{line}')
+    return entries
+
+
+def lint(entries, earlier=None):
+    # Returns (position, entry, reason) for every entry that can be removed without
+    # changing what the list matches. `earlier` is a list of (label, matcher)
+    # for rules evaluated before this one.
+    findings = []
+    seen = set()
+    trie = DomainTrie()
+    keywords = []
+    regexes = []
+    parsed = [parse_domain_entry(entry) for entry in entries]
+    for kind, value in parsed:
+        if kind == 'domain':
+            trie.add(value, DomainTrie.DOMAIN)
+        elif kind == 'keyword':
+            keywords.append(value)
+        elif kind == 'regexp':
+            regexes.append((value, re.compile(value)))
+
+    for position, (entry, (kind, value)) in enumerate(zip(entries, parsed)):
+        if (kind, value) in seen:
+            findings.append((position, entry, 'duplicate'))
+            continue
+        seen.add((kind, value))
+        reason = None
+        if kind in ('full', 'domain'):
+            parent = trie.covering(value)
+            if parent is not None:
+                reason = f'shadowed by domain:{parent}'
+            elif kind == 'full' and ('domain', value) in set(parsed):
+                reason = f'shadowed by domain:{value}'
+            else:
+                keyword = next((k for k in keywords if k in value), None)
+                if keyword is not None:
+                    reason = f'subsumed by keyword:{keyword}'
+                else:
+                    pattern = next((p for p, r in regexes
+                                    if regexp_accepts_subtree(r, value, kind == 'full')), None)
+                    if pattern is not None:
+                        reason = f'subsumed by regexp:{pattern}'
+        elif kind == 'keyword':
+            keyword = next((k for k in keywords if k != value and k in value), None)
+            if keyword is not None:
+                reason = f'subsumed by keyword:{keyword}'
+        if reason is None and earlier and kind in ('full', 'domain'):
+            for label, matcher in earlier:
+                if matcher.covers(kind, value):
+                    reason = f'never reached: matched first by {label}'
+                    break
+        if reason is not None:
+            findings.append((position, entry, reason))
+    return findings
+
+
+def lint_config(config_path, fix=False, fix_dead=False):
+    config = load_config(config_path)
+    print(f">> {config_path}")
+    earlier = []
+    changed = False
+    for index, rule in enumerate(routing_rules(config)):
+        entries = rule.get('domain')
+        if not entries:
+            continue
+        findings = lint(entries, earlier)
+        print(f"  rule #{index} (outboundTag: {rule.get('outboundTag')}): "
+              f"{len(entries)} entries, {len(findings)} removable")
+        for _, entry, reason in findings:
+            print(f"    {entry}: {reason}")
+        remove = {position for position, _, reason in findings
+                  if fix and not reason.startswith('never reached') or fix_dead}
+        if remove:
+            rule['domain'] = [e for position, e in enumerate(entries) if position not in remove]
+            changed = True
+        # Only rules without other conditions shadow the ones after them.
+        if set(rule) <= {'type', 'outboundTag', 'balancerTag', 'domain', 'ruleTag'}:
+            earlier.append((f'rule #{index}', CompiledMatcher(entries)))
+    if external_lists(config, 'domain'):
+        print("  ext: lists are compiled from a rule set in rulesets/ (see ruleset.py); check that instead.")
+    if changed:
+        save_config(config, config_path)
+        print(f">> Updated file saved: {config_path}")
+
+
+def match_file(config_path, file_path):
+    rules = [(index, CompiledMatcher(rule['domain']))
+             for index, rule in enumerate(routing_rules(load_config(config_path)))
+             if rule.get('domain')]
+    f = sys.stdin if file_path == '-' else open(file_path, 'r', encoding='utf-8')
+    with f:
+        domains = [line.strip() for line in f if line.strip()]
+    results = [matcher.match_many(domains) for _, matcher in rules]
+    for pos, domain in enumerate(domains):
+        matched = [f'#{index}' for (index, _), result in zip(rules, results) if result[pos]]
+        print(f"{domain}\t{','.join(matched) or '-'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Lint the domain lists of Xray routing rules and match domains against them.")
+    parser.add_argument('configs', nargs='*', default=DEFAULT_RULESETS,
+                        help="config.json or rule set files to lint (default: the rule sets in rulesets/)")
+    parser.add_argument('--fix', action='store_true',
+                        help="remove duplicate, shadowed and subsumed entries")
+    parser.add_argument('--fix-dead', action='store_true',
+                        help="also remove entries that an earlier rule always matches first")
+    parser.add_argument('--match', metavar='FILE',
+                        help="print the domain rules matching each domain in FILE ('-' for stdin)")
+    args = parser.parse_args()
+
+    if args.match:
+        for config_path in args.configs:
+            match_file(config_path, args.match)
+        return
+    for config_path in args.configs:
+        lint_config(config_path, args.fix or args.fix_dead, args.fix_dead)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+#!/usr/bin/python3
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from cidr_compiler import REPO_ROOT, routing_rules
+from compose import render_compose, resolve_profile
+from dns_tuning import DEFAULT_STRATEGY, STRATEGIES, apply_dns
+from geodat import ASSETS_DIR
+from reality_keys import apply_reality
+from render import PLACEHOLDER_RE, RenderError, dumps, load_template
+from ruleset import DEFAULT_RULESET, RuleSet, inject
+from transport import DEFAULT_PATHS, TRANSPORTS, set_caddy_transport, set_transport
+from tuning import PROFILES, apply_mux, apply_profile
+from unix_sockets import STYLES, apply_unix_sockets, tcp_ports
+from user_registry import DEFAULT_DB, UserRegistry, build_clients, render_clients
+
+TEMPLATES = ['bridge', 'upstream', 'upstream-caddy-cdn', 'xray-caddy-cdn', 'xtl-reality']
+TEMPLATE_FILES = ['xray/config/config.json', 'caddy/Caddyfile', 'docker-compose.yml']
+MODES = ['direct', 'bridge', 'relay']
+# Hash of a node's inputs, written into its output directory.
+STAMP_FILE = '.fleet.sha256'
+# Where each template's Caddy proxies the tunnel to.
+CADDY_UPSTREAMS = {'upstream-caddy-cdn': 'xray:1311', 'xray-caddy-cdn': 'xray:1310'}
+# Inventory keys and the template placeholders they fill.
+FIELDS = {
+    'upstream_uuid': 'UPSTREAM-UUID',
+    'bridge_uuid': 'BRIDGE-UUID',
+    'outbound_domain': 'OUTBOUND-DOMAIN',
+    'domain': 'EXAMPLE.COM',
+    'email': 'USER-EMAIL',
+    'private_key': 'PRIVATE-KEY',
+    'public_key': 'PUBLIC-KEY',
+    'short_id': 'SHORT-ID',
+}
+
+
+def load_inventory(file_path):
+    # {"defaults": {...}, "nodes": [{"name": ..., "template": ..., ...}]};
+    # every node inherits the defaults it does not override.
+    with open(file_path, 'r', encoding='utf-8') as f:
+        inventory = json.load(f)
+    defaults = inventory.get('defaults', {})
+    nodes = []
+    names = set()
+    for entry in inventory.get('nodes', []):
+        node = dict(defaults, **entry)
+        name = node.get('name')
+        if not name or name in names:
+            raise ValueError(f"Node names must be present and unique: {entry}")
+        names.add(name)
+        if node.get('template') not in TEMPLATES:
+            raise ValueError(f"{name}: template must be one of {', '.join(TEMPLATES)}")
+        if node['template'] == 'bridge':
+            node.setdefault('mode', 'bridge')
+            if node['mode'] not in MODES:
+                raise ValueError(f"{name}: mode must be one of {', '.join(MODES)}")
+        if isinstance(node.get('transport'), str):
+            node['transport'] = {'network': node['transport']}
+        if node.get('transport') and node['transport'].get('network') not in TRANSPORTS:
+            raise ValueError(f"{name}: transport network must be one of {', '.join(TRANSPORTS)}")
+        if isinstance(node.get('dns'), dict) and node['dns'].get('strategy', DEFAULT_STRATEGY) not in STRATEGIES:
+            raise ValueError(f"{name}: dns strategy must be one of {', '.join(STRATEGIES)}")
+        if node.get('profile') and node['profile'] not in PROFILES:
+            raise ValueError(f"{name}: profile must be one of {', '.join(sorted(PROFILES))}")
+        if node.get('compose'):
+            try:
+                resolve_profile(node['compose'])
+            except ValueError as e:
+                raise ValueError(f"{name}: {e}")
+        nodes.append(node)
+    return inventory, nodes
+
+
+def node_values(node):
+    values = {placeholder: node[key] for key, placeholder in FIELDS.items() if key in node}
+    values.update(node.get('values', {}))
+    short_ids = node.get('short_ids')
+    if short_ids and 'SHORT-ID' not in values:
+        # The template's single slot; render_node writes the whole list.
+        values['SHORT-ID'] = next(iter(short_ids.values() if isinstance(short_ids, dict) else short_ids))
+    if node.get('mode') == 'direct':
+        # Same as the interactive script: one UUID, no outbound server.
+        values['OUTBOUND-DOMAIN'] = ''
+        values.setdefault('UPSTREAM-UUID', values.get('BRIDGE-UUID'))
+    if 'mode' in node:
+        values['DEPLOYMENT-MODE'] = node['mode']
+    return values
+
+
+def fill_text(text, values):
+    return PLACEHOLDER_RE.sub(lambda m: str(values.get(m.group(1), m.group(0))), text)
+
+
+def write_file(file_path, content):
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = file_path.with_name(file_path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(tmp_path, file_path)
+
+
+def uses_ruleset(template_dir, ruleset):
+    template = load_template(template_dir.joinpath('xray/config/config.json'))
+    return any(rule.get('ruleTag') == ruleset.name for rule in routing_rules(template.data))
+
+
+def node_digest(node, template_dir, ruleset=None, clients_digest=None):
+    # Hash of everything a node's output is rendered from.
+    digest = hashlib.sha256(json.dumps(node, sort_keys=True).encode())
+    for name in TEMPLATE_FILES:
+        file_path = template_dir.joinpath(name)
+        if file_path.exists():
+            digest.update(file_path.read_bytes())
+    for asset in sorted(template_dir.joinpath(ASSETS_DIR).glob('*.dat')):
+        digest.update(asset.read_bytes())
+    if ruleset is not None and uses_ruleset(template_dir, ruleset):
+        digest.update(ruleset.digest.encode())
+    digest.update((clients_digest or '').encode())
+    return digest.hexdigest()
+
+
+def render_node(node, output_dir, clients=None, ruleset=None, clients_digest=None, force=False):
+    # Returns the written files; an empty list when the node's stamp shows
+    # its inputs have not changed since the last render.
+    start = time.perf_counter()
+    template_dir = REPO_ROOT.joinpath(node['template'])
+    node_dir = Path(output_dir).joinpath(node['name'])
+    digest = node_digest(node, template_dir, ruleset, clients_digest)
+    stamp = node_dir.joinpath(STAMP_FILE)
+    if not force and stamp.exists() and stamp.read_text().strip() == digest:
+        return node['name'], [], time.perf_counter() - start
+    values = node_values(node)
+
+    config = load_template(template_dir.joinpath('xray/config/config.json')).render(values)
+    if clients is not None and node.get('users'):
+        render_clients(config, clients, node.get('user_inbounds'))
+    # The canonical rule set replaces the template's copy of its rules.
+    uses_ruleset = ruleset is not None and inject(config, ruleset)
+    transport = node.get('transport')
+    if transport:
+        # "grpc", or {"network": "grpc", "path": ..., "host": ...}; the
+        # bridge changes its outbound, every other template its inbounds.
+        network = transport['network']
+        path = transport.get('path') or DEFAULT_PATHS[network]
+        side = 'outbound' if node['template'] == 'bridge' else 'inbound'
+        set_transport(config, network, path, side, transport.get('host'))
+    if node.get('mux'):
+        # true, or {"concurrency": N, "xudpConcurrency": M}
+        mux = node['mux'] if isinstance(node['mux'], dict) else {}
+        apply_mux(config, mux.get('concurrency', 8), mux.get('xudpConcurrency', 16))
+    if node.get('profile'):
+        apply_profile(config, node['profile'])
+    if node.get('short_ids'):
+        # ["6ba85179e30d4fc2", ...] or {"node-0": ..., "user@example.com": ...},
+        # as written by `reality_keys.py rotate`.
+        apply_reality(config, short_ids=node['short_ids'])
+    if node.get('dns'):
+        # true, or {"strategy": "UseIPv4", "hosts": {"de1.example.com": ["203.0.113.7"]}}
+        dns = node['dns'] if isinstance(node['dns'], dict) else {}
+        apply_dns(config, dns.get('hosts'), dns.get('strategy', DEFAULT_STRATEGY))
+    if node.get('unix_sockets'):
+        # true (abstract @name sockets) or "path" (files in /dev/shm)
+        style = node['unix_sockets'] if node['unix_sockets'] in STYLES else 'abstract'
+        apply_unix_sockets(config, style)
+    use_caddy = node.get('caddy', True)
+    # Rendered before the config is written: with host networking (`compose`:
+    # "performance", or {"profile": "published", "cpuset": "0-1", ...}) the
+    # loopback-only inbounds move to 127.0.0.1. With Unix sockets, ports no
+    # inbound listens on over TCP any more need no publishing.
+    compose, _ = render_compose(template_dir.joinpath('docker-compose.yml').read_text(), node.get('compose'),
+                                config, [] if use_caddy else ['caddy'],
+                                tcp_ports(config) if node.get('unix_sockets') else None)
+    write_file(node_dir.joinpath('xray/config/config.json'), dumps(config))
+    written = ['xray/config/config.json']
+    # Compiled geoip/geosite lists referenced as ext:FILE:CODE (see geodat.py).
+    if uses_ruleset:
+        written += [f'{ASSETS_DIR}/{name}' for name in ruleset.write_assets(node_dir.joinpath(ASSETS_DIR))]
+    else:
+        for asset in sorted(template_dir.joinpath(ASSETS_DIR).glob('*.dat')):
+            node_dir.joinpath(ASSETS_DIR).mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(asset, node_dir.joinpath(ASSETS_DIR, asset.name))
+            written.append(f'{ASSETS_DIR}/{asset.name}')
+
+    caddyfile = template_dir.joinpath('caddy/Caddyfile')
+    if use_caddy and caddyfile.exists():
+        content = fill_text(caddyfile.read_text(), values)
+        if transport and node['template'] in CADDY_UPSTREAMS:
+            content = set_caddy_transport(content, network, path, CADDY_UPSTREAMS[node['template']])
+        write_file(node_dir.joinpath('caddy/Caddyfile'), content)
+        written.append('caddy/Caddyfile')
+
+    write_file(node_dir.joinpath('docker-compose.yml'), compose)
+    written.append('docker-compose.yml')
+    write_file(stamp, digest + '\n')
+    return node['name'], written, time.perf_counter() - start
+
+
+def render_fleet(nodes, output_dir, clients=None, workers=None, ruleset=None, force=False):
+    # Nodes are rendered in a process pool; results come back in inventory order.
+    clients_digest = None
+    if clients is not None:
+        clients_digest = hashlib.sha256(json.dumps(clients, sort_keys=True).encode()).hexdigest()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(render_node, node, output_dir,
+                               clients if node.get('users') else None,
+                               ruleset, clients_digest if node.get('users') else None, force)
+                   for node in nodes]
+        for node, future in zip(nodes, futures):
+            try:
+                yield future.result()
+            except (RenderError, OSError, KeyError, ValueError) as e:
+                yield node['name'], None, e
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render config.json, Caddyfile and docker-compose.yml for every node of an inventory.")
+    parser.add_argument('inventory', help="inventory JSON file")
+    parser.add_argument('-o', '--output', help="output directory (default: inventory 'output' or ./build)")
+    parser.add_argument('--only', action='append', metavar='NAME', help="render only these nodes")
+    parser.add_argument('--workers', type=int, help="worker processes (default: CPU count)")
+    parser.add_argument('--force', action='store_true', help="re-render nodes whose inputs are unchanged")
+    args = parser.parse_args()
+
+    try:
+        inventory, nodes = load_inventory(args.inventory)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    if args.only:
+        nodes = [node for node in nodes if node['name'] in args.only]
+    output_dir = args.output or inventory.get('output', './build')
+
+    clients = None
+    if any(node.get('users') for node in nodes):
+        # An empty client list would lock everyone out of the nodes, so a
+        # missing registry is an error rather than a new, empty one.
+        registry_path = inventory.get('registry', DEFAULT_DB)
+        if not os.path.isfile(registry_path):
+            print(f"Error: User registry {registry_path} not found; create it with user_registry.py "
+                  "or drop 'users' from the nodes.")
+            sys.exit(1)
+        registry = UserRegistry(registry_path)
+        try:
+            clients = build_clients(registry.users())
+        finally:
+            registry.close()
+        if not clients:
+            print(f"Error: The user registry {registry_path} is empty.")
+            sys.exit(1)
+
+    # Compiled once here; every node using it gets the same rules and assets.
+    ruleset_path = Path(inventory.get('ruleset', DEFAULT_RULESET))
+    ruleset = RuleSet(ruleset_path) if ruleset_path.exists() else None
+
+    start = time.perf_counter()
+    failed = 0
+    for name, written, result in render_fleet(nodes, output_dir, clients, args.workers, ruleset, args.force):
+        if written is None:
+            failed += 1
+            print(f"  {name:24} FAILED: {result}")
+        elif not written:
+            print(f"  {name:24}{result * 1e3:8.1f} ms  unchanged")
+        else:
+            print(f"  {name:24}{result * 1e3:8.1f} ms  {', '.join(written)}")
+    elapsed = time.perf_counter() - start
+    print(f">> Rendered {len(nodes) - failed}/{len(nodes)} nodes into {output_dir} in {elapsed:.2f}s")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
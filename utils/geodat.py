@@ -0,0 +1,218 @@
+#!/usr/bin/python3
+
+import argparse
+import ipaddress
+import os
+import sys
+from pathlib import Path
+
+from cidr_compiler import DEFAULT_CONFIGS, GEO_PREFIXES, load_cidr_list, load_config, parse_ip_entry, \
+    parse_list_args, routing_rules, save_config
+from domain_matcher import load_domain_list, parse_domain_entry
+from subscriptions import write_atomic
+from xray_api import _first, decode_message, encode_message
+
+# Referenced as ext:<file>:<code>; one file per list type, since Xray reads
+# IP lists as GeoIPList and domain lists as GeoSiteList messages.
+GEOIP_FILE = 'iran-ip.dat'
+GEOSITE_FILE = 'iran-site.dat'
+# Next to xray/config in each template, mounted where Xray looks for assets
+# after its own directory (the image's geoip.dat and geosite.dat stay visible).
+ASSETS_DIR = 'xray/assets'
+CONTAINER_ASSETS = '/usr/local/share/xray'
+# Rules with fewer inline entries than this stay inline.
+MIN_ENTRIES = 8
+# routercommon.Domain.Type
+DOMAIN_TYPES = {'keyword': 0, 'regexp': 1, 'domain': 2, 'full': 3}
+
+
+def encode_geoip(lists):
+    # GeoIPList{entry: [GeoIP{country_code, cidr: [CIDR{ip, prefix}]}]}. The
+    # code comes first in every entry: Xray finds an entry by scanning for it
+    # without decoding the rest of the file.
+    entries = []
+    for code, networks in sorted(lists.items()):
+        cidrs = [(2, encode_message((1, n.network_address.packed), (2, n.prefixlen))) for n in networks]
+        entries.append((1, encode_message((1, code.upper()), *cidrs)))
+    return encode_message(*entries)
+
+
+def encode_geosite(lists):
+    # GeoSiteList{entry: [GeoSite{country_code, domain: [Domain{type, value}]}]}
+    entries = []
+    for code, domains in sorted(lists.items()):
+        fields = []
+        for entry in domains:
+            kind, value = parse_domain_entry(entry)
+            fields.append((2, encode_message((1, DOMAIN_TYPES[kind]), (2, value))))
+        entries.append((1, encode_message((1, code.upper()), *fields)))
+    return encode_message(*entries)
+
+
+def decode_geoip(data):
+    lists = {}
+    for entry in decode_message(data).get(1, []):
+        fields = decode_message(entry)
+        networks = []
+        for cidr in fields.get(2, []):
+            cidr = decode_message(cidr)
+            address = ipaddress.ip_address(_first(cidr, 1))
+            networks.append(ipaddress.ip_network(f'{address}/{_first(cidr, 2, 0)}'))
+        lists[_first(fields, 1).decode().lower()] = networks
+    return lists
+
+
+def decode_geosite(data):
+    kinds = {number: kind for kind, number in DOMAIN_TYPES.items()}
+    lists = {}
+    for entry in decode_message(data).get(1, []):
+        fields = decode_message(entry)
+        domains = []
+        for domain in fields.get(2, []):
+            domain = decode_message(domain)
+            domains.append(f"{kinds[_first(domain, 1, 0)]}:{_first(domain, 2).decode()}")
+        lists[_first(fields, 1).decode().lower()] = domains
+    return lists
+
+
+def read_dat(file_path, decode):
+    if not os.path.exists(file_path):
+        return {}
+    with open(file_path, 'rb') as f:
+        return decode(f.read())
+
+
+def load_ext(config, assets_dir):
+    # geoip and geosite lists for every ext:<file>:<code> the rules reference,
+    # keyed '<file>:<code>' the way route_check expands geoip:/geosite: codes.
+    geoip, geosite = {}, {}
+    for rule in routing_rules(config):
+        for key, lists, decode in (('ip', geoip, decode_geoip), ('domain', geosite, decode_geosite)):
+            for entry in rule.get(key, []):
+                if entry.startswith('ext:'):
+                    file_name = entry.split(':')[1]
+                    for code, values in read_dat(os.path.join(assets_dir, file_name), decode).items():
+                        lists[f'{file_name}:{code}'] = values
+    return geoip, geosite
+
+
+def template_assets(config_path):
+    # <template>/xray/config/config.json -> <template>/xray/assets
+    return Path(config_path).resolve().parent.parent.parent.joinpath(ASSETS_DIR)
+
+
+def externalize(config, ip_file=GEOIP_FILE, site_file=GEOSITE_FILE, min_entries=MIN_ENTRIES):
+    # Moves the inline CIDRs and domains of every large enough rule into a
+    # list named after the rule's outbound; the rule keeps its geoip:/geosite:
+    # references and gains an ext: one. Returns the new (geoip, geosite) lists.
+    geoip, geosite = {}, {}
+    for rule in routing_rules(config):
+        code = rule.get('outboundTag') or rule.get('balancerTag') or 'default'
+        if len(rule.get('ip', [])) >= min_entries:
+            inline = [e for e in rule['ip'] if not e.startswith(GEO_PREFIXES) and parse_ip_entry(e) is not None]
+            if len(inline) >= min_entries:
+                name = code if code not in geoip else f'{code}-{len(geoip)}'
+                geoip[name] = [parse_ip_entry(e) for e in inline]
+                rule['ip'] = [e for e in rule['ip'] if e not in inline] + [f'ext:{ip_file}:{name}']
+        if len(rule.get('domain', [])) >= min_entries:
+            inline = [e for e in rule['domain'] if parse_domain_entry(e)[0] in DOMAIN_TYPES]
+            if len(inline) >= min_entries:
+                name = code if code not in geosite else f'{code}-{len(geosite)}'
+                geosite[name] = inline
+                rule['domain'] = [e for e in rule['domain'] if e not in inline] + [f'ext:{site_file}:{name}']
+    return geoip, geosite
+
+
+def mount_assets(compose):
+    # Adds the read-only assets volume after the xray config volume.
+    mount = f"./{ASSETS_DIR}:{CONTAINER_ASSETS}:ro"
+    if mount in compose:
+        return compose
+    lines = compose.splitlines(keepends=True)
+    for pos, line in enumerate(lines):
+        if line.strip().startswith('- ./xray/config'):
+            indent = line[:len(line) - len(line.lstrip())]
+            lines.insert(pos + 1, f"{indent}- {mount}\n")
+            break
+    return ''.join(lines)
+
+
+def compile_template(config_path, min_entries=MIN_ENTRIES):
+    assets_dir = template_assets(config_path)
+    template_dir = assets_dir.parent.parent
+    config = load_config(config_path)
+    print(f">> {config_path}")
+    geoip, geosite = externalize(config, GEOIP_FILE, GEOSITE_FILE, min_entries)
+    if not geoip and not geosite:
+        print("  no inline lists to move")
+        return
+    assets_dir.mkdir(parents=True, exist_ok=True)
+    for file_name, lists, encode, decode in ((GEOIP_FILE, geoip, encode_geoip, decode_geoip),
+                                             (GEOSITE_FILE, geosite, encode_geosite, decode_geosite)):
+        if not lists:
+            continue
+        file_path = assets_dir.joinpath(file_name)
+        merged = dict(read_dat(file_path, decode), **lists)
+        data = encode(merged)
+        write_atomic(str(file_path), data)
+        for code, values in lists.items():
+            print(f"  ext:{file_name}:{code}: {len(values)} entries")
+        print(f">> Updated file saved: {file_path} ({len(data)} bytes)")
+    save_config(config, config_path)
+    print(f">> Updated file saved: {config_path}")
+    compose_path = template_dir.joinpath('docker-compose.yml')
+    if compose_path.exists():
+        compose = compose_path.read_text()
+        updated = mount_assets(compose)
+        if updated != compose:
+            compose_path.write_text(updated)
+            print(f">> Updated file saved: {compose_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compile routing rule lists into Xray geoip/geosite .dat files referenced as ext:FILE:CODE.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    compile_parser = commands.add_parser(
+        'compile', help="move the inline lists of config files into .dat files next to them")
+    compile_parser.add_argument('configs', nargs='*', default=DEFAULT_CONFIGS,
+                                help="config.json files (default: bridge and xtl-reality)")
+    compile_parser.add_argument('--min-entries', type=int, default=MIN_ENTRIES,
+                                help=f"smallest inline list moved out (default: {MIN_ENTRIES})")
+
+    build = commands.add_parser('build', help="build a .dat file from plain lists")
+    build.add_argument('output')
+    build.add_argument('--geoip', action='append', metavar='CODE=FILE', help="CIDR list, one per line")
+    build.add_argument('--geosite', action='append', metavar='CODE=FILE',
+                       help="domain list, one per line (bare names are domain: entries)")
+
+    show = commands.add_parser('show', help="print the codes of a .dat file")
+    show.add_argument('file')
+    show.add_argument('--type', choices=['geoip', 'geosite'], required=True)
+    args = parser.parse_args()
+
+    if args.command == 'compile':
+        for config_path in args.configs:
+            compile_template(config_path, args.min_entries)
+    elif args.command == 'build':
+        if bool(args.geoip) == bool(args.geosite):
+            print("Error: Give either --geoip or --geosite lists; a .dat file holds one type.")
+            sys.exit(1)
+        if args.geoip:
+            data = encode_geoip(parse_list_args(args.geoip, load_cidr_list, '--geoip'))
+        else:
+            data = encode_geosite(parse_list_args(args.geosite, load_domain_list, '--geosite'))
+        write_atomic(os.path.abspath(args.output), data)
+        print(f">> Updated file saved: {args.output} ({len(data)} bytes)")
+    else:
+        lists = read_dat(args.file, decode_geoip if args.type == 'geoip' else decode_geosite)
+        if not lists:
+            print(f"Error: No lists in '{args.file}'.")
+            sys.exit(1)
+        for code, values in lists.items():
+            print(f"  {code:20}{len(values):>8} entries")
+
+
+if __name__ == "__main__":
+    main()
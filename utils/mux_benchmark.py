@@ -0,0 +1,200 @@
+#!/usr/bin/python3
+
+import argparse
+import asyncio
+import os
+import ssl
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+from upstream_probe import percentile
+
+# Frame: stream id, response size, payload length (all uint32), then payload.
+FRAME = struct.Struct('!III')
+
+
+def make_certificate(directory):
+    # Self-signed certificate for the stand-in upstream.
+    cert = os.path.join(directory, 'cert.pem')
+    key = os.path.join(directory, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'ec', '-pkeyopt', 'ec_paramgen_curve:prime256v1',
+                    '-nodes', '-days', '1', '-subj', '/CN=localhost', '-keyout', key, '-out', cert],
+                   check=True, capture_output=True)
+    return cert, key
+
+
+async def read_frame(reader):
+    stream_id, size, length = FRAME.unpack(await reader.readexactly(FRAME.size))
+    return stream_id, size, await reader.readexactly(length)
+
+
+async def serve_upstream(reader, writer):
+    # Answers every frame with `size` bytes on the same stream id; frames of
+    # one connection are handled concurrently, like streams over mux.
+    lock = asyncio.Lock()
+
+    async def answer(stream_id, size):
+        async with lock:
+            writer.write(FRAME.pack(stream_id, 0, size) + bytes(size))
+            await writer.drain()
+
+    tasks = set()
+    try:
+        while True:
+            stream_id, size, _ = await read_frame(reader)
+            task = asyncio.ensure_future(answer(stream_id, size))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+        # Cancelled: connections still open when the benchmark shuts down.
+        pass
+    finally:
+        writer.close()
+
+
+async def delay_proxy(target_port, one_way):
+    # Forwards to the upstream, delivering every chunk `one_way` seconds late
+    # in both directions, so the loopback hop behaves like a long-RTT link.
+    loop = asyncio.get_running_loop()
+
+    async def pipe(reader, writer):
+        try:
+            while data := await reader.read(65536):
+                loop.call_later(one_way, writer.write, data)
+        except ConnectionError:
+            pass
+        loop.call_later(one_way, writer.close)
+
+    async def handle(client_reader, client_writer):
+        # The local accept is instant; waiting one RTT stands in for the TCP
+        # handshake a real connection across the link would pay.
+        try:
+            await asyncio.sleep(2 * one_way)
+            upstream_reader, upstream_writer = await asyncio.open_connection('127.0.0.1', target_port)
+            await asyncio.gather(pipe(client_reader, upstream_writer), pipe(upstream_reader, client_writer))
+        except asyncio.CancelledError:
+            client_writer.close()
+
+    return await asyncio.start_server(handle, '127.0.0.1', 0)
+
+
+async def request_direct(port, context, size):
+    # One connection per request: TCP + TLS handshake, then the exchange.
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port, ssl=context, server_hostname='localhost')
+    writer.write(FRAME.pack(1, size, 0))
+    await read_frame(reader)
+    elapsed = time.perf_counter() - start
+    writer.close()
+    return elapsed
+
+
+class MuxClient:
+    # A single TLS connection; requests are streams on it.
+
+    def __init__(self, port, context):
+        self.port = port
+        self.context = context
+        self.pending = {}
+        self.next_id = 0
+        self.connected = None
+
+    async def connect(self):
+        reader, self.writer = await asyncio.open_connection(
+            '127.0.0.1', self.port, ssl=self.context, server_hostname='localhost')
+        self.reader_task = asyncio.ensure_future(self.dispatch(reader))
+
+    async def dispatch(self, reader):
+        try:
+            while True:
+                stream_id, _, _ = await read_frame(reader)
+                self.pending.pop(stream_id).set_result(None)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+    async def request(self, size):
+        start = time.perf_counter()
+        if self.connected is None:
+            self.connected = asyncio.ensure_future(self.connect())
+        # The first requests wait for the shared handshake, as on a fresh mux.
+        await self.connected
+        self.next_id += 1
+        future = self.pending[self.next_id] = asyncio.get_running_loop().create_future()
+        self.writer.write(FRAME.pack(self.next_id, size, 0))
+        await future
+        return time.perf_counter() - start
+
+    def close(self):
+        if self.connected is not None:
+            self.reader_task.cancel()
+            self.writer.close()
+
+
+async def run_mode(mux, port, context, requests, parallel, size):
+    client = MuxClient(port, context) if mux else None
+    semaphore = asyncio.Semaphore(parallel)
+
+    async def one():
+        async with semaphore:
+            if client:
+                return await client.request(size)
+            return await request_direct(port, context, size)
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(one() for _ in range(requests)))
+    total = time.perf_counter() - start
+    if client:
+        client.close()
+    return latencies, total
+
+
+async def benchmark(rtt, requests, parallel, size):
+    with tempfile.TemporaryDirectory() as tmp:
+        cert, key = make_certificate(tmp)
+        server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_context.load_cert_chain(cert, key)
+        client_context = ssl.create_default_context(cafile=cert)
+
+        upstream = await asyncio.start_server(serve_upstream, '127.0.0.1', 0, ssl=server_context)
+        proxy = await delay_proxy(upstream.sockets[0].getsockname()[1], rtt / 2)
+        port = proxy.sockets[0].getsockname()[1]
+        results = {}
+        for name, mux in (('no mux', False), ('mux', True)):
+            results[name] = await run_mode(mux, port, client_context, requests, parallel, size)
+        proxy.close()
+        upstream.close()
+        return results
+
+
+def print_results(results, rtt):
+    print(f"  {'mode':10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'total s':>10}")
+    for name, (latencies, total) in results.items():
+        print(f"  {name:10}" + ''.join(f"{percentile(latencies, q) * 1e3:>10.1f}" for q in (50, 90, 99))
+              + f"{total:>10.2f}")
+    direct = percentile(results['no mux'][0], 50)
+    muxed = percentile(results['mux'][0], 50)
+    print(f">> RTT {rtt * 1e3:.0f} ms: mux median latency is {direct / muxed:.1f}x lower")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare request latency over a delayed loopback link with and without multiplexing.")
+    parser.add_argument('--rtt', type=float, default=150, help="added round-trip time in ms (default: 150)")
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--parallel', type=int, default=8, help="requests in flight at once")
+    parser.add_argument('--size', type=int, default=4096, help="response bytes per request")
+    args = parser.parse_args()
+
+    try:
+        results = asyncio.run(benchmark(args.rtt / 1e3, args.requests, args.parallel, args.size))
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    print_results(results, args.rtt / 1e3)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/python3
+
+import argparse
+import base64
+import json
+import secrets
+import sys
+import time
+
+from cidr_compiler import load_config, save_config
+from user_registry import DEFAULT_DB, UserRegistry
+
+# Curve25519 (RFC 7748): field prime, (A - 2) / 4 and the base point's u.
+P = 2 ** 255 - 19
+A24 = 121665
+BASE_U = 9
+KEY_BYTES = 32
+# Xray accepts shortIds of up to 16 hex digits.
+SHORT_ID_BYTES = 8
+
+
+def x25519(scalar, u):
+    # RFC 7748 section 5: the Montgomery ladder over the u-coordinate, with
+    # conditional swaps instead of branches on the scalar's bits.
+    k = int.from_bytes(scalar, 'little')
+    k = (k & ~7 & ((1 << 254) - 1)) | (1 << 254)
+    x1 = int.from_bytes(u, 'little') & ((1 << 255) - 1)
+    x2, z2, x3, z3 = 1, 0, x1, 1
+    swap = 0
+    for t in reversed(range(255)):
+        bit = (k >> t) & 1
+        swap ^= bit
+        mask = -swap
+        x2, x3 = x2 ^ (mask & (x2 ^ x3)), x3 ^ (mask & (x2 ^ x3))
+        z2, z3 = z2 ^ (mask & (z2 ^ z3)), z3 ^ (mask & (z2 ^ z3))
+        swap = bit
+        a, b = x2 + z2, x2 - z2
+        c, d = x3 + z3, x3 - z3
+        aa, bb = a * a % P, b * b % P
+        e = aa - bb
+        da, cb = d * a % P, c * b % P
+        x3 = (da + cb) ** 2 % P
+        z3 = x1 * (da - cb) ** 2 % P
+        x2 = aa * bb % P
+        z2 = e * (aa + A24 * e) % P
+    mask = -swap
+    x2, x3 = x2 ^ (mask & (x2 ^ x3)), x3 ^ (mask & (x2 ^ x3))
+    z2, z3 = z2 ^ (mask & (z2 ^ z3)), z3 ^ (mask & (z2 ^ z3))
+    return (x2 * pow(z2, P - 2, P) % P).to_bytes(KEY_BYTES, 'little')
+
+
+def encode_key(raw):
+    # Xray prints and reads keys as unpadded base64url.
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def decode_key(text):
+    try:
+        raw = base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+    except ValueError:
+        raw = b''
+    if len(raw) != KEY_BYTES:
+        raise ValueError(f"Not a base64url X25519 key: {text!r}")
+    return raw
+
+
+def public_key(private_key):
+    return encode_key(x25519(decode_key(private_key), BASE_U.to_bytes(KEY_BYTES, 'little')))
+
+
+def generate_keypair():
+    # Clamped like `xray x25519` does, so the stored key is the scalar used.
+    raw = bytearray(secrets.token_bytes(KEY_BYTES))
+    raw[0] &= 248
+    raw[31] = (raw[31] & 127) | 64
+    private_key = encode_key(bytes(raw))
+    return private_key, public_key(private_key)
+
+
+def mint_short_ids(labels, length=SHORT_ID_BYTES, taken=()):
+    # One distinct shortId per label, e.g. per node slot or per user email.
+    if not 0 < length <= SHORT_ID_BYTES:
+        raise ValueError(f"shortId length must be 1-{SHORT_ID_BYTES} bytes")
+    seen = set(taken)
+    short_ids = {}
+    for label in labels:
+        short_id = secrets.token_hex(length)
+        while short_id in seen:
+            short_id = secrets.token_hex(length)
+        seen.add(short_id)
+        short_ids[label] = short_id
+    return short_ids
+
+
+def reality_settings(config):
+    for inbound in config.get('inbounds', []):
+        stream = inbound.get('streamSettings', {})
+        if stream.get('security') == 'reality':
+            yield stream.setdefault('realitySettings', {})
+
+
+def apply_reality(config, private_key=None, short_ids=None):
+    # Writes the key and the shortIds (a list, or a {label: shortId} map)
+    # into every REALITY inbound; returns the number of inbounds changed.
+    if isinstance(short_ids, dict):
+        short_ids = list(short_ids.values())
+    changed = 0
+    for settings in reality_settings(config):
+        if private_key is not None:
+            settings['privateKey'] = private_key
+        if short_ids is not None:
+            settings['shortIds'] = list(short_ids)
+        changed += 1
+    return changed
+
+
+def short_id_labels(count, users=()):
+    return [f'node-{i}' for i in range(count)] + list(users)
+
+
+def registry_emails(db_path):
+    registry = UserRegistry(db_path)
+    try:
+        return [user['email'] for user in registry.users()]
+    finally:
+        registry.close()
+
+
+def rotate_inventory(inventory, count, users=(), length=SHORT_ID_BYTES, templates=('xtl-reality',)):
+    # New keys and shortIds for every REALITY node; fleet.py renders them.
+    rotated = []
+    for node in inventory.get('nodes', []):
+        if node.get('template') not in templates:
+            continue
+        node['private_key'], node['public_key'] = generate_keypair()
+        node['short_ids'] = mint_short_ids(short_id_labels(count, users), length)
+        node.pop('short_id', None)
+        rotated.append(node['name'])
+    return rotated
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate REALITY X25519 keys and shortIds without xray or openssl and write them into configs.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    keys = commands.add_parser('keys', help="print X25519 key pairs like `xray x25519`")
+    keys.add_argument('--count', type=int, default=1)
+    keys.add_argument('-i', '--private-key', help="print the public key of this private key")
+
+    short = commands.add_parser('shortids', help="print random shortIds")
+    short.add_argument('--count', type=int, default=1)
+
+    apply = commands.add_parser('apply', help="write a new key and shortIds into the REALITY inbounds of configs")
+    apply.add_argument('configs', nargs='+')
+    apply.add_argument('-i', '--private-key', help="use this private key instead of a new one")
+    apply.add_argument('--map', help="also write the {label: shortId} map to this JSON file")
+
+    rotate = commands.add_parser('rotate', help="give every REALITY node of a fleet inventory new keys and shortIds")
+    rotate.add_argument('inventory')
+
+    for command in (short, apply, rotate):
+        command.add_argument('--length', type=int, default=SHORT_ID_BYTES, help="shortId bytes (default: 8)")
+    for command in (apply, rotate):
+        command.add_argument('--short-ids', type=int, default=1, help="shortIds per node (default: 1)")
+        command.add_argument('--users', action='store_true', help="add one shortId per registry user")
+        command.add_argument('--db', help=f"user registry (default: inventory 'registry' or {DEFAULT_DB})")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        if args.command == 'keys':
+            if args.private_key:
+                print(f"Private key: {args.private_key}\nPublic key: {public_key(args.private_key)}")
+                return
+            for _ in range(args.count):
+                private_key, public = generate_keypair()
+                print(f"Private key: {private_key}\nPublic key: {public}")
+        elif args.command == 'shortids':
+            print('\n'.join(mint_short_ids(range(args.count), args.length).values()))
+        elif args.command == 'apply':
+            users = registry_emails(args.db or DEFAULT_DB) if args.users else []
+            private_key = args.private_key
+            public = public_key(private_key) if private_key else None
+            if private_key is None:
+                private_key, public = generate_keypair()
+            short_ids = mint_short_ids(short_id_labels(args.short_ids, users), args.length)
+            for config_path in args.configs:
+                config = load_config(config_path)
+                if not apply_reality(config, private_key, short_ids):
+                    print(f">> {config_path}: no REALITY inbounds; skipped")
+                    continue
+                save_config(config, config_path)
+                print(f">> Updated file saved: {config_path}")
+            if args.map:
+                with open(args.map, 'w', encoding='utf-8') as f:
+                    json.dump(short_ids, f, indent=2)
+                    f.write('\n')
+                print(f">> Updated file saved: {args.map}")
+            print(f"Public key: {public}")
+            print(f">> {len(short_ids)} shortIds in {(time.perf_counter() - start) * 1e3:.1f} ms")
+        else:
+            with open(args.inventory, 'r', encoding='utf-8') as f:
+                inventory = json.load(f)
+            users = registry_emails(args.db or inventory.get('registry', DEFAULT_DB)) if args.users else []
+            rotated = rotate_inventory(inventory, args.short_ids, users, args.length)
+            with open(args.inventory, 'w', encoding='utf-8') as f:
+                json.dump(inventory, f, indent=2)
+                f.write('\n')
+            elapsed = time.perf_counter() - start
+            print(f">> Rotated keys of {len(rotated)} nodes in {elapsed * 1e3:.1f} ms: {', '.join(rotated)}")
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
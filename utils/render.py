@@ -0,0 +1,101 @@
+import json
+import os
+import re
+import uuid
+from functools import lru_cache
+
+PLACEHOLDER_RE = re.compile(r'<([A-Z0-9][A-Z0-9_.-]*)>')
+
+
+class RenderError(ValueError):
+    pass
+
+
+def find_slots(node, path=()):
+    # Yields (path, text, names) for every string holding a placeholder.
+    if isinstance(node, dict):
+        for key, value in node.items():
+            yield from find_slots(value, path + (key,))
+    elif isinstance(node, list):
+        for index, value in enumerate(node):
+            yield from find_slots(value, path + (index,))
+    elif isinstance(node, str):
+        names = PLACEHOLDER_RE.findall(node)
+        if names:
+            yield path, node, names
+
+
+def copy_tree(node):
+    # Plain recursive copy; much cheaper than copy.deepcopy for JSON data.
+    if isinstance(node, dict):
+        return {key: copy_tree(value) for key, value in node.items()}
+    if isinstance(node, list):
+        return [copy_tree(value) for value in node]
+    return node
+
+
+class Template:
+    # A JSON template parsed once, with the location of every placeholder
+    # cached as a JSON path so rendering never rescans the document.
+
+    def __init__(self, data):
+        self.data = data
+        self.slots = list(find_slots(data))
+        self.placeholders = {name for _, _, names in self.slots for name in names}
+
+    def render(self, values, strict=True):
+        config = copy_tree(self.data)
+        leftover = set()
+        for path, text, names in self.slots:
+            if len(names) == 1 and text == f'<{names[0]}>':
+                value = values.get(names[0], text)
+            else:
+                value = PLACEHOLDER_RE.sub(lambda m: str(values.get(m.group(1), m.group(0))), text)
+            if isinstance(value, str):
+                leftover.update(PLACEHOLDER_RE.findall(value))
+            parent = config
+            for key in path[:-1]:
+                parent = parent[key]
+            parent[path[-1]] = value
+        if strict:
+            validate(values, leftover)
+        return config
+
+    def render_text(self, values, strict=True):
+        return dumps(self.render(values, strict))
+
+
+def validate(values, leftover=()):
+    if leftover:
+        raise RenderError(f"Unfilled placeholders: {', '.join(sorted(f'<{n}>' for n in leftover))}")
+    for name, value in values.items():
+        if name.endswith('UUID') and value:
+            try:
+                uuid.UUID(str(value))
+            except ValueError:
+                raise RenderError(f"Invalid UUID for <{name}>: {value}")
+
+
+def dumps(config):
+    return json.dumps(config, indent=2) + '\n'
+
+
+@lru_cache(maxsize=32)
+def parse_template(text):
+    return Template(json.loads(text))
+
+
+@lru_cache(maxsize=32)
+def _load_template(path, mtime_ns):
+    with open(path, 'r', encoding='utf-8') as f:
+        return Template(json.load(f))
+
+
+def load_template(path):
+    # Cached per file; editing the file invalidates the cache entry.
+    path = os.path.abspath(path)
+    return _load_template(path, os.stat(path).st_mtime_ns)
+
+
+def render_text(text, values, strict=True):
+    return parse_template(text).render_text(values, strict)
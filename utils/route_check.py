@@ -0,0 +1,344 @@
+#!/usr/bin/python3
+
+import argparse
+import bisect
+import ipaddress
+import socket
+import sys
+import time
+from collections import Counter
+from functools import lru_cache
+
+from cidr_compiler import REPO_ROOT, load_cidr_list, load_config, parse_ip_entry, parse_list_args, routing_rules
+from domain_matcher import CompiledMatcher, load_domain_list
+from geodat import load_ext, template_assets
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DEFAULT_CONFIG = REPO_ROOT.joinpath('bridge/xray/config/config.json')
+PRIVATE_NETWORKS = [
+    '0.0.0.0/8', '10.0.0.0/8', '100.64.0.0/10', '127.0.0.0/8', '169.254.0.0/16',
+    '172.16.0.0/12', '192.0.0.0/24', '192.0.2.0/24', '192.88.99.0/24', '192.168.0.0/16',
+    '198.18.0.0/15', '198.51.100.0/24', '203.0.113.0/24', '224.0.0.0/3',
+    '::/127', 'fc00::/7', 'fe80::/10', 'ff00::/8',
+]
+CHUNK_SIZE = 65536
+
+
+class IPIndex:
+    # Disjoint address segments, each mapped to the ordered rules that contain it.
+
+    def __init__(self, rule_networks):
+        self.starts = {4: [], 6: []}
+        self.rules = {4: [], 6: []}
+        for version in (4, 6):
+            events = []
+            for rule_index, networks in rule_networks.items():
+                for network in networks:
+                    if network.version == version:
+                        events.append((int(network.network_address), 1, rule_index))
+                        events.append((int(network.broadcast_address) + 1, -1, rule_index))
+            events.sort()
+            active = Counter()
+            starts, rules = self.starts[version], self.rules[version]
+            pos = 0
+            while pos < len(events):
+                address = events[pos][0]
+                while pos < len(events) and events[pos][0] == address:
+                    _, delta, rule_index = events[pos]
+                    active[rule_index] += delta
+                    if not active[rule_index]:
+                        del active[rule_index]
+                    pos += 1
+                current = tuple(sorted(active))
+                if rules and rules[-1] == current:
+                    continue
+                starts.append(address)
+                rules.append(current)
+        self.array = None
+        if numpy is not None and self.starts[4] and self.starts[4][-1] < 2 ** 63:
+            self.array = numpy.array(self.starts[4], dtype=numpy.int64)
+
+    def lookup(self, address, version=4):
+        pos = bisect.bisect_right(self.starts[version], address) - 1
+        return self.rules[version][pos] if pos >= 0 else ()
+
+    def lookup_many(self, addresses):
+        # Vectorized IPv4 lookup when NumPy is available.
+        if self.array is None:
+            return [self.lookup(a) for a in addresses]
+        positions = numpy.searchsorted(self.array, numpy.array(addresses, dtype=numpy.int64),
+                                       side='right') - 1
+        rules = self.rules[4]
+        return [rules[p] if p >= 0 else () for p in positions.tolist()]
+
+
+def parse_ports(value):
+    ranges = []
+    for part in str(value).split(','):
+        low, _, high = part.strip().partition('-')
+        ranges.append((int(low), int(high or low)))
+    return ranges
+
+
+class Router:
+
+    def __init__(self, config, geoip=None, geosite=None, resolve=False):
+        self.geoip = {'private': [ipaddress.ip_network(n) for n in PRIVATE_NETWORKS]}
+        self.geoip.update(geoip or {})
+        self.geosite = geosite or {}
+        self.warnings = []
+        self.resolve = resolve
+        routing = config.get('routing', {})
+        self.domain_strategy = routing.get('domainStrategy', 'AsIs')
+
+        outbounds = config.get('outbounds', [])
+        self.default = outbound_label(outbounds[0]) if outbounds else 'direct'
+        self.rules = []
+        rule_networks = {}
+        api_tag = config.get('api', {}).get('tag')
+        for index, rule in enumerate(routing_rules(config)):
+            if api_tag and rule.get('inboundTag') == [api_tag]:
+                # Only the API inbound's own traffic; never client destinations.
+                continue
+            target = rule.get('outboundTag') or rule.get('balancerTag') or self.default
+            unsupported = set(rule) - {'type', 'outboundTag', 'balancerTag', 'domain',
+                                       'domains', 'ip', 'port', 'network', 'ruleTag'}
+            if unsupported:
+                self.warnings.append(
+                    f"rule #{index} ignored: unsupported conditions {sorted(unsupported)}")
+                continue
+            domains = self._expand_domains(index, rule.get('domain', rule.get('domains', [])))
+            networks = self._expand_ips(index, rule.get('ip', []))
+            if 'ip' in rule:
+                rule_networks[index] = networks
+            ports = parse_ports(rule['port']) if 'port' in rule else None
+            network = set(rule['network'].replace(' ', '').split(',')) if 'network' in rule else None
+            matcher = CompiledMatcher(domains) if 'domain' in rule or 'domains' in rule else None
+            self.rules.append((index, target, matcher, 'ip' in rule, ports, network))
+        self.ip_index = IPIndex(rule_networks)
+        self.by_index = {rule[0]: rule for rule in self.rules}
+        # Per router, so the cache and its tables go away with the router.
+        self.route_domain = lru_cache(maxsize=262144)(self._route_domain)
+
+    def _expand_domains(self, index, entries):
+        expanded = []
+        for entry in entries:
+            if entry.startswith(('geosite:', 'ext:')):
+                # ext:FILE:CODE lists are keyed 'FILE:CODE' (see geodat.load_ext).
+                code = entry.split(':', 1)[1].lower()
+                if code in self.geosite:
+                    expanded.extend(self.geosite[code])
+                else:
+                    self.warnings.append(f"rule #{index}: {entry} not loaded; it will never match")
+            else:
+                expanded.append(entry)
+        return expanded
+
+    def _expand_ips(self, index, entries):
+        networks = []
+        for entry in entries:
+            if entry.startswith(('geoip:', 'ext:')):
+                code = entry.split(':', 1)[1].lower()
+                if code in self.geoip:
+                    networks.extend(self.geoip[code])
+                else:
+                    self.warnings.append(f"rule #{index}: {entry} not loaded; it will never match")
+                continue
+            network = parse_ip_entry(entry)
+            if network is None:
+                self.warnings.append(f"rule #{index}: cannot evaluate '{entry}'")
+            else:
+                networks.append(network)
+        return networks
+
+    def _conditions(self, rule, port, network):
+        _, _, _, _, ports, networks = rule
+        if ports is not None and (port is None or not any(a <= port <= b for a, b in ports)):
+            return False
+        if networks is not None and network not in networks:
+            return False
+        return True
+
+    def route_ip(self, address, version=4, port=None, network='tcp', candidates=None):
+        if candidates is None:
+            candidates = self.ip_index.lookup(address, version)
+        for rule in self.rules:
+            matcher, has_ip = rule[2], rule[3]
+            if matcher is not None:
+                continue
+            if has_ip and rule[0] not in candidates:
+                continue
+            if self._conditions(rule, port, network):
+                return rule[1], rule[0]
+        return self.default, None
+
+    def _route_domain(self, domain, port=None, network='tcp'):
+        domain = domain.lower().rstrip('.')
+        for rule in self.rules:
+            matcher, has_ip = rule[2], rule[3]
+            if has_ip:
+                continue
+            if matcher is not None and not matcher.match(domain):
+                continue
+            if self._conditions(rule, port, network):
+                return rule[1], rule[0]
+        if self.resolve and self.domain_strategy in ('IPIfNonMatch', 'IPOnDemand'):
+            try:
+                address = socket.gethostbyname(domain)
+            except OSError:
+                return self.default, None
+            return self.route_ip(int.from_bytes(socket.inet_aton(address), 'big'), 4, port, network)
+        return self.default, None
+
+    def route(self, destination, network='tcp'):
+        host, port = split_destination(destination)
+        try:
+            address = int.from_bytes(socket.inet_pton(socket.AF_INET, host), 'big')
+            return self.route_ip(address, 4, port, network)
+        except OSError:
+            pass
+        if ':' in host:
+            try:
+                address = int.from_bytes(socket.inet_pton(socket.AF_INET6, host), 'big')
+                return self.route_ip(address, 6, port, network)
+            except OSError:
+                pass
+        return self.route_domain(host, port, network)
+
+    def matches(self, destination, network='tcp'):
+        # Every rule the destination satisfies, regardless of order.
+        host, port = split_destination(destination)
+        address = None
+        for family, version in ((socket.AF_INET, 4), (socket.AF_INET6, 6)):
+            try:
+                address = int.from_bytes(socket.inet_pton(family, host), 'big')
+                break
+            except OSError:
+                pass
+        if address is not None:
+            candidates = self.ip_index.lookup(address, version)
+        else:
+            host = host.lower().rstrip('.')
+        matched = []
+        for rule in self.rules:
+            matcher, has_ip = rule[2], rule[3]
+            if address is not None:
+                if matcher is not None or has_ip and rule[0] not in candidates:
+                    continue
+            elif has_ip or matcher is not None and not matcher.match(host):
+                continue
+            if self._conditions(rule, port, network):
+                matched.append(rule[0])
+        return matched
+
+    def route_many(self, destinations, network='tcp'):
+        # IPv4 addresses without a port go through the batched index lookup.
+        results = [None] * len(destinations)
+        batch, positions = [], []
+        for pos, destination in enumerate(destinations):
+            try:
+                batch.append(int.from_bytes(socket.inet_pton(socket.AF_INET, destination), 'big'))
+                positions.append(pos)
+            except OSError:
+                results[pos] = self.route(destination, network)
+        if batch:
+            for pos, address, candidates in zip(positions, batch, self.ip_index.lookup_many(batch)):
+                results[pos] = self.route_ip(address, 4, None, network, candidates)
+        return results
+
+
+def outbound_label(outbound):
+    return outbound.get('tag') or outbound.get('protocol', 'unknown')
+
+
+def split_destination(destination):
+    if destination.startswith('['):
+        host, _, rest = destination[1:].partition(']')
+        return host, int(rest[1:]) if rest.startswith(':') else None
+    if destination.count(':') == 1:
+        host, _, port = destination.partition(':')
+        if port.isdigit():
+            return host, int(port)
+    return destination, None
+
+
+def read_chunks(files):
+    for file_path in files:
+        f = sys.stdin if file_path == '-' else open(file_path, 'r', encoding='utf-8')
+        try:
+            chunk = []
+            for line in f:
+                line = line.strip()
+                if line:
+                    chunk.append(line)
+                    if len(chunk) >= CHUNK_SIZE:
+                        yield chunk
+                        chunk = []
+            if chunk:
+                yield chunk
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay Xray routing rules offline and report the outbound for each destination.")
+    parser.add_argument('destinations', nargs='*', default=['-'],
+                        help="files with one IP, domain or host:port per line ('-' for stdin)")
+    parser.add_argument('-c', '--config', default=DEFAULT_CONFIG,
+                        help="config.json to load the routing rules from (default: bridge)")
+    parser.add_argument('--geoip', action='append', metavar='CODE=FILE',
+                        help="plain CIDR list used for geoip:CODE")
+    parser.add_argument('--geosite', action='append', metavar='CODE=FILE',
+                        help="domain list used for geosite:CODE")
+    parser.add_argument('--assets', metavar='DIR',
+                        help="directory with the .dat files of ext:FILE:CODE entries (default: the template's xray/assets)")
+    parser.add_argument('--network', default='tcp', choices=['tcp', 'udp'])
+    parser.add_argument('--resolve', action='store_true',
+                        help="resolve unmatched domains as domainStrategy IPIfNonMatch does")
+    parser.add_argument('--summary', action='store_true',
+                        help="print totals per outbound and rule instead of one line per destination")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    geoip = parse_list_args(args.geoip, load_cidr_list, '--geoip')
+    geosite = parse_list_args(args.geosite, load_domain_list, '--geosite')
+    ext_geoip, ext_geosite = load_ext(config, args.assets or template_assets(args.config))
+    router = Router(config, dict(ext_geoip, **geoip), dict(ext_geosite, **geosite), args.resolve)
+    for warning in router.warnings:
+        print(f"Warning: {warning}", file=sys.stderr)
+
+    outbounds = Counter()
+    rules = Counter()
+    total = 0
+    start = time.perf_counter()
+    out = sys.stdout
+    for chunk in read_chunks(args.destinations):
+        results = router.route_many(chunk, args.network)
+        total += len(chunk)
+        if args.summary:
+            for outbound, rule_index in results:
+                outbounds[outbound] += 1
+                rules[rule_index] += 1
+        else:
+            out.write(''.join(f"{d}\t{o}\t{'-' if r is None else r}\n"
+                              for d, (o, r) in zip(chunk, results)))
+    elapsed = time.perf_counter() - start
+
+    if args.summary:
+        print(f"{total} destinations in {elapsed:.2f}s")
+        for outbound, count in outbounds.most_common():
+            print(f"  {outbound:16}{count:>12}")
+        print("By rule:")
+        for rule_index, count in sorted(rules.items(), key=lambda item: (item[0] is None, item[0] or 0)):
+            label = 'default' if rule_index is None else f'#{rule_index}'
+            print(f"  {label:16}{count:>12}")
+
+
+if __name__ == "__main__":
+    main()
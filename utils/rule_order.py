@@ -0,0 +1,353 @@
+#!/usr/bin/python3
+
+import argparse
+import copy
+import ipaddress
+import math
+import random
+import sys
+from collections import Counter
+
+from access_log import open_log, parse_line
+from cidr_compiler import DEFAULT_CONFIGS, GEO_PREFIXES, IntervalIndex, load_cidr_list, load_config, \
+    parse_ip_entry, parse_list_args, routing_rules, save_config
+from domain_matcher import CompiledMatcher, load_domain_list, parse_domain_entry
+from geodat import load_ext, template_assets
+from route_check import Router, split_destination
+
+# Rough relative cost of evaluating a rule, in hash lookups. Xray matches
+# full:/domain: entries through a hash set, runs every keyword and regexp in
+# turn, and bisects the sorted ranges of an IP rule. A rule that does not
+# apply to the destination (an IP rule for a domain that has not been
+# resolved, and vice versa) is skipped almost for free.
+DOMAIN_COST = 1.0
+KEYWORD_COST = 1.0
+REGEXP_COST = 8.0
+BISECT_COST = 0.25
+SKIP_COST = 0.1
+# Ranges assumed for a geoip:/ext: list that was not loaded with --geoip.
+GEOIP_RANGES = 1000
+DOMAIN_KEYS = {'type', 'outboundTag', 'balancerTag', 'domain', 'domains', 'ruleTag'}
+IP_KEYS = {'type', 'outboundTag', 'balancerTag', 'ip', 'ruleTag'}
+ADDRESS_TYPES = {4: ipaddress.IPv4Address, 6: ipaddress.IPv6Address}
+
+
+class RuleInfo:
+    # What the optimizer needs to know about one rule: its kind ('domain',
+    # 'ip', 'any' for port/network-only, or 'opaque' for anything the
+    # offline router cannot evaluate), target and evaluation cost.
+
+    def __init__(self, index, rule, router):
+        self.index = index
+        self.rule = rule
+        self.target = rule.get('outboundTag') or rule.get('balancerTag') or router.default
+        parsed = router.by_index.get(index)
+        has_domain = 'domain' in rule or 'domains' in rule
+        if parsed is None or has_domain and 'ip' in rule:
+            self.kind = 'opaque'
+        elif has_domain:
+            self.kind = 'domain'
+        elif 'ip' in rule:
+            self.kind = 'ip'
+        else:
+            self.kind = 'any'
+        self.ports = parsed[4] if parsed else None
+        self.networks = parsed[5] if parsed else None
+        self.unconditional = set(rule) <= (DOMAIN_KEYS if self.kind == 'domain' else IP_KEYS)
+        self.unknown_geo = any(e.startswith(GEO_PREFIXES) and e.split(':', 1)[1].lower() not in router.geoip
+                               for e in rule.get('ip', []))
+        self.cost = self._cost(router)
+
+    def _cost(self, router):
+        if self.kind == 'domain':
+            kinds = Counter(parse_domain_entry(e)[0] for e in self.rule.get('domain', self.rule.get('domains', [])))
+            return DOMAIN_COST + KEYWORD_COST * kinds['keyword'] + REGEXP_COST * kinds['regexp']
+        if self.kind == 'ip':
+            ranges = 0
+            for entry in self.rule['ip']:
+                if entry.startswith(GEO_PREFIXES):
+                    code = entry.split(':', 1)[1].lower()
+                    ranges += len(router.geoip[code]) if code in router.geoip else GEOIP_RANGES
+                else:
+                    ranges += 1
+            return 1 + BISECT_COST * math.log2(ranges + 1)
+        return 1.0
+
+    def cost_for(self, is_ip):
+        if self.kind in ('domain', 'ip') and (self.kind == 'ip') != is_ip:
+            return SKIP_COST
+        return self.cost
+
+
+def ip_overlaps(router):
+    # Pairs of IP rules that share at least one address.
+    pairs = set()
+    for version in (4, 6):
+        for indices in router.ip_index.rules[version]:
+            for pos, a in enumerate(indices):
+                for b in indices[pos + 1:]:
+                    pairs.add((a, b))
+    return pairs
+
+
+def may_overlap(a, b, domain_strategy, ip_pairs):
+    # False only when no destination can satisfy both rules.
+    if 'opaque' in (a.kind, b.kind):
+        return True
+    if a.ports is not None and b.ports is not None and not any(
+            low_a <= high_b and low_b <= high_a for low_a, high_a in a.ports for low_b, high_b in b.ports):
+        return False
+    if a.networks is not None and b.networks is not None and not a.networks & b.networks:
+        return False
+    if {a.kind, b.kind} == {'domain', 'ip'}:
+        # Domain and IP conditions only meet when IPOnDemand resolves the
+        # domain while the domain rules are still being evaluated.
+        return domain_strategy == 'IPOnDemand'
+    if a.kind == b.kind == 'ip' and not (a.unknown_geo or b.unknown_geo):
+        return (min(a.index, b.index), max(a.index, b.index)) in ip_pairs
+    return True
+
+
+def dead_rules(infos, router):
+    # {index: reason} for rules every destination of which is matched by an
+    # earlier rule without extra conditions.
+    dead = {}
+    domain_entries, ip_entries, ip_networks = [], set(), []
+    for info in infos:
+        entries = info.rule.get('domain', info.rule.get('domains', [])) if info.kind == 'domain' else \
+            info.rule.get('ip', [])
+        if info.kind == 'domain' and entries:
+            literal = set(domain_entries)
+            earlier = CompiledMatcher(domain_entries)
+            if all(entry in literal or parse_domain_entry(entry)[0] in ('full', 'domain')
+                   and earlier.covers(*parse_domain_entry(entry)) for entry in entries):
+                dead[info.index] = 'every domain is matched by an earlier rule'
+        elif info.kind == 'ip' and entries:
+            index = IntervalIndex(ip_networks)
+            covered = True
+            for entry in entries:
+                if entry in ip_entries:
+                    continue
+                if entry.startswith(GEO_PREFIXES):
+                    networks = router.geoip.get(entry.split(':', 1)[1].lower())
+                else:
+                    network = parse_ip_entry(entry)
+                    networks = [network] if network is not None else None
+                if networks is None or not all(index.covers(n) for n in networks):
+                    covered = False
+                    break
+            if covered:
+                dead[info.index] = 'every address is matched by an earlier rule'
+        if info.unconditional and info.index not in dead:
+            if info.kind == 'domain':
+                domain_entries += entries
+            elif info.kind == 'ip':
+                ip_entries.update(entries)
+                ip_networks += router._expand_ips(info.index, entries)
+    return dead
+
+
+def profile_destinations(log_files, destination_files):
+    # Destination hit counts from access logs and plain destination lists.
+    counts = Counter()
+    for file_path in log_files:
+        with open_log(file_path) as f:
+            for raw in f:
+                record = parse_line(raw.decode('utf-8', 'replace'))
+                if record and record['status'] == 'accepted':
+                    counts[record['host']] += 1
+    for file_path in destination_files:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    counts[line] += 1
+    return counts
+
+
+def is_ip(destination):
+    host, _ = split_destination(destination)
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+def model_cost(order, infos, profile):
+    # Mean cost per destination of evaluating rules in `order` until one matches.
+    total = weight = 0.0
+    for (destination, is_ip_destination, matched), count in profile.items():
+        cost = 0.0
+        for index in order:
+            info = infos[index]
+            cost += info.cost_for(is_ip_destination)
+            if index in matched:
+                break
+        total += cost * count
+        weight += count
+    return total / weight if weight else 0.0
+
+
+def optimize(infos, order, profile, domain_strategy, ip_pairs):
+    # Greedy topological sort: among the rules whose conflicting predecessors
+    # are placed, take the one with most hits per unit of cost. Two rules
+    # conflict when they go to different targets and a destination may match
+    # both; keeping those in their original relative order keeps the first
+    # matching target of every destination.
+    hits = Counter()
+    share_ip = sum(count for (_, ip, _), count in profile.items() if ip)
+    share = share_ip / sum(profile.values()) if profile else 0.5
+    for (_, _, matched), count in profile.items():
+        for index in matched:
+            hits[index] += count
+    before = {index: set() for index in order}
+    for pos, a in enumerate(order):
+        for b in order[pos + 1:]:
+            if infos[a].target != infos[b].target and may_overlap(infos[a], infos[b], domain_strategy, ip_pairs):
+                before[b].add(a)
+
+    def score(index):
+        info = infos[index]
+        cost = share * info.cost_for(True) + (1 - share) * info.cost_for(False)
+        return (-hits[index] / cost, order.index(index))
+
+    placed, result = set(), []
+    while len(result) < len(order):
+        ready = [index for index in order if index not in placed and before[index] <= placed]
+        index = min(ready, key=score)
+        placed.add(index)
+        result.append(index)
+    return result
+
+
+def sample_destinations(infos, router, count=10000, seed=1):
+    # Destinations to check the optimized rules against: both ends of every
+    # CIDR and the addresses just outside, every literal domain and a
+    # subdomain of it, port range ends, and random IPv4 addresses.
+    rng = random.Random(seed)
+    hosts = set()
+    ports = set()
+    for info in infos:
+        if info.kind == 'ip':
+            for network in router._expand_ips(info.index, info.rule['ip']):
+                limit = 2 ** network.max_prefixlen - 1
+                for address in (int(network.network_address) - 1, int(network.network_address),
+                                int(network.broadcast_address), int(network.broadcast_address) + 1):
+                    if 0 <= address <= limit:
+                        hosts.add(str(ADDRESS_TYPES[network.version](address)))
+        elif info.kind == 'domain':
+            for entry in router._expand_domains(info.index, info.rule.get('domain', info.rule.get('domains', []))):
+                kind, value = parse_domain_entry(entry)
+                if kind in ('full', 'domain'):
+                    hosts.update((value, f'www.{value}'))
+                elif kind == 'keyword':
+                    hosts.add(f'{value}.com')
+        for low, high in info.ports or []:
+            ports.update(p for p in (low - 1, low, high, high + 1) if 0 < p < 65536)
+    hosts.update(str(ipaddress.IPv4Address(rng.getrandbits(32))) for _ in range(count))
+    hosts.update(f'example.{tld}' for tld in ('com', 'net', 'org', 'ir'))
+    destinations = sorted(hosts)
+    for port in sorted(ports):
+        destinations += [f'example.com:{port}', f'1.1.1.1:{port}']
+    return destinations
+
+
+def check_equivalence(config, optimized, destinations, geoip, geosite):
+    # Destinations whose outbound differs between the two configs.
+    differences = []
+    for network in ('tcp', 'udp'):
+        old = Router(config, geoip, geosite).route_many(destinations, network)
+        new = Router(optimized, geoip, geosite).route_many(destinations, network)
+        for destination, (a, _), (b, _) in zip(destinations, old, new):
+            if a != b:
+                differences.append((network, destination, a, b))
+    return differences
+
+
+def optimize_config(config_path, counts, geoip, geosite, samples=10000, write=False):
+    config = load_config(config_path)
+    print(f">> {config_path}")
+    ext_geoip, ext_geosite = load_ext(config, template_assets(config_path))
+    geoip, geosite = dict(ext_geoip, **geoip), dict(ext_geosite, **geosite)
+    router = Router(config, geoip, geosite)
+    for warning in router.warnings:
+        print(f"Warning: {warning}", file=sys.stderr)
+    domain_strategy = config.get('routing', {}).get('domainStrategy', 'AsIs')
+    rules = routing_rules(config)
+    infos = [RuleInfo(index, rule, router) for index, rule in enumerate(rules)]
+
+    dead = dead_rules(infos, router)
+    for index, reason in dead.items():
+        print(f"  rule #{index} (outboundTag: {infos[index].target}) never matches: {reason}")
+    order = [info.index for info in infos if info.index not in dead]
+
+    profile = Counter()
+    for destination, count in counts.items():
+        profile[(destination, is_ip(destination), frozenset(router.matches(destination)))] += count
+    optimized_order = optimize(infos, order, profile, domain_strategy, ip_overlaps(router))
+    before = model_cost(list(range(len(infos))), infos, profile)
+    after = model_cost(optimized_order, infos, profile)
+    if profile and after >= model_cost(order, infos, profile):
+        optimized_order = order
+        after = model_cost(order, infos, profile)
+    print(f"  order: {' '.join(f'#{i}' for i in range(len(infos)))} -> "
+          f"{' '.join(f'#{i}' for i in optimized_order)}")
+    if profile:
+        print(f"  modeled cost per destination over {sum(counts.values())} hits: "
+              f"{before:.2f} -> {after:.2f}")
+
+    optimized = copy.deepcopy(config)
+    optimized_rules = routing_rules(optimized)
+    optimized_rules[:] = [optimized_rules[index] for index in optimized_order]
+    destinations = sorted(set(sample_destinations(infos, router, samples)) | set(counts))
+    differences = check_equivalence(config, optimized, destinations, geoip, geosite)
+    print(f"  equivalence: {len(destinations)} destinations x tcp/udp, {len(differences)} differences")
+    for network, destination, a, b in differences[:20]:
+        print(f"    {network} {destination}: {a} -> {b}")
+    if differences:
+        return False
+    if write and optimized_order != list(range(len(infos))):
+        save_config(optimized, config_path)
+        print(f">> Updated file saved: {config_path}")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Reorder Xray routing rules by hit count and cost where it keeps every route unchanged, "
+                    "and drop rules that can never match.")
+    parser.add_argument('configs', nargs='*', default=DEFAULT_CONFIGS,
+                        help="config.json files to optimize (default: bridge and xtl-reality)")
+    parser.add_argument('--log', action='append', default=[], metavar='FILE',
+                        help="access log (.gz too) whose accepted destinations are the hit profile")
+    parser.add_argument('--destinations', action='append', default=[], metavar='FILE',
+                        help="file with one destination per line, added to the hit profile")
+    parser.add_argument('--geoip', action='append', metavar='CODE=FILE',
+                        help="plain CIDR list used for geoip:CODE")
+    parser.add_argument('--geosite', action='append', metavar='CODE=FILE',
+                        help="domain list used for geosite:CODE")
+    parser.add_argument('--samples', type=int, default=10000,
+                        help="random IPv4 addresses added to the equivalence check")
+    parser.add_argument('--write', action='store_true',
+                        help="save the optimized rules when the equivalence check passes")
+    args = parser.parse_args()
+
+    try:
+        counts = profile_destinations(args.log, args.destinations)
+    except FileNotFoundError as e:
+        print(f"Error: File '{e.filename}' not found.")
+        sys.exit(1)
+    geoip = parse_list_args(args.geoip, load_cidr_list, '--geoip')
+    geosite = parse_list_args(args.geosite, load_domain_list, '--geosite')
+    failed = False
+    for config_path in args.configs:
+        if not optimize_config(config_path, counts, geoip, geosite, args.samples, args.write):
+            failed = True
+    if failed:
+        print("Error: The optimized rules route some destinations differently; nothing was written.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
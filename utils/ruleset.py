@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+
+import argparse
+import hashlib
+import json
+import sys
+from pathlib import Path
+
+from cidr_compiler import DEFAULT_CONFIGS, REPO_ROOT, load_config, routing_rules, save_config
+from geodat import MIN_ENTRIES, encode_geoip, encode_geosite, externalize, mount_assets, template_assets
+from render import copy_tree
+from subscriptions import write_atomic
+
+# Canonical rule sets live in rulesets/<name>.json as {"routing": {"rules": [...]}}
+# with their lists inline, so cidr_compiler, domain_matcher, rule_order and
+# route_check -c work on them directly.
+DEFAULT_RULESET = REPO_ROOT.joinpath('rulesets/iran.json')
+
+
+class RuleSet:
+    # A rule set compiled once: the rules as injected into configs (tagged
+    # with the set's name, lists replaced by ext: references) and the asset
+    # files they need, keyed by the hash of the rules' content.
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.name = self.path.stem
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        canonical = json.dumps(routing_rules(data), sort_keys=True, separators=(',', ':'))
+        self.digest = hashlib.sha256(canonical.encode()).hexdigest()
+        geoip, geosite = externalize(data, f'{self.name}-ip.dat', f'{self.name}-site.dat', MIN_ENTRIES)
+        self.rules = [dict(rule, ruleTag=self.name) for rule in routing_rules(data)]
+        self.assets = {f'{self.name}.sha256': f'{self.digest}\n'.encode()}
+        if geoip:
+            self.assets[f'{self.name}-ip.dat'] = encode_geoip(geoip)
+        if geosite:
+            self.assets[f'{self.name}-site.dat'] = encode_geosite(geosite)
+
+    def stamp(self, assets_dir):
+        # The digest the assets in `assets_dir` were written from, if any.
+        stamp_path = Path(assets_dir).joinpath(f'{self.name}.sha256')
+        return stamp_path.read_text().strip() if stamp_path.exists() else None
+
+    def write_assets(self, assets_dir):
+        assets_dir = Path(assets_dir)
+        assets_dir.mkdir(parents=True, exist_ok=True)
+        # A list that got too short to externalize leaves no stale .dat behind.
+        for file_name in (f'{self.name}-ip.dat', f'{self.name}-site.dat'):
+            if file_name not in self.assets and assets_dir.joinpath(file_name).exists():
+                assets_dir.joinpath(file_name).unlink()
+        # The stamp goes last, so an interrupted write is redone next time.
+        for file_name, data in sorted(self.assets.items(), key=lambda item: item[0].endswith('.sha256')):
+            write_atomic(str(assets_dir.joinpath(file_name)), data)
+        return sorted(self.assets)
+
+
+def inject(config, ruleset):
+    # Replaces the rules tagged with the rule set's name by the current ones,
+    # at the position of the first; other rules (API, balancer) stay put.
+    # Returns False when the config does not use the rule set.
+    rules = routing_rules(config)
+    positions = [pos for pos, rule in enumerate(rules) if rule.get('ruleTag') == ruleset.name]
+    if not positions:
+        return False
+    rules[:] = [rule for rule in rules if rule.get('ruleTag') != ruleset.name]
+    rules[positions[0]:positions[0]] = copy_tree(ruleset.rules)
+    return True
+
+
+def sync_template(config_path, ruleset, force=False):
+    assets_dir = template_assets(config_path)
+    if not force and ruleset.stamp(assets_dir) == ruleset.digest:
+        print(f">> {config_path}: up to date ({ruleset.digest[:12]})")
+        return False
+    config = load_config(config_path)
+    if not inject(config, ruleset):
+        print(f">> {config_path}: no rules tagged '{ruleset.name}'; skipped")
+        return False
+    save_config(config, config_path)
+    print(f">> Updated file saved: {config_path}")
+    for file_name in ruleset.write_assets(assets_dir):
+        print(f">> Updated file saved: {assets_dir.joinpath(file_name)}")
+    compose_path = assets_dir.parent.parent.joinpath('docker-compose.yml')
+    if compose_path.exists():
+        compose = compose_path.read_text()
+        updated = mount_assets(compose)
+        if updated != compose:
+            compose_path.write_text(updated)
+            print(f">> Updated file saved: {compose_path}")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Inject a canonical rule set into templates, regenerating only when its content changes.")
+    parser.add_argument('configs', nargs='*', default=DEFAULT_CONFIGS,
+                        help="config.json files using the rule set (default: bridge and xtl-reality)")
+    parser.add_argument('--ruleset', default=DEFAULT_RULESET,
+                        help="rule set file (default: rulesets/iran.json)")
+    parser.add_argument('--force', action='store_true', help="regenerate even if the hash is unchanged")
+    args = parser.parse_args()
+
+    try:
+        ruleset = RuleSet(args.ruleset)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    print(f">> Rule set {ruleset.name}: {len(ruleset.rules)} rules, sha256 {ruleset.digest[:12]}")
+    changed = sum(sync_template(config_path, ruleset, args.force) for config_path in args.configs)
+    print(f">> {changed}/{len(args.configs)} templates regenerated")
+
+
+if __name__ == "__main__":
+    main()
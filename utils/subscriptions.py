@@ -0,0 +1,280 @@
+#!/usr/bin/python3
+
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from urllib.parse import quote, urlencode
+
+from user_registry import DEFAULT_DB, UserRegistry
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULT_OUTPUT = './caddy/web/sub'
+# Maps every <uuid>.txt to its content hash, so it must stay outside the
+# directory Caddy serves; versions before --manifest kept it there.
+MANIFEST = 'subscriptions.manifest.json'
+LEGACY_MANIFEST = '.manifest.json'
+BATCH_SIZE = 500
+CADDY_BEGIN = '# BEGIN subscriptions (generated by utils/subscriptions.py)'
+CADDY_END = '# END subscriptions'
+
+
+def vless_link(user_uuid, node, remark=''):
+    params = {
+        'encryption': 'none',
+        'security': node.get('security', 'tls'),
+        'type': node.get('network', 'ws'),
+        'host': node.get('host', node['domain']),
+        'path': node.get('path', '/ws'),
+        'sni': node.get('sni', node['domain']),
+    }
+    if params['type'] == 'grpc':
+        params['serviceName'] = params.pop('path').strip('/')
+        params['mode'] = 'multi'
+    if params['security'] == 'none':
+        del params['sni']
+    query = urlencode(params, quote_via=quote, safe='')
+    return f"vless://{user_uuid}@{node['domain']}:{node.get('port', 443)}?{query}#{quote(remark)}"
+
+
+def render_subscription(user, nodes):
+    links = [vless_link(user['uuid'], node, node.get('remark') or f"{user['email']}@{node['domain']}")
+             for node in nodes]
+    return base64.b64encode('\n'.join(links).encode()).decode() + '\n'
+
+
+def content_hash(content):
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def write_atomic(file_path, data, mtime=None):
+    # Caddy's file_server must never see a partially written file, so write
+    # to a temporary file in the same directory and rename it into place.
+    directory = os.path.dirname(file_path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        if mtime is not None:
+            os.utime(tmp_path, (mtime, mtime))
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def sidecars(data):
+    # Precompressed variants for `file_server { precompressed }`. gzip output
+    # is made deterministic (mtime=0) so identical content gives identical bytes.
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+    return variants
+
+
+def write_artifact(file_path, data):
+    # The sidecars share the plain file's mtime, so Caddy derives the same
+    # modtime-based ETag for every encoding of one content version.
+    mtime = time.time()
+    for suffix, compressed in sidecars(data).items():
+        write_atomic(file_path + suffix, compressed, mtime)
+    write_atomic(file_path, data, mtime)
+
+
+def artifact_names(name):
+    return [name, name + '.gz'] + ([name + '.br'] if brotli is not None else [])
+
+
+def render_batch(output_dir, users, nodes, previous):
+    hashes = {}
+    changed = []
+    for user in users:
+        name = f"{user['uuid']}.txt"
+        content = render_subscription(user, nodes)
+        digest = content_hash(content)
+        hashes[name] = digest
+        if previous.get(name) == digest and all(
+                os.path.exists(os.path.join(output_dir, n)) for n in artifact_names(name)):
+            continue
+        write_artifact(os.path.join(output_dir, name), content.encode())
+        changed.append(name)
+    return hashes, changed
+
+
+def default_manifest(db_path=DEFAULT_DB):
+    # Next to the user registry.
+    return os.path.join(os.path.dirname(db_path) or '.', MANIFEST)
+
+
+def load_manifest(manifest_path, output_dir):
+    for file_path in (manifest_path, os.path.join(output_dir, LEGACY_MANIFEST)):
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            continue
+    return {}
+
+
+def generate(users, nodes, output_dir=DEFAULT_OUTPUT, workers=None, prune=False, manifest_path=None):
+    # Renders every user's subscription in a process pool and rewrites only
+    # files whose content hash changed. Returns (written, unchanged, removed).
+    manifest_path = manifest_path or default_manifest()
+    served = os.path.abspath(output_dir)
+    if os.path.commonpath([served, os.path.abspath(manifest_path)]) == served:
+        raise ValueError(f"The manifest {manifest_path} must not be in the served directory {output_dir}")
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    previous = load_manifest(manifest_path, output_dir)
+    users = [{'uuid': user['uuid'], 'email': user['email']} for user in users]
+    batches = [users[i:i + BATCH_SIZE] for i in range(0, len(users), BATCH_SIZE)]
+
+    manifest = {}
+    written = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(render_batch, output_dir, batch, nodes,
+                               {f"{u['uuid']}.txt": previous.get(f"{u['uuid']}.txt") for u in batch})
+                   for batch in batches]
+        for future in futures:
+            hashes, changed = future.result()
+            manifest.update(hashes)
+            written.extend(changed)
+
+    removed = []
+    if prune:
+        for name in set(previous) - set(manifest):
+            for artifact in (name, name + '.gz', name + '.br'):
+                try:
+                    os.remove(os.path.join(output_dir, artifact))
+                except FileNotFoundError:
+                    pass
+            removed.append(name)
+    else:
+        manifest.update({name: digest for name, digest in previous.items() if name not in manifest})
+
+    Path(manifest_path).parent.mkdir(parents=True, exist_ok=True)
+    write_atomic(manifest_path, json.dumps(manifest, indent=2).encode())
+    try:
+        os.remove(os.path.join(output_dir, LEGACY_MANIFEST))
+    except FileNotFoundError:
+        pass
+    return written, len(users) - len(written), removed
+
+
+def caddy_subscription_block(prefix='/sub', root='/usr/share/caddy'):
+    # Serves the pregenerated sidecars instead of compressing per request.
+    # `no-cache` makes clients revalidate every poll, which Caddy answers
+    # with a 304 while the ETag is unchanged. Only the <uuid>.txt artifacts
+    # are served: file_server would otherwise serve dotfiles such as a left
+    # over manifest and the .tmp- files of writes in progress.
+    return (
+        f"  {CADDY_BEGIN}\n"
+        f"  handle {prefix}/* {{\n"
+        f"    root * {root}\n"
+        f"    header Cache-Control \"no-cache\"\n"
+        f"    header X-Content-Type-Options nosniff\n"
+        f"    file_server {{\n"
+        f"      precompressed br gzip\n"
+        f"      hide {LEGACY_MANIFEST} .tmp-*\n"
+        f"    }}\n"
+        f"  }}\n"
+        f"  {CADDY_END}\n"
+    )
+
+
+def set_caddy_block(content, block, begin, end):
+    # Replaces the generated block between the `begin` and `end` marker
+    # lines, or inserts it before the closing brace of the first site block.
+    if begin in content:
+        start = content.rindex('\n', 0, content.index(begin)) + 1
+        stop = content.index('\n', content.index(end)) + 1
+        return content[:start] + block + content[stop:]
+    depth = 0
+    for pos, char in enumerate(content):
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return content[:pos].rstrip('\n') + '\n\n' + block + content[pos:]
+    return content
+
+
+def update_caddyfile(caddyfile_path, prefix='/sub'):
+    with open(caddyfile_path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    content = set_caddy_block(content, caddy_subscription_block(prefix), CADDY_BEGIN, CADDY_END)
+    with open(caddyfile_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+
+def parse_node(value, args):
+    # DOMAIN[:PORT]; transport options come from the shared flags.
+    domain, _, port = value.partition(':')
+    node = {'domain': domain, 'port': int(port or args.port), 'network': args.network,
+            'security': args.security, 'path': args.path}
+    if args.host:
+        node['host'] = args.host
+    return node
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate per-user subscription files for Caddy's file_server.")
+    parser.add_argument('--db', default=DEFAULT_DB, help=f"user registry (default: {DEFAULT_DB})")
+    parser.add_argument('--domain', action='append', required=True, metavar='DOMAIN[:PORT]',
+                        help="node clients connect to; repeat for several links per user")
+    parser.add_argument('--port', type=int, default=443)
+    parser.add_argument('--network', default='ws')
+    parser.add_argument('--security', default='tls')
+    parser.add_argument('--path', default='/ws')
+    parser.add_argument('--host', help="Host header / CDN front (default: the domain)")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help=f"output directory (default: {DEFAULT_OUTPUT})")
+    parser.add_argument('--workers', type=int, help="worker processes (default: CPU count)")
+    parser.add_argument('--manifest', help=f"content hash manifest, kept out of the served directory "
+                                           f"(default: {MANIFEST} next to --db)")
+    parser.add_argument('--prune', action='store_true', help="delete subscriptions of removed users")
+    parser.add_argument('--caddyfile', help="Caddyfile to add or refresh the precompressed file_server block in")
+    args = parser.parse_args()
+
+    nodes = [parse_node(value, args) for value in args.domain]
+    if brotli is None:
+        print(">> brotli module not installed; writing .gz sidecars only.")
+    registry = UserRegistry(args.db)
+    try:
+        users = [dict(user) for user in registry.users()]
+    finally:
+        registry.close()
+    if not users:
+        print("Error: The user registry is empty.")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    try:
+        written, unchanged, removed = generate(users, nodes, args.output, args.workers, args.prune,
+                                               args.manifest or default_manifest(args.db))
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    elapsed = time.perf_counter() - start
+    print(f">> {len(written)} written, {unchanged} unchanged, {len(removed)} removed "
+          f"in {elapsed:.2f}s ({args.output})")
+    if args.caddyfile:
+        prefix = '/' + Path(args.output).name
+        update_caddyfile(args.caddyfile, prefix)
+        print(f">> Updated file saved: {args.caddyfile}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/python3
+
+import argparse
+import os
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from cidr_compiler import REPO_ROOT, load_config, save_config
+from upstream_probe import percentile
+
+# Templates with TLS (not REALITY) inbounds or outbounds.
+TLS_CONFIGS = [REPO_ROOT.joinpath(template, 'xray/config/config.json')
+               for template in ('bridge', 'upstream', 'upstream-caddy-cdn', 'xray-caddy-cdn')]
+SECURITIES = ('tls', 'xtls')
+# openssl req -newkey arguments per certificate type; ECDSA P-256 is what
+# certbot (--key-type ecdsa) and acme.sh (-k ec-256) issue.
+KEY_TYPES = {
+    'ecdsa-p256': ['ec', '-pkeyopt', 'ec_paramgen_curve:prime256v1'],
+    'rsa-2048': ['rsa:2048'],
+}
+TLS_VERSIONS = {'1.2': ssl.TLSVersion.TLSv1_2, '1.3': ssl.TLSVersion.TLSv1_3}
+
+
+def tls_settings(config):
+    # tlsSettings (xtlsSettings on old XTLS configs) of every TLS handler.
+    for handler in config.get('inbounds', []) + config.get('outbounds', []):
+        stream = handler.get('streamSettings', {})
+        if stream.get('security') in SECURITIES:
+            yield stream.setdefault(f"{stream['security']}Settings", {})
+
+
+def enable_resumption(config):
+    # Xray leaves Go's session tickets off unless enableSessionResumption is
+    # set: inbounds then issue tickets, with keys the runtime generates in
+    # memory and rotates daily, and outbounds keep a client session cache.
+    # Returns the number of handlers changed.
+    changed = 0
+    for settings in tls_settings(config):
+        if not settings.get('enableSessionResumption'):
+            settings['enableSessionResumption'] = True
+            changed += 1
+    return changed
+
+
+def make_certificate(directory, key_type):
+    cert = os.path.join(directory, f'{key_type}.crt')
+    key = os.path.join(directory, f'{key_type}.key')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', *KEY_TYPES[key_type], '-nodes', '-days', '1',
+                    '-subj', '/CN=localhost', '-keyout', key, '-out', cert],
+                   check=True, capture_output=True)
+    return cert, key
+
+
+class HandshakeServer(threading.Thread):
+    # Local TLS server taking one connection at a time and recording the CPU
+    # time of every server-side handshake, as the bridge pays it.
+
+    def __init__(self, context):
+        super().__init__(daemon=True)
+        self.context = context
+        self.listener = socket.create_server(('127.0.0.1', 0))
+        self.port = self.listener.getsockname()[1]
+        self.cpu = []
+        self.resumed = 0
+
+    def run(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                return
+            with sock:
+                try:
+                    start = time.thread_time()
+                    conn = self.context.wrap_socket(sock, server_side=True)
+                    self.cpu.append(time.thread_time() - start)
+                    self.resumed += conn.session_reused
+                    # The client reads this byte, and the session ticket sent
+                    # before it, then closes.
+                    conn.sendall(b'\0')
+                    conn.recv(1)
+                except (ssl.SSLError, OSError):
+                    pass
+
+    def close(self):
+        # Wakes up the pending accept().
+        self.listener.shutdown(socket.SHUT_RDWR)
+        self.listener.close()
+
+
+def handshakes(port, context, connections, resume):
+    cpu, wall = [], []
+    session = None
+    for _ in range(connections):
+        with socket.create_connection(('127.0.0.1', port)) as sock:
+            start, start_cpu = time.perf_counter(), time.thread_time()
+            with context.wrap_socket(sock, server_hostname='localhost', session=session) as conn:
+                cpu.append(time.thread_time() - start_cpu)
+                wall.append(time.perf_counter() - start)
+                conn.recv(1)
+                if resume:
+                    session = conn.session
+    return cpu, wall
+
+
+def measure(cert, key, connections, version):
+    server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    server_context.load_cert_chain(cert, key)
+    server_context.minimum_version = server_context.maximum_version = version
+    client_context = ssl.create_default_context(cafile=cert)
+    client_context.minimum_version = client_context.maximum_version = version
+    results = {}
+    for resume in (False, True):
+        server = HandshakeServer(server_context)
+        server.start()
+        try:
+            client_cpu, wall = handshakes(server.port, client_context, connections, resume)
+        finally:
+            server.close()
+        server.join()
+        results[resume] = {'server': server.cpu, 'client': client_cpu, 'wall': wall, 'resumed': server.resumed}
+    return results
+
+
+def benchmark(key_types, connections, version):
+    with tempfile.TemporaryDirectory() as directory:
+        return {key_type: measure(*make_certificate(directory, key_type), connections, version)
+                for key_type in key_types}
+
+
+def print_results(results, connections):
+    print(f"  {'certificate':12}{'handshake':>10}{'resumed':>9}{'server us':>11}{'client us':>11}"
+          f"{'p50 ms':>8}{'p99 ms':>8}")
+    for key_type, modes in results.items():
+        for resume, result in modes.items():
+            server_us = sum(result['server']) / len(result['server']) * 1e6
+            client_us = sum(result['client']) / len(result['client']) * 1e6
+            print(f"  {key_type:12}{'resumed' if resume else 'full':>10}{result['resumed']:>5}/{connections:<3}"
+                  f"{server_us:>11.0f}{client_us:>11.0f}"
+                  + ''.join(f"{percentile(result['wall'], q) * 1e3:>8.2f}" for q in (50, 99)))
+    print()
+    for key_type, modes in results.items():
+        full = sum(modes[False]['server']) / len(modes[False]['server'])
+        resumed = sum(modes[True]['server']) / len(modes[True]['server'])
+        print(f"  {key_type}: resumption saves {(full - resumed) * 1e6:.0f} us of server CPU per connection"
+              f" ({1 - resumed / full:.0%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Enable TLS session resumption in Xray configs and measure its handshake CPU savings.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    apply = commands.add_parser('apply', help="enable session resumption on every TLS inbound and outbound")
+    apply.add_argument('configs', nargs='*', default=TLS_CONFIGS,
+                       help="config.json files (default: every template using TLS)")
+
+    bench = commands.add_parser('bench', help="compare full and resumed handshakes against a local TLS server")
+    bench.add_argument('--connections', type=int, default=300, help="handshakes per certificate and mode")
+    bench.add_argument('--key-type', action='append', choices=list(KEY_TYPES),
+                       help="certificate types to compare (default: all)")
+    bench.add_argument('--tls-version', choices=list(TLS_VERSIONS), default='1.3')
+    args = parser.parse_args()
+
+    if args.command == 'apply':
+        for config_path in args.configs:
+            config = load_config(config_path)
+            changed = enable_resumption(config)
+            if changed:
+                save_config(config, config_path)
+            print(f">> {config_path}: session resumption enabled on {changed} more TLS handlers")
+        return
+
+    try:
+        results = benchmark(args.key_type or list(KEY_TYPES), args.connections, TLS_VERSIONS[args.tls_version])
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    print_results(results, args.connections)
+
+
+if __name__ == "__main__":
+    main()
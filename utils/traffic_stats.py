@@ -0,0 +1,317 @@
+#!/usr/bin/python3
+
+import argparse
+import json
+import os
+import sys
+import time
+from array import array
+
+from cidr_compiler import load_config, save_config
+from subscriptions import write_atomic
+from xray_api import DEFAULT_SERVER, XrayAPI, enable_api, grpc
+
+DEFAULT_STORE = './traffic_stats.bin'
+DEFAULT_CAPACITY = 10000
+# (label, seconds per bucket, buckets kept): 1h of minutes, 2d of hours, 30d of days.
+RESOLUTIONS = (('1m', 60, 60), ('1h', 3600, 48), ('1d', 86400, 30))
+DIRECTIONS = ('uplink', 'downlink')
+
+
+def enable_stats(config):
+    # User counters need the client's email and a level with stats enabled.
+    enable_api(config, ('HandlerService', 'StatsService'))
+    config.setdefault('stats', {})
+    policy = config.setdefault('policy', {})
+    levels = policy.setdefault('levels', {})
+    levels.setdefault('0', {})
+    for level in levels.values():
+        level.update(statsUserUplink=True, statsUserDownlink=True)
+    policy.setdefault('system', {}).update(
+        statsInboundUplink=True, statsInboundDownlink=True,
+        statsOutboundUplink=True, statsOutboundDownlink=True)
+    return config
+
+
+def parse_stat(name):
+    # 'user>>>a@b>>>traffic>>>uplink' -> ('user>>>a@b', 0)
+    parts = name.split('>>>')
+    if len(parts) != 4 or parts[2] != 'traffic' or parts[3] not in DIRECTIONS:
+        return None, None
+    return f'{parts[0]}>>>{parts[1]}', DIRECTIONS.index(parts[3])
+
+
+class RingStore:
+    # Byte counts per series (user, inbound or outbound) and direction in
+    # preallocated arrays: a ring of buckets per resolution plus running
+    # totals. Memory is set by `capacity`, not by the number of users; series
+    # beyond capacity are not stored and their counters counted in `dropped`
+    # on every poll. `counters` holds the last raw value of the counters of
+    # stored series seen in the last poll only.
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, resolutions=RESOLUTIONS):
+        self.capacity = capacity
+        self.resolutions = resolutions
+        self.width = capacity * len(DIRECTIONS)
+        self.names = []
+        self.slots = {}
+        self.dropped = 0
+        self.counters = {}
+        self.totals = array('Q', bytes(8 * self.width))
+        # Sum of each ring, kept up to date so exports never rescan the rings.
+        self.windows = {label: array('Q', bytes(8 * self.width)) for label, _, _ in resolutions}
+        self.rings = {label: array('Q', bytes(8 * self.width * points)) for label, _, points in resolutions}
+        self.heads = {label: None for label, _, _ in resolutions}
+        self._zero = array('Q', bytes(8 * self.width))
+
+    def slot(self, name):
+        slot = self.slots.get(name)
+        if slot is None:
+            if len(self.names) >= self.capacity:
+                self.dropped += 1
+                return None
+            slot = self.slots[name] = len(self.names)
+            self.names.append(name)
+        return slot
+
+    def advance(self, now):
+        # Moves every ring to the bucket holding `now`, clearing the buckets
+        # skipped over (at most one full turn).
+        for label, step, points in self.resolutions:
+            bucket = int(now // step)
+            head = self.heads[label]
+            if head is not None and bucket > head:
+                ring, window = self.rings[label], self.windows[label]
+                for skipped in range(head + 1, min(bucket, head + points) + 1):
+                    row = (skipped % points) * self.width
+                    for index, value in enumerate(ring[row:row + self.width]):
+                        if value:
+                            window[index] -= value
+                    ring[row:row + self.width] = self._zero
+            if head is None or bucket > head:
+                self.heads[label] = bucket
+
+    def _buckets(self):
+        # (ring, window, offset of the current bucket) per resolution.
+        return [(self.rings[label], self.windows[label], (self.heads[label] % points) * self.width)
+                for label, _, points in self.resolutions]
+
+    def add(self, name, direction, delta, now):
+        self.advance(now)
+        self._add(self.slot(name), direction, delta, self._buckets())
+
+    def _add(self, slot, direction, delta, buckets):
+        if slot is None or not delta:
+            return
+        index = slot * len(DIRECTIONS) + direction
+        self.totals[index] += delta
+        for ring, window, offset in buckets:
+            ring[offset + index] += delta
+            window[index] += delta
+
+    def update(self, stats, now):
+        # Feeds raw StatsService counters; stores the increase since the last
+        # poll. A counter that went down means Xray restarted.
+        first = not self.counters
+        self.advance(now)
+        buckets = self._buckets()
+        counters = {}
+        for stat, value in stats.items():
+            name, direction = parse_stat(stat)
+            if name is None:
+                continue
+            slot = self.slot(name)
+            if slot is None:
+                continue
+            previous = self.counters.get(stat)
+            counters[stat] = value
+            if first or value == previous:
+                continue
+            delta = value - previous if previous is not None and value >= previous else value
+            self._add(slot, direction, delta, buckets)
+        # Counters of removed users are gone from the poll and forgotten here.
+        self.counters = counters
+
+    def series(self, name, label):
+        # [(bucket start, uplink, downlink)], oldest first.
+        step, points = next((s, p) for l, s, p in self.resolutions if l == label)
+        slot = self.slots[name]
+        head = self.heads[label]
+        ring = self.rings[label]
+        rows = []
+        for bucket in range(head - points + 1, head + 1):
+            base = (bucket % points) * self.width + slot * len(DIRECTIONS)
+            rows.append((bucket * step, ring[base], ring[base + 1]))
+        return rows
+
+    def window(self, name, label):
+        index = self.slots[name] * len(DIRECTIONS)
+        return self.windows[label][index], self.windows[label][index + 1]
+
+    def total(self, name):
+        index = self.slots[name] * len(DIRECTIONS)
+        return self.totals[index], self.totals[index + 1]
+
+    def save(self, file_path):
+        # One JSON header line followed by the raw arrays.
+        header = {'capacity': self.capacity, 'resolutions': self.resolutions, 'names': self.names,
+                  'heads': self.heads, 'dropped': self.dropped, 'counters': self.counters}
+        chunks = [json.dumps(header).encode() + b'\n', self.totals.tobytes()]
+        for label, _, _ in self.resolutions:
+            chunks += [self.windows[label].tobytes(), self.rings[label].tobytes()]
+        write_atomic(os.path.abspath(file_path), b''.join(chunks))
+
+    @classmethod
+    def load(cls, file_path):
+        with open(file_path, 'rb') as f:
+            header = json.loads(f.readline())
+            store = cls(header['capacity'], tuple(tuple(r) for r in header['resolutions']))
+            store.names = header['names']
+            store.slots = {name: slot for slot, name in enumerate(store.names)}
+            store.heads = header['heads']
+            store.dropped = header['dropped']
+            store.counters = header['counters']
+            store.totals = array('Q', f.read(8 * store.width))
+            for label, _, points in store.resolutions:
+                store.windows[label] = array('Q', f.read(8 * store.width))
+                store.rings[label] = array('Q', f.read(8 * store.width * points))
+        return store
+
+
+def span_label(seconds):
+    for unit, size in (('d', 86400), ('h', 3600), ('m', 60)):
+        if seconds % size == 0:
+            return f'{seconds // size}{unit}'
+    return f'{seconds}s'
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(store):
+    lines = [
+        '# HELP xray_traffic_bytes_total Bytes counted by the collector per user, inbound and outbound.',
+        '# TYPE xray_traffic_bytes_total counter',
+    ]
+    labels = []
+    for name in store.names:
+        kind, _, value = name.partition('>>>')
+        labels.append(f'kind="{kind}",name="{escape_label(value)}"')
+    for name, label in zip(store.names, labels):
+        for direction, count in zip(DIRECTIONS, store.total(name)):
+            lines.append(f'xray_traffic_bytes_total{{{label},direction="{direction}"}} {count}')
+    lines += [
+        '# HELP xray_traffic_window_bytes Bytes in the trailing window kept at each resolution.',
+        '# TYPE xray_traffic_window_bytes gauge',
+    ]
+    for resolution, step, points in store.resolutions:
+        window = span_label(step * points)
+        for name, label in zip(store.names, labels):
+            for direction, count in zip(DIRECTIONS, store.window(name, resolution)):
+                lines.append(f'xray_traffic_window_bytes{{{label},direction="{direction}",window="{window}"}} {count}')
+    lines += [
+        '# HELP xray_traffic_series Series slots of the collector store.',
+        '# TYPE xray_traffic_series gauge',
+        f'xray_traffic_series{{state="used"}} {len(store.names)}',
+        f'xray_traffic_series{{state="capacity"}} {store.capacity}',
+        f'xray_traffic_series{{state="dropped"}} {store.dropped}',
+    ]
+    return '\n'.join(lines) + '\n'
+
+
+def open_store(file_path, capacity):
+    if os.path.exists(file_path):
+        return RingStore.load(file_path)
+    return RingStore(capacity)
+
+
+def collect(api, store_path, textfile=None, interval=60.0, capacity=DEFAULT_CAPACITY,
+            save_every=5, once=False):
+    store = open_store(store_path, capacity)
+    polls = 0
+    warned = False
+    try:
+        while True:
+            store.update(api.query_stats(), time.time())
+            polls += 1
+            if store.dropped and not warned:
+                print(f"Warning: The store is full ({store.capacity} series); traffic of new users is not "
+                      "recorded. Start a new store with a larger --capacity.")
+                warned = True
+            if textfile:
+                write_atomic(os.path.abspath(textfile), prometheus_text(store).encode())
+            if once:
+                break
+            if polls % save_every == 0:
+                store.save(store_path)
+            time.sleep(interval)
+    finally:
+        store.save(store_path)
+    return store
+
+
+def print_top(store, resolution, top):
+    kinds = sorted({name.partition('>>>')[0] for name in store.names})
+    for kind in kinds:
+        names = [name for name in store.names if name.startswith(kind + '>>>')]
+        names.sort(key=lambda name: sum(store.window(name, resolution)), reverse=True)
+        print(f"\nTop {kind}s by traffic over the {resolution} ring:")
+        print(f"  {'name':40}{'uplink MB':>12}{'downlink MB':>14}")
+        for name in names[:top]:
+            up, down = store.window(name, resolution)
+            print(f"  {name.partition('>>>')[2]:40}{up / 1e6:>12.1f}{down / 1e6:>14.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Collect per-user traffic from the Xray StatsService into a fixed-size time-series store.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    enable = commands.add_parser('enable', help="turn on the stats counters and StatsService in config files")
+    enable.add_argument('configs', nargs='+')
+
+    run = commands.add_parser('collect', help="poll the StatsService and export a Prometheus textfile")
+    run.add_argument('--server', default=DEFAULT_SERVER, help=f"API address (default: {DEFAULT_SERVER})")
+    run.add_argument('--store', default=DEFAULT_STORE, help=f"store file (default: {DEFAULT_STORE})")
+    run.add_argument('--textfile', help="Prometheus textfile to write, e.g. for node_exporter")
+    run.add_argument('--interval', type=float, default=60.0, help="seconds between polls")
+    run.add_argument('--capacity', type=int, default=DEFAULT_CAPACITY,
+                     help="series a new store can hold (users + inbounds + outbounds)")
+    run.add_argument('--once', action='store_true', help="poll once and exit")
+
+    report = commands.add_parser('top', help="print the heaviest users from the store")
+    report.add_argument('--store', default=DEFAULT_STORE)
+    report.add_argument('--resolution', default='1h', choices=[label for label, _, _ in RESOLUTIONS])
+    report.add_argument('--top', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.command == 'enable':
+        for config_path in args.configs:
+            save_config(enable_stats(load_config(config_path)), config_path)
+            print(f">> Stats enabled in {config_path}")
+    elif args.command == 'top':
+        if not os.path.exists(args.store):
+            print(f"Error: File '{args.store}' not found.")
+            sys.exit(1)
+        store = RingStore.load(args.store)
+        print_top(store, args.resolution, args.top)
+    else:
+        if grpc is None:
+            print("Error: The grpcio module is required (pip install grpcio).")
+            sys.exit(1)
+        api = XrayAPI(args.server)
+        try:
+            store = collect(api, args.store, args.textfile, args.interval, args.capacity, once=args.once)
+        except KeyboardInterrupt:
+            return
+        except grpc.RpcError as e:
+            print(f"Error: {e.details() or e.code()}")
+            sys.exit(1)
+        finally:
+            api.close()
+        print(f">> {len(store.names)}/{store.capacity} series stored in {args.store}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+
+import argparse
+import sys
+
+from caddyfile import indent, reverse_proxy
+from cidr_compiler import load_config, save_config
+from subscriptions import set_caddy_block
+from user_registry import CLIENT_PROTOCOLS, client_inbounds
+
+TRANSPORTS = ('ws', 'grpc', 'h2', 'xhttp')
+# Paths both ends default to; for gRPC the path is the service name.
+DEFAULT_PATHS = {'ws': '/', 'grpc': '/tunnel', 'h2': '/tunnel', 'xhttp': '/tunnel'}
+ALPN = {'ws': ['http/1.1'], 'grpc': ['h2'], 'h2': ['h2'], 'xhttp': ['h2', 'http/1.1']}
+SETTINGS_KEYS = ('tcpSettings', 'wsSettings', 'grpcSettings', 'httpSettings', 'xhttpSettings',
+                 'splithttpSettings', 'httpupgradeSettings')
+LOOPBACK = ('127.0.0.1', 'localhost', '::1')
+CADDY_BEGIN = '# BEGIN transport (generated by utils/transport.py)'
+CADDY_END = '# END transport'
+
+
+def service_name(path):
+    return path.strip('/') or 'tunnel'
+
+
+def stream_settings(transport, path, host=None):
+    # The transport-specific part of streamSettings; identical on both ends.
+    if transport == 'ws':
+        settings = {'path': path}
+        if host:
+            settings['headers'] = {'Host': host}
+        return {'network': 'ws', 'wsSettings': settings}
+    if transport == 'grpc':
+        return {'network': 'grpc', 'grpcSettings': {'serviceName': service_name(path), 'multiMode': True}}
+    if transport == 'h2':
+        settings = {'path': path}
+        if host:
+            settings['host'] = [host]
+        return {'network': 'h2', 'httpSettings': settings}
+    settings = {'path': path, 'mode': 'auto'}
+    if host:
+        settings['host'] = host
+    return {'network': 'xhttp', 'xhttpSettings': settings}
+
+
+def apply_transport(handler, transport, path, host=None):
+    stream = handler.setdefault('streamSettings', {})
+    for key in SETTINGS_KEYS:
+        stream.pop(key, None)
+    stream.update(stream_settings(transport, path, host))
+    tls_settings = stream.get('tlsSettings')
+    if tls_settings is not None:
+        tls_settings['alpn'] = list(ALPN[transport])
+    return handler
+
+
+def tunnel_handlers(config, side):
+    # The handlers of the bridge-to-upstream hop: proxy outbounds on the
+    # bridge, client inbounds on the upstream. Raw TCP (e.g. a TLS inbound
+    # with fallbacks) is left alone.
+    if side == 'outbound':
+        handlers = [o for o in config.get('outbounds', []) if o.get('protocol') in CLIENT_PROTOCOLS]
+    else:
+        handlers = list(client_inbounds(config))
+    return [h for h in handlers if h.get('streamSettings', {}).get('network', 'tcp') in TRANSPORTS]
+
+
+def set_transport(config, transport, path=None, side='outbound', host=None):
+    path = path or DEFAULT_PATHS[transport]
+    handlers = tunnel_handlers(config, side)
+    for handler in handlers:
+        apply_transport(handler, transport, path, host)
+        if side == 'inbound' and handler.get('listen') in LOOPBACK:
+            # Caddy proxies to xray:<port> from its own container, which the
+            # xray container's loopback is not reachable from.
+            handler['listen'] = '0.0.0.0'
+    return handlers
+
+
+def caddy_tunnel_paths(transport, path):
+    # Path matchers of the tunnel requests, e.g. to keep them out of `encode`.
+    if transport == 'ws':
+        return [path]
+    return [f"/{service_name(path)}/*" if transport == 'grpc' else f"{path.rstrip('/')}/*"]
+
+
+def caddy_transport_block(transport, path, upstream):
+    # WebSocket needs the upgrade matcher; the multiplexed transports are
+    # proxied as cleartext HTTP/2 (h2c). Both stream unbuffered over a tuned
+    # keepalive pool (see caddyfile.reverse_proxy).
+    if transport == 'ws':
+        lines = ["@websockets {",
+                 "  header Connection *Upgrade*",
+                 "  header Upgrade websocket",
+                 f"  path {path}",
+                 "}"] + reverse_proxy(upstream, '@websockets')
+    else:
+        lines = [f"handle {caddy_tunnel_paths(transport, path)[0]} {{"] + \
+            indent(reverse_proxy(upstream, h2c=True)) + ["}"]
+    return '\n'.join(indent([CADDY_BEGIN] + lines + [CADDY_END])) + '\n'
+
+
+def set_caddy_transport(content, transport, path, upstream):
+    return set_caddy_block(content, caddy_transport_block(transport, path, upstream), CADDY_BEGIN, CADDY_END)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Switch the bridge-to-upstream hop of config files to another transport.")
+    parser.add_argument('transport', choices=TRANSPORTS)
+    parser.add_argument('configs', nargs='+')
+    parser.add_argument('--side', choices=['outbound', 'inbound'], default='outbound',
+                        help="outbound for bridge configs, inbound for upstream configs (default: outbound)")
+    parser.add_argument('--path', help="path, or service name for grpc (default: / for ws, /tunnel otherwise)")
+    parser.add_argument('--host', help="Host header / authority, e.g. the CDN domain")
+    parser.add_argument('--caddyfile', help="Caddyfile to add the matching reverse_proxy block to")
+    parser.add_argument('--upstream', default='xray:1311', help="address Caddy proxies to (default: xray:1311)")
+    args = parser.parse_args()
+
+    path = args.path or DEFAULT_PATHS[args.transport]
+    for config_path in args.configs:
+        config = load_config(config_path)
+        handlers = set_transport(config, args.transport, path, args.side, args.host)
+        if not handlers:
+            print(f"Error: No {args.side} to change in {config_path}")
+            sys.exit(1)
+        save_config(config, config_path)
+        print(f">> {len(handlers)} {args.side}(s) switched to {args.transport} in {config_path}")
+    if args.caddyfile:
+        with open(args.caddyfile, 'r', encoding='utf-8') as f:
+            content = f.read()
+        with open(args.caddyfile, 'w', encoding='utf-8') as f:
+            f.write(set_caddy_transport(content, args.transport, path, args.upstream))
+        print(f">> Updated file saved: {args.caddyfile}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+
+import argparse
+import sys
+
+from cidr_compiler import load_config, save_config
+
+# policy.levels values are seconds, except bufferSize (KB per connection;
+# Xray's default is 512 on 64-bit). sockopt applies to every inbound and
+# outbound that carries traffic. tcpCongestion "bbr" needs the kernel module
+# (see bbr.sh).
+PROFILES = {
+    # Tens of thousands of mostly idle connections on a small VPS: small
+    # buffers, and idle or half-closed connections are released early.
+    'low-memory': {
+        'policy': {'handshake': 4, 'connIdle': 120, 'uplinkOnly': 1, 'downlinkOnly': 1, 'bufferSize': 4},
+        'sockopt': {'tcpFastOpen': True, 'tcpNoDelay': True, 'tcpKeepAliveInterval': 30},
+    },
+    # Few, busy connections (bridge-to-upstream hops, large downloads).
+    'high-throughput': {
+        'policy': {'handshake': 4, 'connIdle': 300, 'uplinkOnly': 2, 'downlinkOnly': 5, 'bufferSize': 512},
+        # No tcpNoDelay: Go sets TCP_NODELAY on every connection and Xray
+        # only acts on the option when it is true, so false would not bring
+        # Nagle back.
+        'sockopt': {'tcpFastOpen': True, 'tcpCongestion': 'bbr', 'tcpKeepAliveInterval': 60},
+    },
+    # Phones that sit idle behind carrier NAT: a slow handshake is tolerated,
+    # idle sessions are kept, and keepalives find dead peers.
+    'many-idle-mobile': {
+        'policy': {'handshake': 8, 'connIdle': 600, 'uplinkOnly': 1, 'downlinkOnly': 1, 'bufferSize': 2},
+        'sockopt': {'tcpFastOpen': True, 'tcpNoDelay': True, 'tcpCongestion': 'bbr',
+                    'tcpKeepAliveIdle': 120, 'tcpKeepAliveInterval': 30},
+    },
+}
+# Handlers that never carry client traffic.
+SKIPPED_PROTOCOLS = ('blackhole', 'dns')
+MUX_PROTOCOLS = ('vless', 'vmess', 'trojan')
+
+
+def apply_profile(config, name):
+    profile = PROFILES[name]
+    levels = config.setdefault('policy', {}).setdefault('levels', {})
+    levels.setdefault('0', {})
+    for level in levels.values():
+        level.update(profile['policy'])
+
+    api_tag = config.get('api', {}).get('tag')
+    for handler in config.get('inbounds', []) + config.get('outbounds', []):
+        if handler.get('protocol') in SKIPPED_PROTOCOLS or (api_tag and handler.get('tag') == api_tag):
+            continue
+        handler.setdefault('streamSettings', {}).setdefault('sockopt', {}).update(profile['sockopt'])
+    return config
+
+
+def apply_mux(config, concurrency=8, xudp_concurrency=16):
+    # Mux.Cool on the proxy outbounds: up to `concurrency` TCP streams share
+    # one upstream connection and UDP is carried as XUDP. -1 keeps that kind
+    # of traffic off mux. Outbounds using an XTLS flow cannot be muxed.
+    muxed = []
+    for outbound in config.get('outbounds', []):
+        if outbound.get('protocol') not in MUX_PROTOCOLS:
+            continue
+        users = [user for server in outbound.get('settings', {}).get('vnext', []) for user in server.get('users', [])]
+        if any(user.get('flow') for user in users):
+            continue
+        outbound['mux'] = {'enabled': True, 'concurrency': concurrency, 'xudpConcurrency': xudp_concurrency}
+        muxed.append(outbound.get('tag', outbound['protocol']))
+    return muxed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a tuning profile's policy and sockopt into config files.")
+    parser.add_argument('profile', choices=sorted(PROFILES))
+    parser.add_argument('configs', nargs='+')
+    args = parser.parse_args()
+
+    for config_path in args.configs:
+        try:
+            config = load_config(config_path)
+        except FileNotFoundError:
+            print(f"Error: File '{config_path}' not found.")
+            sys.exit(1)
+        save_config(apply_profile(config, args.profile), config_path)
+        print(f">> Applied the {args.profile} profile to {config_path}")
+
+
+if __name__ == "__main__":
+    main()
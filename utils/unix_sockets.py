@@ -0,0 +1,233 @@
+#!/usr/bin/python3
+
+import argparse
+import asyncio
+import os
+import re
+import sys
+import tempfile
+import time
+
+from cidr_compiler import load_config, save_config
+from upstream_probe import percentile
+
+STYLES = ('abstract', 'path')
+# Filesystem sockets go to tmpfs inside the container.
+SOCKET_DIR = '/dev/shm'
+# - "1234:1234", - "127.0.0.1:1310:1310/udp", ...
+PUBLISH_RE = re.compile(r'^\s*-\s*["\']?(?:[\d.]+:)?\d+:(\d+)(?:/\w+)?["\']?\s*$')
+
+
+def socket_address(tag, style='abstract', directory=SOCKET_DIR):
+    # Abstract sockets (@name) live in the network namespace and leave no file
+    # behind; filesystem ones can be shared with another container.
+    if style == 'abstract':
+        return f'@xray-{tag}'
+    return os.path.join(directory, f'xray-{tag}.sock')
+
+
+def fallback_port(dest):
+    # 1234, "1234" and "127.0.0.1:1234" are loopback ports; anything else
+    # (another host, a socket) is not.
+    if isinstance(dest, int):
+        return dest
+    host, _, port = str(dest).rpartition(':')
+    if port.isdigit() and host in ('', '127.0.0.1', 'localhost'):
+        return int(port)
+    return None
+
+
+def apply_unix_sockets(config, style='abstract', directory=SOCKET_DIR):
+    # Points every fallback that targets another inbound of the same config at
+    # a Unix socket that inbound now listens on. Returns {port: address}.
+    inbounds = {inbound['port']: inbound for inbound in config.get('inbounds', []) if 'port' in inbound}
+    moved = {}
+    for inbound in config.get('inbounds', []):
+        for fallback in inbound.get('settings', {}).get('fallbacks', []):
+            port = fallback_port(fallback.get('dest'))
+            target = inbounds.get(port)
+            if target is None or target is inbound:
+                continue
+            if port not in moved:
+                moved[port] = socket_address(target.get('tag') or f"{target['protocol']}-{port}", style, directory)
+                target.setdefault('tag', f"{target['protocol']}-{port}")
+                # Xray ignores the port of an inbound listening on a socket.
+                del target['port']
+                target['listen'] = moved[port]
+            fallback['dest'] = moved[port]
+    return moved
+
+
+def tcp_ports(config):
+    return {inbound['port'] for inbound in config.get('inbounds', []) if isinstance(inbound.get('port'), int)}
+
+
+def drop_publications(compose, ports, service='xray'):
+    # Removes the `ports:` entries of `service` that publish the given
+    # container ports; returns the new text and the removed entries.
+    kept, removed = [], []
+    current = None
+    for line in compose.splitlines(keepends=True):
+        indent = len(line) - len(line.lstrip(' '))
+        if line.strip() and indent == 2:
+            current = line.strip().rstrip(':')
+        match = PUBLISH_RE.match(line)
+        if current == service and match and int(match.group(1)) in ports:
+            removed.append(line.strip().lstrip('- ').strip('"\''))
+            continue
+        kept.append(line)
+    return ''.join(kept), removed
+
+
+def published_ports(compose, service='xray'):
+    ports = set()
+    current = None
+    for line in compose.splitlines():
+        if line.strip() and len(line) - len(line.lstrip(' ')) == 2:
+            current = line.strip().rstrip(':')
+        match = PUBLISH_RE.match(line)
+        if current == service and match:
+            ports.add(int(match.group(1)))
+    return ports
+
+
+def apply_template(config_path, compose_path, style='abstract', directory=SOCKET_DIR, keep=()):
+    config = load_config(config_path)
+    moved = apply_unix_sockets(config, style, directory)
+    if moved:
+        save_config(config, config_path)
+        for port, address in moved.items():
+            print(f"  {port} -> {address}")
+        print(f">> Updated file saved: {config_path}")
+    if compose_path and os.path.exists(compose_path):
+        with open(compose_path, 'r', encoding='utf-8') as f:
+            compose = f.read()
+        # Only ports an inbound still listens on over TCP need publishing.
+        unused = published_ports(compose) - tcp_ports(config) - set(keep)
+        compose, removed = drop_publications(compose, unused)
+        if removed:
+            with open(compose_path, 'w', encoding='utf-8') as f:
+                f.write(compose)
+            print(f">> Updated file saved: {compose_path} (dropped {', '.join(removed)})")
+    return moved
+
+
+async def echo(reader, writer):
+    try:
+        while data := await reader.read(65536):
+            writer.write(data)
+            await writer.drain()
+    except (ConnectionError, asyncio.CancelledError):
+        # Cancelled: connections still open when the benchmark shuts down.
+        pass
+    finally:
+        writer.close()
+
+
+async def measure(connect, connections, round_trips, payload, bulk):
+    # Connection setup plus small request/response exchanges (a fallback
+    # handing over a PROXY header and the first records), then bulk transfer.
+    setup, latencies = [], []
+    message = bytes(payload)
+    for _ in range(connections):
+        start = time.perf_counter()
+        reader, writer = await connect()
+        setup.append(time.perf_counter() - start)
+        for _ in range(round_trips):
+            start = time.perf_counter()
+            writer.write(message)
+            await reader.readexactly(len(message))
+            latencies.append(time.perf_counter() - start)
+        writer.close()
+        await writer.wait_closed()
+    reader, writer = await connect()
+    chunk = bytes(65536)
+    start = time.perf_counter()
+
+    async def send():
+        for _ in range(bulk // len(chunk)):
+            writer.write(chunk)
+            await writer.drain()
+
+    sender = asyncio.ensure_future(send())
+    await reader.readexactly(bulk // len(chunk) * len(chunk))
+    await sender
+    elapsed = time.perf_counter() - start
+    writer.close()
+    await writer.wait_closed()
+    return {'setup': setup, 'rtt': latencies, 'throughput': bulk / elapsed}
+
+
+async def benchmark(connections, round_trips, payload, bulk):
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        servers = {
+            'tcp 127.0.0.1': await asyncio.start_server(echo, '127.0.0.1', 0),
+            'unix path': await asyncio.start_unix_server(echo, os.path.join(directory, 'bench.sock')),
+            'unix abstract': await asyncio.start_unix_server(echo, f'\0xray-bench-{os.getpid()}'),
+        }
+        try:
+            for name, server in servers.items():
+                address = server.sockets[0].getsockname()
+                if name.startswith('tcp'):
+                    def connect(address=address):
+                        return asyncio.open_connection(*address[:2])
+                else:
+                    def connect(address=address):
+                        return asyncio.open_unix_connection(address)
+                results[name] = await measure(connect, connections, round_trips, payload, bulk)
+        finally:
+            for server in servers.values():
+                server.close()
+    return results
+
+
+def print_results(results):
+    print(f"  {'socket':16}{'connect us':>12}{'rtt p50 us':>12}{'rtt p99 us':>12}{'MB/s':>9}")
+    for name, result in results.items():
+        setup = sum(result['setup']) / len(result['setup'])
+        print(f"  {name:16}{setup * 1e6:>12.1f}{percentile(result['rtt'], 50) * 1e6:>12.1f}"
+              f"{percentile(result['rtt'], 99) * 1e6:>12.1f}{result['throughput'] / 1e6:>9.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Move fallbacks and the inbounds they reach onto Unix sockets, or benchmark TCP against them.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    apply = commands.add_parser('apply', help="switch internal fallbacks of a config to Unix sockets")
+    apply.add_argument('config')
+    apply.add_argument('--compose', help="docker-compose.yml whose unneeded xray port publications are dropped")
+    apply.add_argument('--style', choices=STYLES, default='abstract',
+                       help="abstract @name sockets or files in --dir (default: abstract)")
+    apply.add_argument('--dir', default=SOCKET_DIR, help=f"directory of path sockets (default: {SOCKET_DIR})")
+    apply.add_argument('--keep', type=int, action='append', default=[], metavar='PORT',
+                       help="keep publishing this container port")
+
+    bench = commands.add_parser('bench', help="compare loopback TCP with Unix sockets")
+    bench.add_argument('--connections', type=int, default=2000)
+    bench.add_argument('--round-trips', type=int, default=4, help="request/response exchanges per connection")
+    bench.add_argument('--payload', type=int, default=512, help="bytes per exchange")
+    bench.add_argument('--bulk', type=int, default=256, help="MB for the throughput test")
+    args = parser.parse_args()
+
+    if args.command == 'apply':
+        try:
+            moved = apply_template(args.config, args.compose, args.style, args.dir, args.keep)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        if not moved:
+            print(f">> {args.config}: no fallbacks to inbounds of the same config")
+        return
+
+    try:
+        results = asyncio.run(benchmark(args.connections, args.round_trips, args.payload, args.bulk << 20))
+    except OSError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    print_results(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/python3
+
+import argparse
+import asyncio
+import copy
+import ssl
+import sys
+import time
+
+DEFAULT_PORT = 443
+BALANCER_TAG = 'upstream'
+OUTBOUND_PREFIX = 'upstream-'
+PROBE_URL = 'https://www.google.com/generate_204'
+
+
+def split_target(target):
+    host, _, port = target.partition(':')
+    return host, int(port or DEFAULT_PORT)
+
+
+def make_ssl_context(insecure=False, cafile=None):
+    context = ssl.create_default_context(cafile=cafile)
+    context.set_alpn_protocols(['http/1.1'])
+    if insecure:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q / 100
+    low = int(pos)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+async def probe_once(host, port, context, server_name=None, timeout=5.0):
+    # Returns (tcp connect seconds, TLS handshake seconds).
+    loop = asyncio.get_running_loop()
+    protocol = asyncio.Protocol()
+    start = time.perf_counter()
+    transport, _ = await asyncio.wait_for(loop.create_connection(lambda: protocol, host, port), timeout)
+    connected = time.perf_counter()
+    try:
+        transport = await asyncio.wait_for(
+            loop.start_tls(transport, protocol, context, server_hostname=server_name or host),
+            timeout)
+        handshake = time.perf_counter()
+    finally:
+        transport.close()
+    return connected - start, handshake - connected
+
+
+async def probe_target(target, context, count=5, interval=0.2, timeout=5.0, server_name=None):
+    host, port = split_target(target)
+    connect, tls, errors = [], [], []
+    for attempt in range(count):
+        if attempt:
+            await asyncio.sleep(interval)
+        try:
+            tcp_time, tls_time = await probe_once(host, port, context, server_name, timeout)
+        except (OSError, asyncio.TimeoutError, ssl.SSLError) as e:
+            errors.append(str(e) or type(e).__name__)
+            continue
+        connect.append(tcp_time)
+        tls.append(tls_time)
+    total = [a + b for a, b in zip(connect, tls)]
+    return {
+        'target': target,
+        'samples': len(total),
+        'errors': errors,
+        'connect': {q: percentile(connect, q) for q in (50, 90, 99)},
+        'tls': {q: percentile(tls, q) for q in (50, 90, 99)},
+        'total': {q: percentile(total, q) for q in (50, 90, 99)},
+    }
+
+
+async def probe_all(targets, context, count=5, interval=0.2, timeout=5.0):
+    return await asyncio.gather(*(probe_target(t, context, count, interval, timeout) for t in targets))
+
+
+def rank(results):
+    # Reachable upstreams by median connect+handshake time, then p90;
+    # unreachable ones keep their given order at the end.
+    def key(result):
+        total = result['total']
+        if total[50] is None:
+            return (1, 0, 0)
+        return (0, total[50], total[90])
+    return sorted(results, key=key)
+
+
+def probe(targets, count=5, interval=0.2, timeout=5.0, insecure=False, cafile=None):
+    context = make_ssl_context(insecure, cafile)
+    return rank(asyncio.run(probe_all(targets, context, count, interval, timeout)))
+
+
+def apply_balancer(config, targets, probe_url=PROBE_URL, probe_interval='30s'):
+    # Replaces the single upstream vless outbound with one outbound per
+    # target (in the given, latency-ranked order) behind a leastPing balancer.
+    outbounds = config['outbounds']
+    position, template = next((i, o) for i, o in enumerate(outbounds) if o.get('protocol') == 'vless')
+    upstreams = []
+    for index, target in enumerate(targets, 1):
+        host, port = split_target(target)
+        outbound = copy.deepcopy(template)
+        outbound['tag'] = f'{OUTBOUND_PREFIX}{index}'
+        vnext = outbound['settings']['vnext'][0]
+        vnext['address'] = host
+        vnext['port'] = port
+        tls_settings = outbound.get('streamSettings', {}).get('tlsSettings')
+        if tls_settings is not None:
+            tls_settings['serverName'] = host
+        upstreams.append(outbound)
+    outbounds[position:position + 1] = upstreams
+
+    # Balancers always live in `routing`, even when the rules still use the
+    # legacy `routing.settings.rules` layout.
+    routing = config.setdefault('routing', {})
+    container = routing['settings'] if 'settings' in routing and 'rules' not in routing else routing
+    routing['balancers'] = [{
+        'tag': BALANCER_TAG,
+        'selector': [OUTBOUND_PREFIX],
+        'strategy': {'type': 'leastPing'},
+        'fallbackTag': upstreams[0]['tag'],
+    }]
+    rules = container.setdefault('rules', [])
+    rules[:] = [r for r in rules if r.get('balancerTag') != BALANCER_TAG]
+    rules.append({'type': 'field', 'network': 'tcp,udp', 'balancerTag': BALANCER_TAG})
+    config['observatory'] = {
+        'subjectSelector': [OUTBOUND_PREFIX],
+        'probeUrl': probe_url,
+        'probeInterval': probe_interval,
+        'enableConcurrency': True,
+    }
+    return config
+
+
+def format_ms(value):
+    return '-' if value is None else f"{value * 1e3:.1f}"
+
+
+def print_results(results):
+    print(f"  {'upstream':32}{'ok':>4}{'tcp p50':>9}{'p90':>8}{'p99':>8}{'tls p50':>9}{'p90':>8}{'p99':>8}")
+    for result in results:
+        connect, tls = result['connect'], result['tls']
+        print(f"  {result['target']:32}{result['samples']:>4}"
+              f"{format_ms(connect[50]):>9}{format_ms(connect[90]):>8}{format_ms(connect[99]):>8}"
+              f"{format_ms(tls[50]):>9}{format_ms(tls[90]):>8}{format_ms(tls[99]):>8}")
+        if result['errors']:
+            print(f"    errors: {result['errors'][-1]} ({len(result['errors'])}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure TCP connect and TLS handshake latency of upstreams.")
+    parser.add_argument('targets', nargs='+', metavar='HOST[:PORT]')
+    parser.add_argument('--count', type=int, default=5, help="probes per upstream")
+    parser.add_argument('--timeout', type=float, default=5.0)
+    parser.add_argument('--insecure', action='store_true', help="do not verify certificates")
+    parser.add_argument('--cafile', help="CA bundle to verify against (e.g. for local test servers)")
+    args = parser.parse_args()
+
+    results = probe(args.targets, args.count, timeout=args.timeout, insecure=args.insecure, cafile=args.cafile)
+    print_results(results)
+    if not any(result['samples'] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
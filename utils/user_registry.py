@@ -0,0 +1,214 @@
+#!/usr/bin/python3
+
+import argparse
+import csv
+import json
+import sqlite3
+import sys
+import uuid
+
+from cidr_compiler import load_config, save_config
+
+DEFAULT_DB = './users.db'
+CLIENT_PROTOCOLS = ('vless', 'vmess', 'trojan')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    uuid TEXT NOT NULL,
+    email TEXT NOT NULL,
+    level INTEGER NOT NULL DEFAULT 0,
+    flow TEXT NOT NULL DEFAULT '',
+    enabled INTEGER NOT NULL DEFAULT 1,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE UNIQUE INDEX IF NOT EXISTS users_uuid ON users (uuid);
+CREATE UNIQUE INDEX IF NOT EXISTS users_email ON users (email);
+"""
+
+
+def normalize_user(row):
+    email = (row.get('email') or '').strip()
+    if not email:
+        raise ValueError(f"User without email: {row}")
+    user_uuid = (row.get('uuid') or row.get('id') or '').strip() or str(uuid.uuid4())
+    user_uuid = str(uuid.UUID(user_uuid))
+    enabled = row.get('enabled', 1)
+    if isinstance(enabled, str):
+        enabled = enabled.strip().lower() not in ('0', 'false', 'no', '')
+    return (user_uuid, email, int(row.get('level') or 0), (row.get('flow') or '').strip(),
+            1 if enabled else 0)
+
+
+def read_users_file(file_path):
+    # CSV with a header row (email[,uuid,level,flow,enabled]) or a JSON list
+    # of objects with the same keys.
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        if file_path.endswith('.json'):
+            yield from json.load(f)
+        else:
+            yield from csv.DictReader(f)
+
+
+class UserRegistry:
+
+    def __init__(self, db_path=DEFAULT_DB):
+        self.db = sqlite3.connect(db_path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def import_users(self, rows):
+        # One transaction for the whole batch; existing emails are updated.
+        users = [normalize_user(row) for row in rows]
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO users (uuid, email, level, flow, enabled) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (email) DO UPDATE SET uuid = excluded.uuid, level = excluded.level, "
+                "flow = excluded.flow, enabled = excluded.enabled",
+                users)
+        return len(users)
+
+    def add_user(self, email, user_uuid=None, level=0, flow=''):
+        self.import_users([{'email': email, 'uuid': user_uuid, 'level': level, 'flow': flow}])
+        return self.get_user(email)
+
+    def get_user(self, key):
+        return self.db.execute(
+            "SELECT * FROM users WHERE email = ? OR uuid = ?", (key, key)).fetchone()
+
+    def remove_users(self, keys):
+        with self.db:
+            removed = 0
+            for key in keys:
+                removed += self.db.execute(
+                    "DELETE FROM users WHERE email = ? OR uuid = ?", (key, key)).rowcount
+        return removed
+
+    def set_enabled(self, keys, enabled):
+        with self.db:
+            self.db.executemany(
+                "UPDATE users SET enabled = ? WHERE email = ? OR uuid = ?",
+                [(1 if enabled else 0, key, key) for key in keys])
+
+    def users(self, enabled_only=True):
+        query = "SELECT * FROM users"
+        if enabled_only:
+            query += " WHERE enabled = 1"
+        return self.db.execute(query + " ORDER BY id")
+
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+
+def build_clients(users):
+    return [{'id': user['uuid'], 'email': user['email'], 'level': user['level'], 'flow': user['flow']}
+            for user in users]
+
+
+def client_inbounds(config, selectors=None):
+    for index, inbound in enumerate(config.get('inbounds', [])):
+        if inbound.get('protocol') not in CLIENT_PROTOCOLS:
+            continue
+        if selectors and str(index) not in selectors and inbound.get('tag') not in selectors:
+            continue
+        yield inbound
+
+
+def render_clients(config, clients, selectors=None):
+    # Every selected inbound gets the full clients array. Fields of the
+    # template's first client that users do not set (e.g. xtls flow) are kept.
+    # Clients without an email are not registry users but the template's own,
+    # such as the UPSTREAM-UUID a bridge authenticates with; they stay first.
+    user_ids = {client['id'] for client in clients}
+    for inbound in client_inbounds(config, selectors):
+        settings = inbound.setdefault('settings', {})
+        template = (settings.get('clients') or [{}])[0]
+        defaults = {k: v for k, v in template.items() if k not in ('id', 'email', 'level', 'password')}
+        protocol = inbound['protocol']
+        key = 'password' if protocol == 'trojan' else 'id'
+        rendered = [client for client in settings.get('clients', [])
+                    if not client.get('email') and client.get(key) not in user_ids]
+        for client in clients:
+            entry = dict(defaults)
+            if protocol == 'trojan':
+                entry['password'] = client['id']
+            else:
+                entry['id'] = client['id']
+            entry['email'] = client['email']
+            entry['level'] = client['level']
+            if client['flow']:
+                entry['flow'] = client['flow']
+            if protocol == 'vmess':
+                entry.pop('flow', None)
+            rendered.append(entry)
+        settings['clients'] = rendered
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage Xray users and render them into config files.")
+    parser.add_argument('--db', default=DEFAULT_DB, help=f"SQLite database (default: {DEFAULT_DB})")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('add', help="add or update a user")
+    add.add_argument('email')
+    add.add_argument('--uuid')
+    add.add_argument('--level', type=int, default=0)
+    add.add_argument('--flow', default='')
+
+    bulk = commands.add_parser('import', help="bulk import users from CSV or JSON")
+    bulk.add_argument('files', nargs='+')
+
+    remove = commands.add_parser('remove', help="delete users by email or UUID")
+    remove.add_argument('keys', nargs='+')
+
+    for name, text in (('enable', "enable users"), ('disable', "disable users without deleting them")):
+        toggle = commands.add_parser(name, help=text)
+        toggle.add_argument('keys', nargs='+')
+
+    listing = commands.add_parser('list', help="print users as CSV")
+    listing.add_argument('--all', action='store_true', help="include disabled users")
+
+    render = commands.add_parser('render', help="write the clients arrays of config files")
+    render.add_argument('configs', nargs='+')
+    render.add_argument('--inbound', action='append',
+                        help="inbound tag or index to render into (default: every vless/vmess/trojan inbound)")
+    args = parser.parse_args()
+
+    registry = UserRegistry(args.db)
+    try:
+        if args.command == 'add':
+            user = registry.add_user(args.email, args.uuid, args.level, args.flow)
+            print(f"{user['email']}: {user['uuid']}")
+        elif args.command == 'import':
+            for file_path in args.files:
+                count = registry.import_users(read_users_file(file_path))
+                print(f">> Imported {count} users from {file_path}")
+            print(f">> Registry now holds {registry.count()} users.")
+        elif args.command == 'remove':
+            print(f">> Removed {registry.remove_users(args.keys)} users.")
+        elif args.command in ('enable', 'disable'):
+            registry.set_enabled(args.keys, args.command == 'enable')
+        elif args.command == 'list':
+            writer = csv.writer(sys.stdout)
+            writer.writerow(['email', 'uuid', 'level', 'flow', 'enabled'])
+            for user in registry.users(not args.all):
+                writer.writerow([user['email'], user['uuid'], user['level'], user['flow'], user['enabled']])
+        elif args.command == 'render':
+            clients = build_clients(registry.users())
+            for config_path in args.configs:
+                config = render_clients(load_config(config_path), clients, args.inbound)
+                save_config(config, config_path)
+                print(f">> Rendered {len(clients)} clients into {config_path}")
+    except (ValueError, sqlite3.IntegrityError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    finally:
+        registry.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,408 @@
+#!/usr/bin/python3
+
+import argparse
+import sys
+import time
+from concurrent import futures
+
+from cidr_compiler import load_config, save_config
+from render import copy_tree
+from user_registry import DEFAULT_DB, UserRegistry, build_clients, client_inbounds, render_clients
+
+try:
+    import grpc
+except ImportError:
+    grpc = None
+
+API_TAG = 'api'
+API_PORT = 10085
+DEFAULT_SERVER = f'127.0.0.1:{API_PORT}'
+# The API is unauthenticated and can add and remove users. Docker forwards
+# a published port to the container's network address, which a 127.0.0.1
+# bind would refuse, so on a bridge network the inbound listens on every
+# container interface and docker-compose publishes it on the host's
+# loopback only. Other containers of the same compose network (Caddy) can
+# still reach it; with host networking use 127.0.0.1 (`enable --listen`,
+# or compose.py's performance profile, which moves it there).
+API_LISTEN = '0.0.0.0'
+BATCH_SIZE = 100
+HANDLER_SERVICE = 'xray.app.proxyman.command.HandlerService'
+STATS_SERVICE = 'xray.app.stats.command.StatsService'
+ADD_USER = 'xray.app.proxyman.command.AddUserOperation'
+REMOVE_USER = 'xray.app.proxyman.command.RemoveUserOperation'
+ACCOUNT_TYPES = {
+    'vless': 'xray.proxy.vless.Account',
+    'vmess': 'xray.proxy.vmess.Account',
+    'trojan': 'xray.proxy.trojan.Account',
+}
+
+
+# Minimal protobuf wire format: the API messages are small and fixed, so they
+# are encoded by hand instead of shipping generated Xray stubs.
+
+def encode_varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def encode_field(number, value):
+    # Proto3 omits default values; ints are varints, str/bytes are length-delimited.
+    if not value:
+        return b''
+    if isinstance(value, int):
+        return encode_varint(number << 3) + encode_varint(value)
+    if isinstance(value, str):
+        value = value.encode()
+    return encode_varint(number << 3 | 2) + encode_varint(len(value)) + value
+
+
+def encode_message(*fields):
+    return b''.join(encode_field(number, value) for number, value in fields)
+
+
+def decode_message(data):
+    # Returns {field number: [values]}; length-delimited values stay bytes.
+    fields = {}
+    pos = 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = _read_varint(data, pos)
+        elif wire_type == 2:
+            length, pos = _read_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        elif wire_type == 1:
+            value, pos = data[pos:pos + 8], pos + 8
+        elif wire_type == 5:
+            value, pos = data[pos:pos + 4], pos + 4
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+        fields.setdefault(number, []).append(value)
+    return fields
+
+
+def _read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _first(fields, number, default=b''):
+    return fields.get(number, [default])[0]
+
+
+def typed_message(type_name, value):
+    return encode_message((1, type_name), (2, value))
+
+
+def encode_user(protocol, client):
+    if protocol == 'trojan':
+        account = encode_message((1, client['id']))
+    elif protocol == 'vless':
+        account = encode_message((1, client['id']), (2, client.get('flow', '')), (3, 'none'))
+    else:
+        account = encode_message((1, client['id']))
+    return encode_message((1, client.get('level', 0)), (2, client['email']),
+                          (3, typed_message(ACCOUNT_TYPES[protocol], account)))
+
+
+def decode_user(data):
+    fields = decode_message(data)
+    account = decode_message(_first(fields, 3))
+    account_fields = decode_message(_first(account, 2))
+    flow = _first(account_fields, 2).decode() if _first(account, 1) == ACCOUNT_TYPES['vless'].encode() else ''
+    return {'id': _first(account_fields, 1).decode(), 'email': _first(fields, 2).decode(),
+            'level': _first(fields, 1, 0), 'flow': flow}
+
+
+def add_user_request(tag, protocol, client):
+    operation = typed_message(ADD_USER, encode_message((1, encode_user(protocol, client))))
+    return encode_message((1, tag), (2, operation))
+
+
+def remove_user_request(tag, email):
+    operation = typed_message(REMOVE_USER, encode_message((1, email)))
+    return encode_message((1, tag), (2, operation))
+
+
+def enable_api(config, services=('HandlerService',), port=API_PORT, listen=API_LISTEN):
+    # Adds the `api` object, its dokodemo-door inbound and the routing rule
+    # that sends the inbound to the API handler. Client inbounds get a tag,
+    # since the API addresses inbounds by tag. Safe to run more than once.
+    api = config.setdefault('api', {'tag': API_TAG, 'services': []})
+    api['services'] = api.get('services', []) + [s for s in services if s not in api.get('services', [])]
+
+    inbounds = config.setdefault('inbounds', [])
+    for inbound in client_inbounds(config):
+        # Inbounds on a Unix socket (see unix_sockets.py) have no port.
+        address = inbound.get('port') or str(inbound.get('listen', '')).lstrip('@').rsplit('/', 1)[-1]
+        inbound.setdefault('tag', f"{inbound['protocol']}-{address}")
+    if not any(inbound.get('tag') == api['tag'] for inbound in inbounds):
+        inbounds.append({'tag': api['tag'], 'listen': listen, 'port': port,
+                         'protocol': 'dokodemo-door', 'settings': {'address': '127.0.0.1'}})
+
+    routing = config.setdefault('routing', {})
+    container = routing['settings'] if 'settings' in routing and 'rules' not in routing else routing
+    rules = container.setdefault('rules', [])
+    if not any(rule.get('inboundTag') == [api['tag']] for rule in rules):
+        # First, so that no destination rule (e.g. geoip:private) catches it.
+        rules.insert(0, {'type': 'field', 'inboundTag': [api['tag']], 'outboundTag': api['tag']})
+    return config
+
+
+class XrayAPI:
+
+    def __init__(self, address=DEFAULT_SERVER, timeout=10.0):
+        if grpc is None:
+            raise RuntimeError("The grpcio module is required (pip install grpcio).")
+        self.channel = grpc.insecure_channel(address)
+        self.timeout = timeout
+        self._methods = {}
+
+    def close(self):
+        self.channel.close()
+
+    def method(self, service, name):
+        # Requests and responses are passed as raw protobuf bytes.
+        path = f'/{service}/{name}'
+        if path not in self._methods:
+            self._methods[path] = self.channel.unary_unary(path)
+        return self._methods[path]
+
+    def inbound_users(self, tag):
+        # Needs Xray 24.12+; older servers answer UNIMPLEMENTED.
+        response = self.method(HANDLER_SERVICE, 'GetInboundUsers')(
+            encode_message((1, tag)), timeout=self.timeout)
+        return [decode_user(user) for user in decode_message(response).get(1, [])]
+
+    def query_stats(self, pattern='', reset=False):
+        # {counter name: value}, e.g. 'user>>>a@b>>>traffic>>>uplink'.
+        response = self.method(STATS_SERVICE, 'QueryStats')(
+            encode_message((1, pattern), (2, int(reset))), timeout=self.timeout)
+        stats = {}
+        for stat in decode_message(response).get(1, []):
+            fields = decode_message(stat)
+            stats[_first(fields, 1).decode()] = _first(fields, 2, 0)
+        return stats
+
+    def alter_inbound(self, requests, batch_size=BATCH_SIZE):
+        # AlterInbound takes one user per call; calls are pipelined on the
+        # channel, batch_size at a time. Returns [(request index, error)].
+        call = self.method(HANDLER_SERVICE, 'AlterInbound')
+        errors = []
+        for start in range(0, len(requests), batch_size):
+            pending = [(index, call.future(request, timeout=self.timeout))
+                       for index, request in enumerate(requests[start:start + batch_size], start)]
+            for index, future in pending:
+                try:
+                    future.result()
+                except grpc.RpcError as e:
+                    errors.append((index, e.details() or str(e.code())))
+        return errors
+
+
+def client_key(client):
+    return client['id'], client.get('level', 0), client.get('flow', '')
+
+
+def diff_users(desired, live):
+    # Users are matched by email, which is how Xray removes them. A changed
+    # UUID, level or flow is applied as remove + add. Users without an email
+    # (the template's own clients, see render_clients) cannot be removed
+    # through the API and stay as they are.
+    live = [user for user in live if user['email']]
+    desired = [client for client in desired if client['email']]
+    live_by_email = {user['email']: user for user in live}
+    desired_by_email = {client['email']: client for client in desired}
+    add = [client for email, client in desired_by_email.items()
+           if email not in live_by_email or client_key(live_by_email[email]) != client_key(client)]
+    remove = [user['email'] for email, user in live_by_email.items()
+              if email not in desired_by_email or client_key(user) != client_key(desired_by_email[email])]
+    return add, remove
+
+
+def config_users(inbound):
+    protocol = inbound['protocol']
+    return [{'id': client.get('password' if protocol == 'trojan' else 'id', ''),
+             'email': client.get('email', ''), 'level': client.get('level', 0),
+             'flow': client.get('flow', '') if protocol == 'vless' else ''}
+            for client in inbound.get('settings', {}).get('clients', [])]
+
+
+def sync(api, config, clients, selectors=None, batch_size=BATCH_SIZE, dry_run=False):
+    # Brings the running inbounds to the desired client set and, when every
+    # call succeeded, renders the same set into `config`.
+    # Returns {tag: (added, removed, errors)}.
+    rendered = render_clients(copy_tree(config), clients, selectors)
+    report = {}
+    for inbound in client_inbounds(rendered, selectors):
+        tag = inbound.get('tag')
+        if not tag:
+            raise ValueError(f"Inbound on port {inbound.get('port')} has no tag; run 'enable' first.")
+        protocol = inbound['protocol']
+        try:
+            live = api.inbound_users(tag)
+        except grpc.RpcError as e:
+            if e.code() != grpc.StatusCode.UNIMPLEMENTED:
+                raise
+            # Older Xray cannot list users; the config on disk is what it runs.
+            live = config_users(next(i for i in config['inbounds'] if i.get('tag') == tag))
+        desired = config_users(inbound)
+        add, remove = diff_users(desired, live)
+        if dry_run:
+            report[tag] = (len(add), len(remove), [])
+            continue
+        # Removals first, so a user whose account changed can be re-added.
+        errors = api.alter_inbound([remove_user_request(tag, email) for email in remove], batch_size)
+        errors += api.alter_inbound([add_user_request(tag, protocol, client) for client in add], batch_size)
+        report[tag] = (len(add), len(remove), [message for _, message in errors])
+    if not dry_run and not any(errors for _, _, errors in report.values()):
+        config.clear()
+        config.update(rendered)
+    return report
+
+
+class StandinHandlerService:
+    # In-memory HandlerService speaking the same wire format as Xray, for
+    # trying `sync` without a running server. Seeded from a config file.
+
+    def __init__(self, config=None):
+        self.inbounds = {}
+        for inbound in client_inbounds(config or {}):
+            if inbound.get('tag'):
+                self.inbounds[inbound['tag']] = {
+                    user['email']: encode_user(inbound['protocol'], user) for user in config_users(inbound)}
+
+    def alter_inbound(self, request, context):
+        fields = decode_message(request)
+        tag = _first(fields, 1).decode()
+        operation = decode_message(_first(fields, 2))
+        users = self.inbounds.get(tag)
+        if users is None:
+            context.abort(grpc.StatusCode.UNKNOWN, f"handler not found: {tag}")
+        kind = _first(operation, 1).decode()
+        body = decode_message(_first(operation, 2))
+        if kind == ADD_USER:
+            user = _first(body, 1)
+            email = decode_user(user)['email']
+            if not email:
+                context.abort(grpc.StatusCode.UNKNOWN, "Email must not be empty.")
+            if email in users:
+                context.abort(grpc.StatusCode.UNKNOWN, f"User {email} already exists.")
+            users[email] = user
+        elif kind == REMOVE_USER:
+            email = _first(body, 1).decode()
+            if not email:
+                context.abort(grpc.StatusCode.UNKNOWN, "Email must not be empty.")
+            if users.pop(email, None) is None:
+                context.abort(grpc.StatusCode.UNKNOWN, f"User {email} not found.")
+        else:
+            context.abort(grpc.StatusCode.UNKNOWN, f"unknown operation: {kind}")
+        return b''
+
+    def get_inbound_users(self, request, context):
+        tag = _first(decode_message(request), 1).decode()
+        users = self.inbounds.get(tag)
+        if users is None:
+            context.abort(grpc.StatusCode.UNKNOWN, f"handler not found: {tag}")
+        return b''.join(encode_field(1, user) for user in users.values())
+
+    def serve(self, address=DEFAULT_SERVER):
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+        server.add_generic_rpc_handlers([grpc.method_handlers_generic_handler(HANDLER_SERVICE, {
+            'AlterInbound': grpc.unary_unary_rpc_method_handler(self.alter_inbound),
+            'GetInboundUsers': grpc.unary_unary_rpc_method_handler(self.get_inbound_users),
+        })])
+        server.add_insecure_port(address)
+        server.start()
+        return server
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Add and remove users on running Xray inbounds through the HandlerService API.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    enable = commands.add_parser('enable', help="add the API inbound and tag client inbounds in config files")
+    enable.add_argument('configs', nargs='+')
+    enable.add_argument('--listen', default=API_LISTEN,
+                        help=f"API inbound address (default: {API_LISTEN}; 127.0.0.1 with host networking)")
+
+    apply = commands.add_parser('sync', help="apply the registry to a running server and its config file")
+    apply.add_argument('config', help="config.json the server was started with")
+    apply.add_argument('--server', default=DEFAULT_SERVER, help=f"API address (default: {DEFAULT_SERVER})")
+    apply.add_argument('--db', default=DEFAULT_DB, help=f"user registry (default: {DEFAULT_DB})")
+    apply.add_argument('--inbound', action='append',
+                       help="inbound tag or index to sync (default: every vless/vmess/trojan inbound)")
+    apply.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="API calls in flight at once")
+    apply.add_argument('--dry-run', action='store_true', help="only print the delta")
+
+    standin = commands.add_parser('standin', help="serve an in-memory HandlerService for testing")
+    standin.add_argument('config', help="config.json to seed the inbounds and users from")
+    standin.add_argument('--listen', default=DEFAULT_SERVER)
+    args = parser.parse_args()
+
+    if args.command == 'enable':
+        for config_path in args.configs:
+            save_config(enable_api(load_config(config_path), listen=args.listen), config_path)
+            print(f">> API enabled in {config_path}")
+        return
+
+    if grpc is None:
+        print("Error: The grpcio module is required (pip install grpcio).")
+        sys.exit(1)
+
+    if args.command == 'standin':
+        server = StandinHandlerService(load_config(args.config)).serve(args.listen)
+        print(f">> Stand-in HandlerService listening on {args.listen}")
+        try:
+            server.wait_for_termination()
+        except KeyboardInterrupt:
+            server.stop(0)
+        return
+
+    registry = UserRegistry(args.db)
+    try:
+        clients = build_clients(registry.users())
+    finally:
+        registry.close()
+    config = load_config(args.config)
+    api = XrayAPI(args.server)
+    start = time.perf_counter()
+    try:
+        report = sync(api, config, clients, args.inbound, args.batch_size, args.dry_run)
+    except (ValueError, grpc.RpcError) as e:
+        print(f"Error: {e.details() if isinstance(e, grpc.RpcError) else e}")
+        sys.exit(1)
+    finally:
+        api.close()
+    elapsed = time.perf_counter() - start
+
+    failed = False
+    for tag, (added, removed, errors) in report.items():
+        print(f"  {tag:24} +{added} -{removed}" + (f"  {len(errors)} failed: {errors[0]}" if errors else ''))
+        failed = failed or bool(errors)
+    if args.dry_run:
+        return
+    if failed:
+        print(f"Error: Some API calls failed; {args.config} was not changed. Run sync again.")
+        sys.exit(1)
+    save_config(config, args.config)
+    print(f">> Synced {len(clients)} users in {elapsed:.2f}s; {args.config} updated.")
+
+
+if __name__ == "__main__":
+    main()
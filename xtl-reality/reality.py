@@ -2,10 +2,12 @@
 
 import json
 import uuid
-import re
 import os
 import sys
-import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from reality_keys import apply_reality, generate_keypair, mint_short_ids, short_id_labels
+from render import RenderError, dumps, render_text
 
 
 def load_file(file_path):
@@ -36,58 +38,48 @@ def prompt_uuid(label):
                 f"Invalid UUID for {label}. Please try again or leave it empty to generate one.")
 
 
-def update_config_and_docker_compose_file(config_path, docker_compose_path):
+def update_config_and_docker_compose_file(config_path, docker_compose_path, private_key, public_key, short_ids):
     config = load_file(config_path)
     print(f"Original config: \n{config}\n")
 
     upstream_uuid = prompt_uuid("upstream")
-    updated_config = update_config(config, upstream_uuid)
-    print(f"Updated config: \n{updated_config}\n")
-
-    save_file(updated_config, config_path)
-
-    print("Configuration updated successfully.")
-
-
-def run_command(command):
     try:
-        subprocess.run(command, shell=True, check=True)
-    except subprocess.CalledProcessError as e:
+        updated_config = update_config(
+            config, upstream_uuid, None, None, private_key, public_key, short_ids[0])
+    except RenderError as e:
         print(f"Error: {e}")
         sys.exit(1)
+    if len(short_ids) > 1:
+        # The template has one <SHORT-ID> slot; the rest go into the list.
+        rendered = json.loads(updated_config)
+        apply_reality(rendered, short_ids=short_ids)
+        updated_config = dumps(rendered)
+    print(f"Updated config: \n{updated_config}\n")
 
+    save_file(updated_config, config_path)
 
-def generate_keys(container_name):
-    print("Generating private and public keys...")
-    run_command(
-        f"docker exec {container_name} /bin/sh -c 'openssl genpkey -algorithm RSA -out /app/private_key.pem -pkeyopt rsa_keygen_bits:2048'")
-    run_command(
-        f"docker exec {container_name} /bin/sh -c 'openssl rsa -pubout -in /app/private_key.pem -out /app/public_key.pem'")
-    print("Private and public keys generated successfully.")
-
-
-def generate_x25519_keys():
-    result = subprocess.run(
-        "docker exec gen_keys /usr/bin/xray x25519", shell=True, capture_output=True, text=True)
-    output = result.stdout.strip()
-    print(f"Generated X25519 keys:\n{output}")
-    return output
+    print("Configuration updated successfully.")
 
 
-def generate_short_id():
-    result = subprocess.run(
-        "openssl rand -hex 8", shell=True, capture_output=True, text=True)
-    short_id = result.stdout.strip()
-    print(f"Generated short ID: {short_id}")
-    return short_id
+def prompt_short_id_count():
+    while True:
+        count = input(
+            "Enter the number of shortIds to generate or leave it empty for one: ").strip()
+        if not count:
+            return 1
+        if count.isdigit() and int(count) > 0:
+            return int(count)
+        print("Invalid number. Please enter a positive integer.")
 
 
 def update_config(config, upstream_uuid, bridge_uuid, outbound_domain, private_key, public_key, short_id):
-    config = re.sub(r'<UPSTREAM-UUID>', upstream_uuid, config)
-    config = re.sub(r'<PRIVATE-KEY>', private_key, config)
-    config = re.sub(r'<PUBLIC-KEY>', public_key, config)
-    config = re.sub(r'<SHORT-ID>', short_id, config)
-    return config
+    values = {
+        'UPSTREAM-UUID': upstream_uuid,
+        'PRIVATE-KEY': private_key,
+        'PUBLIC-KEY': public_key,
+        'SHORT-ID': short_id,
+    }
+    return render_text(config, values)
 
 
 def main():
@@ -101,25 +93,19 @@ def main():
     if not docker_compose_path:
         docker_compose_path = "./docker-compose.yml"
 
-    update_config_and_docker_compose_file(config_path, docker_compose_path)
-
-    container_name = input(
-        "Enter the name of the container where the keys will be generated: ").strip()
-
-    if not container_name:
-        print("Error: Container name is required.")
-        sys.exit(1)
-
-    generate_keys(container_name)
-    # Generate X25519 keys
-    x25519_keys = generate_x25519_keys()
+    # X25519 keys and shortIds are generated in-process (see utils/reality_keys.py).
+    private_key, public_key = generate_keypair()
+    print(f"Generated X25519 keys:\nPrivate key: {private_key}\nPublic key: {public_key}")
     with open("x25519_keys.txt", "w") as keys_file:
-        keys_file.write(x25519_keys)
+        keys_file.write(f"Private key: {private_key}\nPublic key: {public_key}\n")
 
-    # Generate short ID
-    short_id = generate_short_id()
+    short_ids = list(mint_short_ids(short_id_labels(prompt_short_id_count())).values())
+    print(f"Generated short IDs: {', '.join(short_ids)}")
     with open("short_id.txt", "w") as short_id_file:
-        short_id_file.write(short_id)
+        short_id_file.write('\n'.join(short_ids) + '\n')
+
+    update_config_and_docker_compose_file(
+        config_path, docker_compose_path, private_key, public_key, short_ids)
 
 
 if __name__ == "__main__":